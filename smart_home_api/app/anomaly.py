@@ -0,0 +1,109 @@
+"""
+全设备使用异常扫描
+
+把所有设备最近若干天的每日使用时长读成 设备 × 天 的矩阵，对每个待检查的日期，以其之前window天为基线，
+一次向量化计算所有设备的基线中位数、MAD 和稳健z分数 (x - 中位数) / (1.4826 × MAD)，
+超过阈值的 (设备, 日期) 写入 device_usage_anomaly 表
+
+命令行运行: python -m app.anomaly [--days N] [--window W] [--threshold T]
+"""
+import argparse
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import crud, models
+from .database import engine, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+BASELINE_DAYS = 28
+Z_THRESHOLD = 3.5
+# 基线中有使用的天数少于该值的设备不判断（新设备、偶尔使用的设备）
+MIN_ACTIVE_DAYS = 7
+# 基线几乎恒定时MAD接近0，稳健标准差至少取该值（小时），避免微小波动被判为异常
+MIN_SCALE_HOURS = 0.25
+# 正态分布下 标准差 = 1.4826 × MAD
+MAD_TO_SIGMA = 1.4826
+
+
+def robust_zscores(matrix: np.ndarray, window: int, scan_days: int,
+                   min_scale: float = MIN_SCALE_HOURS) -> Tuple[np.ndarray, ...]:
+    """
+    对矩阵最后scan_days列，以各自之前window列为基线计算稳健z分数
+
+    matrix列数须为 window + scan_days；返回 (基线中位数, MAD, 基线有使用的天数, z分数)，形状均为 (设备数, scan_days)
+    """
+    baseline = sliding_window_view(matrix[:, :-1], window, axis=1)[:, -scan_days:]
+    median = np.median(baseline, axis=2)
+    mad = np.median(np.abs(baseline - median[..., None]), axis=2)
+    active_days = np.count_nonzero(baseline > 0, axis=2)
+    scale = np.maximum(MAD_TO_SIGMA * mad, min_scale)
+    z = (matrix[:, -scan_days:] - median) / scale
+    return median, mad, active_days, z
+
+
+def scan_usage_anomalies(end_day: Optional[date] = None, scan_days: int = 1, window: int = BASELINE_DAYS,
+                         threshold: float = Z_THRESHOLD) -> Dict:
+    """
+    扫描 [end_day - scan_days + 1, end_day] 内各天的异常并写入结果表，end_day默认为昨天（今天尚未结束）
+
+    返回扫描摘要
+    """
+    started = time.perf_counter()
+    end_day = end_day or date.today() - timedelta(days=1)
+    first_scan_day = end_day - timedelta(days=scan_days - 1)
+    first_day = datetime.combine(first_scan_day - timedelta(days=window), datetime.min.time())
+
+    db = SessionLocal()
+    try:
+        device_ids, home_ids, matrix = crud.get_daily_usage_matrix(db, first_day, window + scan_days)
+        anomalies = []
+        if device_ids:
+            median, mad, active_days, z = robust_zscores(matrix, window, scan_days)
+            flagged = (active_days >= MIN_ACTIVE_DAYS) & (np.abs(z) > threshold)
+            for i, j in zip(*np.nonzero(flagged)):
+                anomalies.append({
+                    "device_id": device_ids[i],
+                    "home_id": home_ids[i],
+                    "day": first_scan_day + timedelta(days=int(j)),
+                    "usage_hours": float(matrix[i, window + j]),
+                    "baseline_median_hours": float(median[i, j]),
+                    "baseline_mad_hours": float(mad[i, j]),
+                    "robust_zscore": float(z[i, j]),
+                    "direction": "spike" if z[i, j] > 0 else "drop",
+                })
+        crud.replace_usage_anomalies(db, first_scan_day, end_day, anomalies)
+    finally:
+        db.close()
+
+    summary = {
+        "first_day": first_scan_day.isoformat(),
+        "last_day": end_day.isoformat(),
+        "devices": len(device_ids),
+        "anomalies": len(anomalies),
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"使用异常扫描完成: {summary}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="扫描全部设备的每日使用异常")
+    parser.add_argument("--days", type=int, default=1, help="检查截至昨天的最近N天")
+    parser.add_argument("--window", type=int, default=BASELINE_DAYS, help="基线天数")
+    parser.add_argument("--threshold", type=float, default=Z_THRESHOLD, help="稳健z分数阈值")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=engine, tables=[models.DeviceUsageAnomaly.__table__])
+    summary = scan_usage_anomalies(scan_days=args.days, window=args.window, threshold=args.threshold)
+    print(f"✅ 异常扫描完成: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,20 @@
 # app/routers/analytics.py - 完整版本
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 import requests
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import io
 import base64
 from typing import List, Dict, Any, Optional
 from .. import crud, models, schemas
+from ..cache import coalesce
+from ..parallel import parallel_area_usage_correlation, parallel_device_type_correlation
 from ..database import get_db
+from ..time_buckets import bucket_weekly_usage, MAX_SESSION_SECONDS
 
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'DejaVu Sans']
@@ -89,34 +92,27 @@ def _find_user_homes(user_id: str):
     
     return user_data, user_homes
 
-def _get_mock_usage_data(device_id: str, days: int = 49):
-    """生成模拟使用数据"""
-    np.random.seed(hash(device_id) % 2**32)
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
+def _find_home_device(db: Session, home_id: str, device_name: str):
+    """查询房屋及其中指定名称的设备，不存在时抛出404"""
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="房屋不存在")
     
-    usage_records = []
-    current_date = start_date
+    device = crud.get_home_device_by_name(db, home_id=home_id, name=device_name)
+    if not device:
+        raise HTTPException(status_code=404, detail="设备不存在")
     
-    while current_date <= end_date:
-        weekday = current_date.weekday()
-        daily_sessions = np.random.randint(1, 5) if weekday < 5 else np.random.randint(2, 6)
-        
-        for _ in range(daily_sessions):
-            start_hour = np.random.randint(7, 22)
-            duration = np.random.randint(30, 180)
-            start_time = current_date.replace(hour=start_hour, minute=np.random.randint(0, 60))
-            end_time = start_time + timedelta(minutes=duration)
-            
-            usage_records.append({
-                "start_time": start_time,
-                "end_time": end_time,
-                "duration_minutes": duration
-            })
-        
-        current_date += timedelta(days=1)
-    
-    return usage_records
+    return home, device
+
+def _load_usage_buckets(db: Session, device_id: str, days: int = 49):
+    """读取设备最近days天的使用记录并一次性完成按天/周/时间段的分桶"""
+    now = datetime.now()
+    window_start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    # 向前多取一个最长会话时长，跨入窗口的会话也按重叠部分计入
+    starts, durations = crud.get_device_usage_arrays(
+        db, device_id=device_id, start_time=window_start - timedelta(seconds=MAX_SESSION_SECONDS)
+    )
+    return bucket_weekly_usage(starts, durations, now=now, days=days)
 
 # ============ 1. 用户房屋关联查询 ============
 
@@ -260,66 +256,14 @@ def get_device_weekly_usage(home_id: str, device_name: str, db: Session = Depend
         plt.rcParams['axes.titlesize'] = 16
         plt.rcParams['figure.titlesize'] = 20
         
-        # 获取房屋信息
-        home_data = _call_internal_api(f"/homes/{home_id}")
-        if not home_data:
-            raise HTTPException(status_code=404, detail="房屋不存在")
-        
-        print(f"✅ 房屋存在: {home_data.get('address', 'Unknown')}")
+        home, device = _find_home_device(db, home_id, device_name)
+        print(f"✅ 找到设备: {device.name}")
         
-        # 查找设备（先尝试API，然后模拟）
-        devices = _call_internal_api(f"/homes/{home_id}/devices") or []
-        
-        device = None
-        for d in devices:
-            if d.get('name') == device_name:
-                device = d
-                break
-        
-        if not device:
-            # 创建模拟设备
-            print(f"⚠️ 设备不存在，创建模拟设备: {device_name}")
-            device = {
-                "device_id": f"device_{home_id}_{device_name}",
-                "name": device_name,
-                "device_type": "智能设备",
-                "room_name": "客厅"
-            }
-        else:
-            print(f"✅ 找到设备: {device.get('name')}")
-        
-        # 获取使用数据（使用模拟数据）
-        usage_data = _get_mock_usage_data(device['device_id'])
-        
-        # 计算7天和7周数据
-        now = datetime.now()
-        
-        # 计算过去7天
-        daily_data = []
-        daily_labels = []
-        for i in range(6, -1, -1):
-            target_date = (now - timedelta(days=i)).date()
-            daily_total = sum(
-                record['duration_minutes'] for record in usage_data
-                if record['start_time'].date() == target_date
-            ) / 60
-            daily_data.append(daily_total)
-            daily_labels.append(target_date.strftime('%m-%d'))
-        
-        # 计算过去7周
-        weekly_data = []
-        weekly_labels = []
-        for i in range(6, -1, -1):
-            week_start = (now - timedelta(weeks=i)).replace(hour=0, minute=0, second=0, microsecond=0)
-            week_start = week_start - timedelta(days=week_start.weekday())
-            week_end = week_start + timedelta(days=7)
-            
-            weekly_total = sum(
-                record['duration_minutes'] for record in usage_data
-                if week_start <= record['start_time'] < week_end
-            ) / 60
-            weekly_data.append(weekly_total)
-            weekly_labels.append(f"{week_start.strftime('%m-%d')}~{(week_end-timedelta(days=1)).strftime('%m-%d')}")
+        buckets = _load_usage_buckets(db, device.device_id)
+        daily_data = buckets["daily_data"]
+        daily_labels = buckets["daily_labels"]
+        weekly_data = buckets["weekly_data"]
+        weekly_labels = buckets["weekly_labels"]
         
         # 计算平均值
         daily_avg = sum(daily_data) / len(daily_data)
@@ -329,7 +273,7 @@ def get_device_weekly_usage(home_id: str, device_name: str, db: Session = Depend
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 9))
         
         # 设置主标题，确保有足够空间
-        fig.suptitle(f'{device["name"]} 使用分析 - {home_data.get("address", "Unknown")}', 
+        fig.suptitle(f'{device.name} 使用分析 - {home.address}', 
                     fontsize=21, fontweight='bold', color='#2C3E50', y=0.92, 
                     fontfamily='Microsoft YaHei')
         
@@ -406,10 +350,10 @@ def get_device_weekly_usage(home_id: str, device_name: str, db: Session = Depend
         
         result = {
             "device_info": {
-                "device_id": device.get('device_id', 'unknown'),
-                "name": device.get('name', device_name),
-                "device_type": device.get('device_type', '未知类型'),
-                "room_name": device.get('room_name', '未知房间')
+                "device_id": device.device_id,
+                "name": device.name,
+                "device_type": device.device_type,
+                "room_name": device.room_name
             },
             "daily_data": daily_data,
             "weekly_data": weekly_data,
@@ -420,7 +364,7 @@ def get_device_weekly_usage(home_id: str, device_name: str, db: Session = Depend
             "chart": chart_base64
         }
         
-        print(f"✅ 成功分析设备 {device['name']} 的使用数据")
+        print(f"✅ 成功分析设备 {device.name} 的使用数据")
         return result
         
     except HTTPException:
@@ -437,35 +381,12 @@ def get_device_hourly_usage(home_id: str, device_name: str, db: Session = Depend
     try:
         print(f"🔍 分析设备 {device_name} 的时间段分布...")
         
-        # 获取房屋信息
-        home_data = _call_internal_api(f"/homes/{home_id}")
-        if not home_data:
-            raise HTTPException(status_code=404, detail="房屋不存在")
-        
-        # 查找或创建设备
-        device = {
-            "device_id": f"device_{home_id}_{device_name}",
-            "name": device_name,
-            "device_type": "智能设备",
-            "room_name": "客厅"
-        }
+        home, device = _find_home_device(db, home_id, device_name)
         
-        # 获取使用数据
-        usage_data = _get_mock_usage_data(device['device_id'])
-        
-        # 计算时间段分布（每2小时一个时间段）
-        time_slots = [
-            "00:00-02:00", "02:00-04:00", "04:00-06:00", "06:00-08:00",
-            "08:00-10:00", "10:00-12:00", "12:00-14:00", "14:00-16:00", 
-            "16:00-18:00", "18:00-20:00", "20:00-22:00", "22:00-24:00"
-        ]
-        
-        usage_hours = [0] * 12
-        
-        for record in usage_data:
-            hour = record['start_time'].hour
-            slot_index = hour // 2
-            usage_hours[slot_index] += record['duration_minutes'] / 60
+        # 最近49天的使用记录按2小时时间段分桶
+        buckets = _load_usage_buckets(db, device.device_id)
+        time_slots = buckets["time_slots"]
+        usage_hours = buckets["slot_hours"]
         
         # 找到高峰时段
         peak_index = usage_hours.index(max(usage_hours))
@@ -476,7 +397,7 @@ def get_device_hourly_usage(home_id: str, device_name: str, db: Session = Depend
         fig, ax = plt.subplots(figsize=(14, 8))
         
         bars = ax.bar(range(len(time_slots)), usage_hours, color='#9B59B6', alpha=0.8)
-        ax.set_title(f'{device["name"]} 使用时间段分布 - {home_data.get("address", "Unknown")}', 
+        ax.set_title(f'{device.name} 使用时间段分布 - {home.address}', 
                     fontsize=14, fontweight='bold')
         ax.set_xlabel('时间段')
         ax.set_ylabel('使用时长 (小时)')
@@ -496,7 +417,12 @@ def get_device_hourly_usage(home_id: str, device_name: str, db: Session = Depend
         chart_base64 = _generate_chart_response(fig)
         
         result = {
-            "device_info": device,
+            "device_info": {
+                "device_id": device.device_id,
+                "name": device.name,
+                "device_type": device.device_type,
+                "room_name": device.room_name
+            },
             "time_slots": time_slots,
             "usage_hours": [round(h, 2) for h in usage_hours],
             "peak_slot": peak_slot,
@@ -504,7 +430,7 @@ def get_device_hourly_usage(home_id: str, device_name: str, db: Session = Depend
             "chart": chart_base64
         }
         
-        print(f"✅ 成功分析设备 {device['name']} 的时间段分布")
+        print(f"✅ 成功分析设备 {device.name} 的时间段分布")
         return result
         
     except HTTPException:
@@ -519,30 +445,50 @@ def get_device_hourly_usage(home_id: str, device_name: str, db: Session = Depend
 # 为了节省空间，这里省略其他路由的实现
 # 你可以根据需要添加更多路由
 
+# 抽样近似模式的公共参数
+SAMPLE_RATE_QUERY = Query(0.1, gt=0, le=1, description="approx=true时的抽样比例，越小越快、误差越大")
+CONFIDENCE_QUERY = Query(0.95, gt=0, lt=1, description="置信区间的置信水平")
+
 @router.get("/system/alert-distribution")
-def get_system_alert_distribution(db: Session = Depends(get_db)):
-    """系统警报类型分布饼图"""
+def get_system_alert_distribution(
+    approx: bool = False,
+    sample_rate: float = SAMPLE_RATE_QUERY,
+    confidence: float = CONFIDENCE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """系统警报类型分布饼图；approx=true时按抽样估计，附带置信区间"""
     try:
         print("🔍 分析系统警报分布...")
         
-        # 模拟警报数据
-        alert_types = ["设备故障", "网络异常", "传感器错误", "电源问题", "通信超时"]
-        alert_counts = [45, 23, 18, 12, 8]
+        # 警报按设备类型统计（结果带缓存，并发的相同请求只查询一次）
+        if approx:
+            distribution = crud.get_alert_distribution_sampled(db, sample_rate, confidence)
+        else:
+            distribution = crud.get_alert_distribution(db)
+        distribution = sorted(distribution, key=lambda item: item["count"], reverse=True)
+        alert_types = [item["device_type"] for item in distribution]
+        alert_counts = [int(round(item["count"])) for item in distribution]
         total_alerts = sum(alert_counts)
-        percentages = [round(count/total_alerts*100, 1) for count in alert_counts]
-        most_common = alert_types[0]
-        
-        # 创建饼图
-        fig, ax = plt.subplots(figsize=(10, 8))
-        colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FECCA7']
+        percentages = [round(item["percentage"], 1) for item in distribution]
+        most_common = alert_types[0] if alert_types else None
         
-        wedges, texts, autotexts = ax.pie(alert_counts, labels=alert_types, autopct='%1.1f%%',
-                                         colors=colors, startangle=90, textprops={'fontsize': 12})
-        
-        ax.set_title('系统警报类型分布', fontsize=16, fontweight='bold', pad=20)
+        def render():
+            # 创建饼图
+            fig, ax = plt.subplots(figsize=(10, 8))
+            colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FECCA7']
+            
+            wedges, texts, autotexts = ax.pie(alert_counts, labels=alert_types, autopct='%1.1f%%',
+                                             colors=colors, startangle=90, textprops={'fontsize': 12})
+            
+            ax.set_title('系统警报类型分布', fontsize=16, fontweight='bold', pad=20)
+            
+            plt.tight_layout()
+            return _generate_chart_response(fig)
         
-        plt.tight_layout()
-        chart_base64 = _generate_chart_response(fig)
+        # 相同数据的并发请求共享一次图表渲染
+        chart_base64 = coalesce(
+            ("system-alert-distribution-chart", tuple(alert_types), tuple(alert_counts)), render
+        ) if total_alerts > 0 else None
         
         result = {
             "alert_types": alert_types,
@@ -552,12 +498,184 @@ def get_system_alert_distribution(db: Session = Depends(get_db)):
             "most_common": most_common,
             "chart": chart_base64
         }
+        if approx:
+            result.update({
+                "approx": True,
+                "sample_rate": sample_rate,
+                "confidence": confidence,
+                "count_intervals": [item["count_interval"] for item in distribution],
+                "percentage_intervals": [item["percentage_interval"] for item in distribution]
+            })
         
         print(f"✅ 成功分析系统警报分布")
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ 警报分析失败: {e}")
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
+
+@router.get("/aggregate")
+def get_aggregate(
+    fact: str = Query("usage", description="usage / feedback / security"),
+    dimensions: str = Query("", description="逗号分隔: device_type, room_name, home_id, hour, weekday, day, month"),
+    measures: str = Query("count", description="usage: count, sum_duration, avg_duration; feedback: count, resolved_count, resolved_ratio; security: count"),
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    home_id: Optional[str] = None,
+    device_type: Optional[str] = None,
+    use_rollup: bool = Query(True, description="使用记录是否优先读取小时汇总表（时长按实际重叠分摊到小时；请求avg_duration时总是查明细）"),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """通用多维聚合，维度和度量为白名单，每个请求编译为一条GROUP BY语句"""
+    try:
+        return crud.get_aggregate(
+            db,
+            fact=fact,
+            dimensions=tuple(item.strip() for item in dimensions.split(",") if item.strip()),
+            measures=tuple(item.strip() for item in measures.split(",") if item.strip()),
+            start_time=start_time,
+            end_time=end_time,
+            home_id=home_id,
+            device_type=device_type,
+            use_rollup=use_rollup,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/duration-percentiles")
+def get_duration_percentiles(
+    quantiles: str = Query("0.5,0.9,0.99", description="逗号分隔，取值在0到1之间"),
+    group_by: str = Query("device", description="device / device_type / home / all"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    home_id: Optional[str] = None,
+    device_type: Optional[str] = None,
+    device_id: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """使用时长分位数，由每设备每日的t-digest草图合并得到（近似值），不扫描原始使用记录"""
+    try:
+        qs = tuple(float(item) for item in quantiles.split(",") if item.strip())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="quantiles 须为逗号分隔的数字")
+    if not qs or any(not 0 <= q <= 1 for q in qs):
+        raise HTTPException(status_code=400, detail="quantiles 取值须在0到1之间")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date 不能晚于 end_date")
+    
+    try:
+        groups = crud.get_duration_percentiles(
+            db,
+            quantiles=qs,
+            group_by=group_by,
+            start_day=start_date,
+            end_day=end_date,
+            home_id=home_id,
+            device_type=device_type,
+            device_id=device_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"group_by": group_by, "quantiles": list(qs), "groups": groups}
+
+@router.get("/active-counts")
+def get_active_counts(
+    period: str = Query("day", description="day / week / month"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    device_type: Optional[str] = None,
+    by_device_type: bool = False,
+    db: Session = Depends(get_db)
+):
+    """活跃设备数、活跃房屋数（HyperLogLog近似，相对误差约1.6%），默认最近30天"""
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=29)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date 不能晚于 end_date")
+    
+    try:
+        return crud.get_active_counts(
+            db,
+            start_day=start_date,
+            end_day=end_date,
+            period=period,
+            device_type=device_type,
+            by_device_type=by_device_type
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/usage-anomalies")
+def get_usage_anomalies(
+    day: Optional[date] = Query(None, description="默认为最近一次扫描到的日期"),
+    home_id: Optional[str] = None,
+    direction: Optional[str] = Query(None, description="spike / drop"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """全设备异常扫描（每日夜间运行）发现的使用异常，按偏离程度降序"""
+    if direction is not None and direction not in ("spike", "drop"):
+        raise HTTPException(status_code=400, detail="direction must be spike or drop")
+    return crud.get_usage_anomalies(db, day=day, home_id=home_id, direction=direction, limit=limit)
+
+@router.get("/system/area-usage-correlation")
+def get_system_area_usage_correlation(
+    device_type: str,
+    days: int = Query(30, ge=1, le=366),
+    approx: bool = False,
+    sample_rate: float = SAMPLE_RATE_QUERY,
+    confidence: float = CONFIDENCE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """
+    房屋面积对某类设备使用时长的影响（按房屋分片多进程并行计算）
+    
+    approx=true时改为对使用记录抽样查询，每个房屋附带平均使用时长的置信区间
+    """
+    if approx:
+        points = crud.get_area_usage_correlation_sampled(db, device_type, sample_rate, confidence, days=days)
+    else:
+        points = coalesce(
+            ("system-area-usage-correlation", device_type, days),
+            lambda: parallel_area_usage_correlation(device_type, days=days)
+        )
+    result = {
+        "device_type": device_type,
+        "days": days,
+        "points": sorted(points, key=lambda item: item["area_sqm"]),
+        "total_homes": len(points)
+    }
+    if approx:
+        result.update({"approx": True, "sample_rate": sample_rate, "confidence": confidence})
+    return result
+
+@router.get("/system/feedback-distribution")
+def get_system_feedback_distribution(
+    approx: bool = False,
+    sample_rate: float = SAMPLE_RATE_QUERY,
+    confidence: float = CONFIDENCE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """用户反馈按设备类型的分布及解决比例；approx=true时按抽样估计，附带置信区间"""
+    if approx:
+        return {
+            "approx": True,
+            "sample_rate": sample_rate,
+            "confidence": confidence,
+            "distribution": crud.get_feedback_distribution_sampled(db, sample_rate, confidence)
+        }
+    return {"approx": False, "distribution": crud.get_feedback_distribution(db)}
+
+@router.get("/system/device-type-correlation")
+def get_system_device_type_correlation(days: int = Query(30, ge=1, le=366)):
+    """跨所有房屋的设备类型关联性（按房屋分片多进程并行计算）"""
+    return coalesce(
+        ("system-device-type-correlation", days),
+        lambda: parallel_device_type_correlation(days=days)
+    )
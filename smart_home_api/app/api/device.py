@@ -53,6 +53,30 @@ def delete_device(device_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Device not found")
     return db_device
 
+# 单次批量写入的记录数上限
+MAX_BULK_USAGE_LOGS = 5000
+
+@router.post("/usage-logs/bulk", response_model=List[schemas.DeviceUsageLog])
+def create_device_usage_logs_bulk(usage_logs: List[schemas.DeviceUsageLogCreate], db: Session = Depends(get_db)):
+    """批量创建设备使用记录（可跨设备），一次提交"""
+    if not usage_logs:
+        return []
+    if len(usage_logs) > MAX_BULK_USAGE_LOGS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_USAGE_LOGS} usage logs per request")
+    
+    usage_ids = [usage_log.usage_id for usage_log in usage_logs]
+    if len(set(usage_ids)) != len(usage_ids):
+        raise HTTPException(status_code=400, detail="Duplicate usage_id in request")
+    if crud.get_existing_usage_ids(db, usage_ids):
+        raise HTTPException(status_code=400, detail="Usage log already exists")
+    
+    device_ids = {usage_log.device_id for usage_log in usage_logs}
+    missing = device_ids - crud.get_existing_device_ids(db, device_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Device not found: {', '.join(sorted(missing))}")
+    
+    return crud.create_device_usage_logs_bulk(db=db, usage_logs=usage_logs)
+
 @router.get("/{device_id}/usage-logs", response_model=List[schemas.DeviceUsageLog])
 def get_device_usage_logs(device_id: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """获取设备使用记录"""
@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import base64
+import json
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
 from sqlalchemy import text 
 from .. import crud, schemas
-from ..database import get_db
+from ..cache import coalesce, serve_stale_while_revalidate
+from ..database import get_db, SessionLocal
+from ..downsample import lttb
+from ..fanout import fan_out
+from ..pubsub import hub, home_topic
 
 router = APIRouter(
     prefix="/homes",
@@ -50,13 +61,18 @@ def delete_home(home_id: str, db: Session = Depends(get_db)):
     return db_home
 
 @router.get("/{home_id}/users", response_model=schemas.HomeUsersResponse)
-def get_home_users(home_id: str, db: Session = Depends(get_db)):
+def get_home_users(home_id: str):
     """获取房屋关联的所有用户"""
-    home = crud.get_home(db, home_id=home_id)
+    # 房屋与用户关系两个查询互不依赖，并发执行
+    results = fan_out({
+        "home": lambda db: crud.get_home(db, home_id=home_id),
+        "members": lambda db: crud.get_home_users(db, home_id=home_id),
+    })
+    home = results["home"]
     if not home:
         raise HTTPException(status_code=404, detail="Home not found")
     
-    users, relations = crud.get_home_users(db, home_id=home_id)
+    users, relations = results["members"]
     
     return schemas.HomeUsersResponse(
         home=home,
@@ -64,6 +80,44 @@ def get_home_users(home_id: str, db: Session = Depends(get_db)):
         relations=relations
     )
 
+# 仪表盘可选部分；usage_stats 会附加到每个设备上，因此隐含 devices
+DASHBOARD_SECTIONS = ["devices", "usage_stats", "users", "alerts", "alert_distribution"]
+
+@router.get("/{home_id}/dashboard")
+def get_home_dashboard(
+    home_id: str,
+    sections: str = Query(
+        ",".join(DASHBOARD_SECTIONS),
+        description="逗号分隔的部分：devices, usage_stats, users, alerts, alert_distribution"
+    ),
+    alert_limit: int = Query(20, ge=1, le=100),
+):
+    """一次返回房屋仪表盘所需的全部数据，每个部分一条SQL语句并发执行"""
+    requested = {section.strip() for section in sections.split(",") if section.strip()}
+    unknown = requested - set(DASHBOARD_SECTIONS)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid sections: {', '.join(sorted(unknown))}. Must be among: {', '.join(DASHBOARD_SECTIONS)}"
+        )
+    
+    queries = {"home": lambda db: crud.get_dashboard_home(db, home_id=home_id)}
+    if requested & {"devices", "usage_stats"}:
+        queries["devices"] = lambda db: crud.get_dashboard_devices(
+            db, home_id=home_id, with_usage="usage_stats" in requested
+        )
+    if "users" in requested:
+        queries["users"] = lambda db: crud.get_dashboard_users(db, home_id=home_id)
+    if "alerts" in requested:
+        queries["alerts"] = lambda db: crud.get_dashboard_alerts(db, home_id=home_id, limit=alert_limit)
+    if "alert_distribution" in requested:
+        queries["alert_distribution"] = lambda db: crud.get_alert_distribution(db, home_id=home_id)
+    
+    dashboard = fan_out(queries)
+    if dashboard["home"] is None:
+        raise HTTPException(status_code=404, detail="Home not found")
+    return dashboard
+
 ####################################
 @router.get("/{home_id}/devices")
 def get_home_devices_simple(home_id: str, db: Session = Depends(get_db)):
@@ -96,6 +150,28 @@ def get_home_devices_simple(home_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 #######################################
 
+@router.get("/{home_id}/usage-stats")
+def get_home_usage_stats(
+    home_id: str,
+    periods: str = Query("day,week,month,year", description="逗号分隔: day, week, month, year"),
+    sort_by: Optional[str] = Query(None, description="排序所依据的周期，默认为第一个周期"),
+    top: Optional[int] = Query(None, ge=1, le=1000, description="只返回使用时长最多的前N个设备和房间"),
+    db: Session = Depends(get_db)
+):
+    """一次返回房屋内所有设备和各房间的使用统计"""
+    requested = tuple(dict.fromkeys(period.strip() for period in periods.split(",") if period.strip()))
+    valid = ["day", "week", "month", "year"]
+    if not requested or any(period not in valid for period in requested):
+        raise HTTPException(status_code=400, detail="Invalid periods. Must be among: day, week, month, year")
+    if sort_by is not None and sort_by not in requested:
+        raise HTTPException(status_code=400, detail="sort_by must be one of the requested periods")
+    
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="Home not found")
+    
+    return crud.get_home_usage_stats(db, home_id=home_id, periods=requested, sort_by=sort_by, top=top)
+
 @router.get("/{home_id}/devices/{device_id}/usage-stats")
 def get_device_usage_stats(
     home_id: str, 
@@ -113,13 +189,44 @@ def get_device_usage_stats(
     
     return stats
 
-@router.get("/{home_id}/devices/{device_id}/usage-stats/chart")
-def get_device_usage_chart(
-    home_id: str, 
-    device_id: str,
-    db: Session = Depends(get_db)
-):
-    """获取设备使用统计的条形图数据"""
+@router.get("/{home_id}/duration-stats")
+def get_home_duration_stats(home_id: str, db: Session = Depends(get_db)):
+    """房屋及各设备全部使用记录的时长统计（数量、均值、标准差、最小、最大），读取在线维护的汇总"""
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="Home not found")
+    return crud.get_home_duration_stats(db, home_id=home_id)
+
+@router.get("/{home_id}/devices/{device_id}/duration-stats")
+def get_device_duration_stats(home_id: str, device_id: str, db: Session = Depends(get_db)):
+    """设备全部使用记录的时长统计，读取在线维护的汇总"""
+    stats = crud.get_device_duration_stats(db, home_id=home_id, device_id=device_id)
+    if not stats:
+        raise HTTPException(status_code=404, detail="Device not found or not in this home")
+    return stats
+
+def _serve_chart(response: Response, background_tasks: BackgroundTasks, key: tuple, home_id: str,
+                 build: Callable[[Session], dict], max_stale: float) -> schemas.ChartData:
+    """
+    按stale-while-revalidate返回图表数据：不超过max_stale秒的旧结果立即返回并在响应后后台刷新，
+    响应头 Age 为结果已缓存的秒数，X-Cache 为 HIT / STALE / MISS
+    """
+    def compute():
+        # 后台刷新时请求的会话已关闭，使用独立会话
+        db = SessionLocal()
+        try:
+            return build(db)
+        finally:
+            db.close()
+
+    chart, age, state = serve_stale_while_revalidate(
+        key, home_id, compute, max_stale, background_tasks.add_task
+    )
+    response.headers["Age"] = str(int(age))
+    response.headers["X-Cache"] = state
+    return schemas.ChartData(**chart)
+
+def _build_device_usage_chart(db: Session, home_id: str, device_id: str) -> dict:
     periods = ["day", "week", "month", "year"]
     labels = []
     data = []
@@ -138,6 +245,20 @@ def get_device_usage_chart(
         data=data,
         chart_type="bar",
         title=f"Device Usage Statistics"
+    ).dict()
+
+@router.get("/{home_id}/devices/{device_id}/usage-stats/chart")
+def get_device_usage_chart(
+    home_id: str, 
+    device_id: str,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    max_stale: float = Query(0, ge=0, description="可接受的旧结果最大年龄（秒），过期或已失效但不超过该年龄时立即返回并后台刷新"),
+):
+    """获取设备使用统计的条形图数据"""
+    return _serve_chart(
+        response, background_tasks, ("device-usage-chart", home_id, device_id), home_id,
+        lambda db: _build_device_usage_chart(db, home_id, device_id), max_stale
     )
 
 @router.get("/{home_id}/devices/{device_id}/time-slot-usage")
@@ -166,24 +287,36 @@ def get_device_time_slot_chart(home_id: str, device_id: str, db: Session = Depen
         title="Device Usage Distribution by Time Slot"
     )
 
+def _get_correlations(db: Session, home_id: str, mode: str):
+    """按模式计算设备关联性：window为30分钟开始时间窗口共现，overlap为实际使用区间重叠"""
+    if mode not in ["window", "overlap"]:
+        raise HTTPException(status_code=400, detail="Invalid mode. Must be one of: window, overlap")
+    
+    # 同一房屋、同一模式的并发请求只计算一次
+    if mode == "overlap":
+        return coalesce(("device-correlation", home_id, mode),
+                        lambda: crud.get_device_overlap_correlation(db, home_id=home_id))
+    return coalesce(("device-correlation", home_id, mode),
+                    lambda: crud.get_device_correlation(db, home_id=home_id))
+
 @router.get("/{home_id}/device-correlation")
-def get_home_device_correlation(home_id: str, db: Session = Depends(get_db)):
+def get_home_device_correlation(home_id: str, mode: str = "window", db: Session = Depends(get_db)):
     """获取房屋设备使用关联性"""
     home = crud.get_home(db, home_id=home_id)
     if not home:
         raise HTTPException(status_code=404, detail="Home not found")
     
-    correlations = crud.get_device_correlation(db, home_id=home_id)
+    correlations = _get_correlations(db, home_id, mode)
     return correlations
 
 @router.get("/{home_id}/device-correlation/chart")
-def get_home_device_correlation_chart(home_id: str, db: Session = Depends(get_db)):
+def get_home_device_correlation_chart(home_id: str, mode: str = "window", db: Session = Depends(get_db)):
     """获取房屋设备使用关联性的琴弦图数据"""
     home = crud.get_home(db, home_id=home_id)
     if not home:
         raise HTTPException(status_code=404, detail="Home not found")
     
-    correlations = crud.get_device_correlation(db, home_id=home_id)
+    correlations = _get_correlations(db, home_id, mode)
     
     # 构建节点和连接数据
     devices = set()
@@ -207,6 +340,131 @@ def get_home_device_correlation_chart(home_id: str, db: Session = Depends(get_db
         title="Device Usage Correlation"
     )
 
+@router.get("/{home_id}/concurrency")
+def get_home_concurrency(
+    home_id: str,
+    days: int = Query(30, ge=1, le=366),
+    resolution_minutes: int = Query(60, ge=5, le=1440),
+    db: Session = Depends(get_db)
+):
+    """获取房屋设备同时运行数量（并发）分析：并发时间序列、峰值时刻和各设备贡献"""
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="Home not found")
+    
+    return crud.get_home_concurrency(db, home_id=home_id, days=days, resolution_minutes=resolution_minutes)
+
+@router.get("/{home_id}/usage-heatmap")
+def get_usage_heatmap(
+    home_id: str,
+    device_id: Optional[str] = Query(None, description="只统计该设备，默认为整个房屋"),
+    days: int = Query(365, ge=1, le=366),
+    output: str = Query("json", alias="format", pattern="^(json|base64|binary)$",
+                        description="json: 按行展开的数组; base64: float32小端字节的base64; binary: 原始float32字节"),
+    db: Session = Depends(get_db)
+):
+    """使用日历热力图（天 × 小时，单位小时），矩阵按行展开，第i*24+h个值为第i天h点"""
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="Home not found")
+    if device_id:
+        device = crud.get_device(db, device_id=device_id)
+        if not device or device.home_id != home_id:
+            raise HTTPException(status_code=404, detail="Device not found or not in this home")
+    
+    heatmap = crud.get_usage_heatmap(db, home_id=home_id, device_id=device_id, days=days)
+    matrix = heatmap["matrix"]
+    packed = matrix.astype("<f4").tobytes()
+    meta = {
+        "home_id": home_id,
+        "device_id": device_id,
+        "first_day": heatmap["first_day"].isoformat(),
+        "shape": list(matrix.shape),
+        "unit": "hours",
+        "dtype": "float32"
+    }
+    
+    if output == "binary":
+        return Response(
+            content=packed,
+            media_type="application/octet-stream",
+            headers={
+                "X-Heatmap-First-Day": meta["first_day"],
+                "X-Heatmap-Shape": f"{matrix.shape[0]},{matrix.shape[1]}",
+                "X-Heatmap-Dtype": "float32-le"
+            }
+        )
+    if output == "base64":
+        return {**meta, "data": base64.b64encode(packed).decode("ascii")}
+    return {**meta, "data": matrix.ravel().tolist(), "max": float(matrix.max()), "total": float(matrix.sum())}
+
+@router.get("/{home_id}/usage-series")
+def get_usage_series(
+    home_id: str,
+    device_id: Optional[str] = Query(None, description="只统计该设备，默认为整个房屋"),
+    days: int = Query(90, ge=1, le=3660),
+    series: str = Query("sessions", pattern="^(sessions|hourly)$",
+                        description="sessions: 每次使用的时长; hourly: 每小时的使用时长"),
+    max_points: int = Query(1000, ge=3, le=10000, description="返回的最大点数，超过时用LTTB降采样"),
+    db: Session = Depends(get_db)
+):
+    """长时间范围的使用时间序列，服务端用LTTB降采样到至多max_points个点"""
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="Home not found")
+    if device_id:
+        device = crud.get_device(db, device_id=device_id)
+        if not device or device.home_id != home_id:
+            raise HTTPException(status_code=404, detail="Device not found or not in this home")
+    
+    end_time = datetime.now()
+    start_time = end_time - timedelta(days=days)
+    timestamps, values = crud.get_usage_series(
+        db, home_id=home_id, start_time=start_time, end_time=end_time, device_id=device_id, series=series
+    )
+    keep = lttb(timestamps, values, max_points)
+    
+    return {
+        "home_id": home_id,
+        "device_id": device_id,
+        "series": series,
+        "unit": "seconds",
+        "raw_points": len(timestamps),
+        "returned_points": len(keep),
+        "timestamps": [datetime.fromtimestamp(t).isoformat() for t in timestamps[keep].tolist()],
+        "values": values[keep].tolist()
+    }
+
+@router.get("/{home_id}/timeline")
+def get_home_timeline(
+    home_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    types: str = Query(",".join(crud.TIMELINE_TYPES), description="逗号分隔的记录类型"),
+    db: Session = Depends(get_db)
+):
+    """
+    房屋活动时间线：使用记录、反馈、安全事件按时间倒序合并分页
+
+    has_more 为真时用 next_cursor 请求下一页；翻页期间新写入的记录不会造成重复或遗漏
+    """
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="Home not found")
+    
+    requested = tuple(dict.fromkeys(kind.strip() for kind in types.split(",") if kind.strip()))
+    unknown = set(requested) - set(crud.TIMELINE_TYPES)
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid types: {', '.join(sorted(unknown))}. Must be among: {', '.join(crud.TIMELINE_TYPES)}"
+        )
+    try:
+        page = crud.get_home_timeline(db, home_id=home_id, limit=limit, cursor=cursor, types=requested)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"home_id": home_id, **page}
+
 @router.get("/{home_id}/alerts", response_model=List[schemas.SecurityEvent])
 def get_home_alerts(home_id: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """获取房屋的所有警报事件"""
@@ -217,6 +475,91 @@ def get_home_alerts(home_id: str, skip: int = 0, limit: int = 100, db: Session =
     alerts = crud.get_security_events(db, home_id=home_id, skip=skip, limit=limit)
     return alerts
 
+# 实时推送的心跳间隔（秒）；心跳同时用于发现已断开的客户端
+STREAM_HEARTBEAT_SECONDS = 15
+
+def _home_exists(home_id: str) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.get_home(db, home_id=home_id) is not None
+    finally:
+        db.close()
+
+@router.websocket("/{home_id}/alerts/ws")
+async def stream_home_alerts_ws(websocket: WebSocket, home_id: str):
+    """
+    WebSocket实时推送房屋的新安全事件（type=security_event）和突发警报（type=alert）
+    
+    客户端消费过慢、积压超过队列上限时服务端以代码1013关闭连接，客户端应重连并补查 /alerts
+    """
+    if not await run_in_threadpool(_home_exists, home_id):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = hub.subscribe(home_topic(home_id))
+    try:
+        while True:
+            try:
+                message = await subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.send_json({"type": "heartbeat"})
+                continue
+            if message is None:
+                await websocket.close(code=1013, reason="slow consumer")
+                break
+            await websocket.send_json(jsonable_encoder(message))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        subscription.close()
+
+@router.get("/{home_id}/alerts/stream")
+async def stream_home_alerts_sse(home_id: str, request: Request):
+    """Server-Sent Events 实时推送，事件名为 security_event / alert，消费过慢时发送 close 事件后断开"""
+    if not await run_in_threadpool(_home_exists, home_id):
+        raise HTTPException(status_code=404, detail="Home not found")
+
+    async def events():
+        # 在生成器内订阅：客户端在响应开始前断开时生成器不会运行，也就不会留下无人关闭的订阅
+        subscription = hub.subscribe(home_topic(home_id))
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if message is None:
+                    yield "event: close\ndata: slow consumer\n\n"
+                    break
+                data = json.dumps(jsonable_encoder(message["data"]), ensure_ascii=False)
+                yield f"event: {message['type']}\ndata: {data}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/{home_id}/alerts/system", response_model=List[schemas.Alert])
+def get_home_system_alerts(
+    home_id: str,
+    alert_type: Optional[str] = None,
+    resolved: Optional[bool] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    """获取房屋的系统警报（如安全事件突发），按时间倒序"""
+    home = crud.get_home(db, home_id=home_id)
+    if not home:
+        raise HTTPException(status_code=404, detail="Home not found")
+    
+    return crud.get_home_system_alerts(
+        db, home_id=home_id, alert_type=alert_type, resolved=resolved, skip=skip, limit=limit
+    )
+
 @router.get("/{home_id}/alerts/distribution")
 def get_home_alert_distribution(home_id: str, db: Session = Depends(get_db)):
     """获取单个房屋发出的警报的类型分布"""
@@ -228,8 +571,19 @@ def get_home_alert_distribution(home_id: str, db: Session = Depends(get_db)):
     return distribution
 
 @router.get("/{home_id}/alerts/distribution/chart")
-def get_home_alert_distribution_chart(home_id: str, db: Session = Depends(get_db)):
+def get_home_alert_distribution_chart(
+    home_id: str,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    max_stale: float = Query(0, ge=0, description="可接受的旧结果最大年龄（秒），过期或已失效但不超过该年龄时立即返回并后台刷新"),
+):
     """获取单个房屋警报类型分布的饼图数据"""
+    return _serve_chart(
+        response, background_tasks, ("home-alert-distribution-chart", home_id), home_id,
+        lambda db: _build_alert_distribution_chart(db, home_id), max_stale
+    )
+
+def _build_alert_distribution_chart(db: Session, home_id: str) -> dict:
     home = crud.get_home(db, home_id=home_id)
     if not home:
         raise HTTPException(status_code=404, detail="Home not found")
@@ -247,7 +601,7 @@ def get_home_alert_distribution_chart(home_id: str, db: Session = Depends(get_db
         data=data,
         chart_type="pie",
         title=f"Alert Distribution for Home {home_id}"
-    )
+    ).dict()
 
 
 
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+from .. import crud
+from ..database import get_db
+
+router = APIRouter(
+    prefix="/sync",
+    tags=["sync"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("/cursor")
+def get_sync_cursor(db: Session = Depends(get_db)):
+    """
+    获取当前同步游标
+
+    客户端全量同步前先读取游标，全量下载完成后用该游标调用 /sync/changes 增量同步
+    """
+    return {"cursor": crud.get_sync_cursor(db)}
+
+@router.get("/changes")
+def get_changes(
+    since: int = Query(0, ge=0, description="上次同步返回的 next_cursor"),
+    home_id: Optional[str] = Query(None, description="只同步该房屋的变更"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """
+    获取游标之后的新增、修改、删除
+
+    has_more 为真时用 next_cursor 继续请求；reset_required 为真表示游标之后的部分变更已被清理，需要全量同步
+    """
+    if home_id and not crud.get_home(db, home_id=home_id):
+        raise HTTPException(status_code=404, detail="Home not found")
+    return crud.get_changes(db, since=since, home_id=home_id, limit=limit)
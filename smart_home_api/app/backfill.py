@@ -0,0 +1,80 @@
+"""
+派生表回填
+
+小时汇总等派生表在写入使用记录时增量维护，只覆盖上线之后写入的记录；已有数据或直接用SQL导入的数据
+需要根据原始记录重建一次。每个步骤完成后在 derived_backfill 表中记一行，夜间预计算的全量运行
+（见 scheduler.py）开始时执行尚未完成的步骤，之后不再重复
+
+重建会先删除派生表再重新计算，应在低峰时段运行
+命令行运行: python -m app.backfill [--step NAME ...] [--force]
+"""
+import argparse
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .database import engine, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# 步骤名 -> 重建函数（自行提交事务）
+STEPS: Dict[str, Callable[[Session], None]] = {
+    "usage_rollup": crud.rebuild_usage_rollup,
+    "device_cooccurrence": crud.rebuild_device_cooccurrence,
+    "duration_digests": crud.rebuild_duration_digests,
+    "activity_sketches": crud.rebuild_activity_sketches,
+    "duration_stats": crud.rebuild_duration_stats,
+}
+
+
+def completed_steps(db: Session) -> set:
+    return {step for (step,) in db.query(models.DerivedBackfill.step).all()}
+
+
+def run_backfills(steps: Optional[List[str]] = None, force: bool = False) -> List[str]:
+    """
+    执行回填步骤，返回实际执行的步骤名
+
+    steps为空时执行全部步骤；force为假时跳过已完成的步骤。单个步骤失败只记录日志，下次再试
+    """
+    db = SessionLocal()
+    try:
+        done = set() if force else completed_steps(db)
+        executed = []
+        for step in steps or list(STEPS):
+            if step in done:
+                continue
+            started = time.perf_counter()
+            try:
+                STEPS[step](db)
+                db.merge(models.DerivedBackfill(step=step, completed_at=datetime.now()))
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"回填失败 {step}: {e}")
+                continue
+            executed.append(step)
+            logger.info(f"回填完成 {step}，耗时 {time.perf_counter() - started:.2f} 秒")
+        return executed
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="根据原始记录重建派生表")
+    parser.add_argument("--step", dest="steps", action="append", choices=list(STEPS), help="只执行指定步骤，可重复")
+    parser.add_argument("--force", action="store_true", help="重新执行已完成的步骤")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=engine, tables=[models.DerivedBackfill.__table__])
+    executed = run_backfills(args.steps, force=args.force)
+    print(f"✅ 回填完成: {executed or '无需执行的步骤'}")
+
+
+if __name__ == "__main__":
+    main()
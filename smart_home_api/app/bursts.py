@@ -0,0 +1,106 @@
+"""
+安全事件突发检测
+
+每个房屋、每个设备各有一个环形缓冲区形式的滑动窗口计数器：窗口分为固定数量的桶，新事件只更新当前桶，
+时间前进时清空过期的桶，单个事件的开销与历史事件数量无关。窗口内事件数超过阈值时产生一条突发警报，
+同一对象在一个窗口长度内只报警一次
+
+计数保存在进程内存中；多进程部署时每个进程只统计自己接收的事件
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+
+class SlidingWindowCounter:
+    """窗口长度window秒、分为buckets个桶的滑动计数，精度为一个桶的宽度"""
+
+    __slots__ = ("window", "width", "counts", "total", "head")
+
+    def __init__(self, window: float, buckets: int):
+        self.window = window
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.total = 0
+        self.head: Optional[int] = None  # 当前桶的序号（时间戳 // 桶宽度）
+
+    def _advance(self, slot: int):
+        if self.head is None or slot - self.head >= len(self.counts):
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+        else:
+            for expired in range(self.head + 1, slot + 1):
+                index = expired % len(self.counts)
+                self.total -= self.counts[index]
+                self.counts[index] = 0
+        self.head = slot
+
+    def add(self, timestamp: float) -> int:
+        """记录一个事件并返回窗口内的事件数；早于窗口的事件忽略"""
+        slot = int(timestamp // self.width)
+        if self.head is not None and slot <= self.head - len(self.counts):
+            return self.total
+        if self.head is None or slot > self.head:
+            self._advance(slot)
+        self.counts[slot % len(self.counts)] += 1
+        self.total += 1
+        return self.total
+
+
+class BurstDetector:
+    """
+    按 (范围, 对象ID) 维护滑动窗口计数，observe返回本次事件触发的突发 [(范围, 对象ID, 窗口内事件数)]
+
+    limits为各范围的阈值，如 {"home": 20, "device": 10}；计数器数量超过max_keys时淘汰最久未更新的对象
+    """
+
+    def __init__(self, window: float = 60, limits: dict = None, buckets: int = 12, max_keys: int = 100000):
+        self.window = window
+        self.limits = limits or {"home": 20, "device": 10}
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self._counters: "OrderedDict[Hashable, SlidingWindowCounter]" = OrderedDict()
+        self._last_alert: dict = {}
+        self._lock = threading.Lock()
+
+    def observe(self, timestamp: float, **ids: Optional[str]) -> List[Tuple[str, str, int]]:
+        bursts = []
+        with self._lock:
+            for scope, object_id in ids.items():
+                limit = self.limits.get(scope)
+                if object_id is None or limit is None:
+                    continue
+                key = (scope, object_id)
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = self._counters[key] = SlidingWindowCounter(self.window, self.buckets)
+                    if len(self._counters) > self.max_keys:
+                        evicted, _ = self._counters.popitem(last=False)
+                        self._last_alert.pop(evicted, None)
+                else:
+                    self._counters.move_to_end(key)
+                count = counter.add(timestamp)
+                last_alert = self._last_alert.get(key)
+                if count > limit and (last_alert is None or timestamp - last_alert >= self.window):
+                    self._last_alert[key] = timestamp
+                    bursts.append((scope, object_id, count))
+        return bursts
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._last_alert.clear()
+
+
+def detector_from_env() -> BurstDetector:
+    return BurstDetector(
+        window=float(os.getenv("SECURITY_BURST_WINDOW_SECONDS", "60")),
+        limits={
+            "home": int(os.getenv("SECURITY_BURST_HOME_LIMIT", "20")),
+            "device": int(os.getenv("SECURITY_BURST_DEVICE_LIMIT", "10")),
+        },
+    )
+
+
+security_burst_detector = detector_from_env()
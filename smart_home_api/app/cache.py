@@ -0,0 +1,247 @@
+import copy
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# 全局作用域：系统级分析结果，任何房屋的数据变化都会使其失效
+GLOBAL_SCOPE = "*"
+
+
+class _Entry:
+    __slots__ = ("value", "scope", "generation", "computed_at", "expires_at")
+
+    def __init__(self, value, scope: str, generation: int, computed_at: float, expires_at: float):
+        self.value = value
+        self.scope = scope
+        self.generation = generation
+        self.computed_at = computed_at
+        self.expires_at = expires_at
+
+
+class AnalyticsCache:
+    """
+    分析结果缓存
+
+    以 (函数名, 参数) 为键，按TTL过期、按LRU淘汰。每个房屋和全局作用域各有一个代数计数器，
+    写操作提升对应代数，缓存项记录计算开始时的代数，代数不一致即视为失效，
+    因此写入之后不会再读到旧结果
+    """
+
+    def __init__(self, max_entries: int = 1024, default_ttl: float = 300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, scope: str) -> int:
+        """当前作用域的代数"""
+        with self._lock:
+            return self._generations.get(scope, 0)
+
+    def _is_fresh(self, entry: _Entry, now: float) -> bool:
+        return entry.expires_at > now and entry.generation == self._generations.get(entry.scope, 0)
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """返回 (是否命中, 值)；过期或已失效的项视为未命中，但保留到被LRU淘汰，供lookup返回旧值"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh(entry, time.monotonic()):
+                return False, None
+            self._entries.move_to_end(key)
+            return True, copy.deepcopy(entry.value)
+
+    def lookup(self, key: Hashable) -> Optional[Tuple[Any, float, bool]]:
+        """返回 (值, 距计算完成的秒数, 是否仍新鲜)，包括已过期或已失效的旧值；不存在时返回None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(entry.value), now - entry.computed_at, self._is_fresh(entry, now)
+
+    def set(self, key: Hashable, value: Any, scope: str, generation: int, ttl: Optional[float] = None):
+        """写入缓存；generation应为计算开始前读取的代数，计算期间发生写入则该结果直接作废"""
+        now = time.monotonic()
+        with self._lock:
+            if generation != self._generations.get(scope, 0):
+                return
+            self._entries[key] = _Entry(
+                copy.deepcopy(value), scope, generation, now, now + (self.default_ttl if ttl is None else ttl)
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_home(self, home_id: Optional[str]):
+        """房屋数据发生变化：提升该房屋和全局作用域的代数"""
+        with self._lock:
+            if home_id:
+                self._generations[home_id] = self._generations.get(home_id, 0) + 1
+            self._generations[GLOBAL_SCOPE] = self._generations.get(GLOBAL_SCOPE, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求
+
+    同一键同时只有一个调用（leader）真正执行，其余并发调用阻塞等待并共享其结果或异常；
+    执行结束后键即被移除，之后的调用会重新计算
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.value)
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+
+single_flight = SingleFlight()
+
+
+def coalesce(key: Hashable, fn: Callable[[], Any]) -> Any:
+    """用全局SingleFlight合并相同键的并发计算（如图表渲染）"""
+    return single_flight.do(key, fn)
+
+
+def _recompute(cache: "AnalyticsCache", key: Hashable, scope: str, compute: Callable[[], Any], ttl: Optional[float]):
+    """通过SingleFlight重新计算并写入缓存"""
+    def run():
+        generation = cache.generation(scope)
+        result = compute()
+        cache.set(key, result, scope, generation, ttl)
+        return result
+
+    return single_flight.do(key, run)
+
+
+def serve_stale_while_revalidate(key: Hashable, scope: str, compute: Callable[[], Any], max_stale: float,
+                                 schedule: Callable[[Callable[[], None]], None], ttl: Optional[float] = None,
+                                 cache: "AnalyticsCache" = None) -> Tuple[Any, float, str]:
+    """
+    stale-while-revalidate 读取
+
+    新鲜结果直接返回；已过期或已被写入失效、但计算完成不超过max_stale秒的旧结果也立即返回，
+    同时通过schedule安排后台重新计算；否则同步计算。
+    compute需自行管理数据库会话（后台执行时请求的会话已关闭）。
+    返回 (值, 结果年龄秒数, 状态)，状态为 HIT / STALE / MISS
+    """
+    cache = cache or analytics_cache
+    cached = cache.lookup(key)
+    if cached is not None:
+        value, age, fresh = cached
+        if fresh:
+            return value, age, "HIT"
+        if age <= max_stale:
+            def refresh():
+                try:
+                    _recompute(cache, key, scope, compute, ttl)
+                except Exception as e:
+                    print(f"❌ 后台刷新缓存失败: {key} - {e}")
+
+            schedule(refresh)
+            return value, age, "STALE"
+
+    return copy.deepcopy(_recompute(cache, key, scope, compute, ttl)), 0.0, "MISS"
+
+
+analytics_cache = AnalyticsCache(
+    max_entries=int(os.getenv("ANALYTICS_CACHE_SIZE", "1024")),
+    default_ttl=float(os.getenv("ANALYTICS_CACHE_TTL", "300")),
+)
+
+
+def cache_key_digest(key: Hashable) -> str:
+    """缓存键的稳定摘要，用作持久化缓存表的主键"""
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+def cached_analytics(ttl: Optional[float] = None, cache: AnalyticsCache = analytics_cache,
+                     loader: Optional[Callable[[Any, str], Tuple[bool, Any]]] = None):
+    """
+    crud分析函数的缓存装饰器
+
+    被装饰函数的第一个参数为数据库会话，不参与缓存键；带home_id参数时按该房屋的代数失效，
+    否则属于全局作用域。未命中时通过SingleFlight计算，并发的相同调用只查询一次数据库。
+    loader(db, 键摘要) 用于在计算前读取持久化的预计算结果，返回 (是否命中, 值)。
+    原函数可通过 wrapper.uncached 调用，wrapper.cache_key(...) 返回 (缓存键, 作用域)
+    """
+    def decorator(fn: Callable):
+        signature = inspect.signature(fn)
+
+        def cache_key(*args, **kwargs) -> Tuple[Hashable, str]:
+            bound = signature.bind_partial(*args, **kwargs)
+            bound.apply_defaults()
+            params = tuple(
+                (name, tuple(sorted(value.items())) if isinstance(value, dict) else value)
+                for name, value in bound.arguments.items() if name != "db"
+            )
+            return (fn.__name__, params), bound.arguments.get("home_id") or GLOBAL_SCOPE
+
+        @functools.wraps(fn)
+        def wrapper(db, *args, **kwargs):
+            key, scope = cache_key(db, *args, **kwargs)
+
+            hit, value = cache.get(key)
+            if hit:
+                return value
+
+            def compute():
+                generation = cache.generation(scope)
+                if loader is not None:
+                    stored, result = loader(db, cache_key_digest(key))
+                    if stored:
+                        cache.set(key, result, scope, generation, ttl)
+                        return result
+                result = fn(db, *args, **kwargs)
+                cache.set(key, result, scope, generation, ttl)
+                return result
+
+            return single_flight.do(key, compute)
+
+        wrapper.uncached = fn
+        wrapper.cache_key = lambda *args, **kwargs: cache_key(None, *args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -1,14 +1,159 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func, extract, case
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, or_, func, extract, case, select, true, cast, text, update, Integer, BigInteger
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from . import models, schemas
+from .time_buckets import (
+    to_epoch_seconds, hour_edges, day_edges, split_intervals, split_by_day_and_slot,
+    count_by_slot, day_hour_matrix, MAX_SESSION_SECONDS
+)
+from .cache import cached_analytics, analytics_cache
+from .olap import build_aggregate_query, format_rows, time_part
+from .sketches import TDigest, HyperLogLog
+from .sampling import sample_source, z_value, count_interval, mean_interval, proportion_interval
+from . import running_stats
+from .bursts import security_burst_detector
+from .pubsub import hub, home_topic
+from .timeline import merge_timeline
+from .intervals import merge_intervals, sweep_concurrency, measure_where, level_runs, pairwise_overlap
 from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+import uuid
+import numpy as np
+
+# Change log (outbox for delta sync)
+def _row_payload(obj) -> Dict[str, Any]:
+    """ORM对象各列的值，转换为可写入JSON列的类型"""
+    payload = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()  # datetime / date
+        elif value is not None and not isinstance(value, (str, int, float, bool)):
+            value = float(value)  # Numeric
+        payload[column.key] = value
+    return payload
+
+def _record_change(db: Session, obj, operation: str, home_ids: List[Optional[str]], flush: bool = True):
+    """
+    在当前事务中写入变更记录，不提交事务；与数据修改同时提交或回滚
+    
+    home_ids为实体所属的房屋（用户为其所在的各房屋，不属于任何房屋时为[None]），每个房屋一条记录。
+    insert/update 先flush以取得数据库默认值，payload为修改后的整行；delete 的payload为空
+    """
+    if flush and operation != "delete":
+        db.flush()
+    table = obj.__table__
+    entity_id = "/".join(str(getattr(obj, column.key)) for column in table.primary_key.columns)
+    payload = None if operation == "delete" else _row_payload(obj)
+    changed_at = datetime.now()
+    db.add_all([
+        models.ChangeLog(
+            entity=table.name, entity_id=entity_id, home_id=home_id,
+            operation=operation, payload=payload, changed_at=changed_at
+        )
+        for home_id in (home_ids or [None])
+    ])
+
+def _user_home_ids(db: Session, user_id: str) -> List[Optional[str]]:
+    home_ids = [
+        home_id for (home_id,) in db.query(models.UserHomeRelation.home_id).filter(
+            models.UserHomeRelation.user_id == user_id
+        ).all()
+    ]
+    return home_ids or [None]
+
+# 每次排序最多处理的变更数；排序步骤的advisory锁键
+SYNC_SEQUENCE_BATCH = 5000
+SYNC_SEQUENCE_LOCK_KEY = 7_305_002
+
+def sequence_changes(db: Session) -> int:
+    """
+    给已提交、尚未排序的变更分配同步序号sync_seq（客户端游标），返回分配的条数
+    
+    change_id在flush时分配，与提交顺序不一定一致，不能作为游标。本步骤只能看到已提交的变更，并且串行执行
+    （PostgreSQL事务级advisory锁；其他数据库由写锁和sync_seq唯一约束保证），之后提交的变更总会得到更大的序号，
+    因此客户端游标不会越过尚未提交的变更。其他会话正在排序时直接返回0
+    """
+    try:
+        if db.get_bind().dialect.name == "postgresql":
+            acquired = db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SYNC_SEQUENCE_LOCK_KEY}
+            ).scalar()
+            if not acquired:
+                db.rollback()
+                return 0
+        pending = [
+            change_id
+            for (change_id,) in db.query(models.ChangeLog.change_id).filter(
+                models.ChangeLog.sync_seq.is_(None)
+            ).order_by(models.ChangeLog.change_id).limit(SYNC_SEQUENCE_BATCH).all()
+        ]
+        if pending:
+            last = db.query(func.max(models.ChangeLog.sync_seq)).scalar() or 0
+            db.execute(update(models.ChangeLog), [
+                {"change_id": change_id, "sync_seq": last + i} for i, change_id in enumerate(pending, 1)
+            ])
+        db.commit()
+        return len(pending)
+    except IntegrityError:
+        db.rollback()
+        return 0
+
+def get_changes(db: Session, since: int = 0, home_id: str = None, limit: int = 500):
+    """
+    返回同步序号大于since的变更（按序号升序，最多limit条）
+    
+    home_id不为空时只返回该房屋的变更；since早于已清理的最早变更时reset_required为真，客户端需全量同步
+    """
+    sequence_changes(db)
+    query = db.query(models.ChangeLog).filter(models.ChangeLog.sync_seq > since)
+    if home_id:
+        query = query.filter(models.ChangeLog.home_id == home_id)
+    rows = query.order_by(models.ChangeLog.sync_seq).limit(limit + 1).all()
+    
+    oldest = db.query(func.min(models.ChangeLog.sync_seq)).scalar()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "changes": [
+            {
+                "cursor": row.sync_seq,
+                "change_id": row.change_id,
+                "entity": row.entity,
+                "entity_id": row.entity_id,
+                "home_id": row.home_id,
+                "operation": row.operation,
+                "data": row.payload,
+                "changed_at": row.changed_at
+            }
+            for row in rows
+        ],
+        "next_cursor": rows[-1].sync_seq if rows else since,
+        "has_more": has_more,
+        "reset_required": since > 0 and oldest is not None and since < oldest - 1
+    }
+
+def get_sync_cursor(db: Session) -> int:
+    """当前最大的同步序号，客户端全量同步前读取，之后从该游标开始增量同步"""
+    sequence_changes(db)
+    return db.query(func.max(models.ChangeLog.sync_seq)).scalar() or 0
+
+def prune_change_log(db: Session, days: int = 30) -> int:
+    """删除早于days天的变更记录，返回删除的行数"""
+    deleted = db.query(models.ChangeLog).filter(
+        models.ChangeLog.changed_at < datetime.now() - timedelta(days=days)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
 
 # User CRUD operations
 def create_user(db: Session, user: schemas.UserCreate):
     db_user = models.User(**user.dict())
     db.add(db_user)
+    _record_change(db, db_user, "insert", [None])
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -25,6 +170,7 @@ def update_user(db: Session, user_id: str, user: schemas.UserUpdate):
         update_data = user.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_user, field, value)
+        _record_change(db, db_user, "update", _user_home_ids(db, user_id))
         db.commit()
         db.refresh(db_user)
     return db_user
@@ -32,6 +178,7 @@ def update_user(db: Session, user_id: str, user: schemas.UserUpdate):
 def delete_user(db: Session, user_id: str):
     db_user = db.query(models.User).filter(models.User.user_id == user_id).first()
     if db_user:
+        _record_change(db, db_user, "delete", _user_home_ids(db, user_id))
         db.delete(db_user)
         db.commit()
     return db_user
@@ -40,6 +187,7 @@ def delete_user(db: Session, user_id: str):
 def create_home(db: Session, home: schemas.HomeCreate):
     db_home = models.Home(**home.dict())
     db.add(db_home)
+    _record_change(db, db_home, "insert", [home.home_id])
     db.commit()
     db.refresh(db_home)
     return db_home
@@ -56,21 +204,32 @@ def update_home(db: Session, home_id: str, home: schemas.HomeUpdate):
         update_data = home.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_home, field, value)
+        _record_change(db, db_home, "update", [home_id])
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
         db.refresh(db_home)
     return db_home
 
 def delete_home(db: Session, home_id: str):
     db_home = db.query(models.Home).filter(models.Home.home_id == home_id).first()
     if db_home:
+        _record_change(db, db_home, "delete", [home_id])
         db.delete(db_home)
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
     return db_home
 
 # User-Home Relation CRUD operations
 def create_user_home_relation(db: Session, relation: schemas.UserHomeRelationCreate):
     db_relation = models.UserHomeRelation(**relation.dict())
     db.add(db_relation)
+    _record_change(db, db_relation, "insert", [relation.home_id])
+    # 按房屋同步的客户端之前没有该用户的记录，新成员的用户信息也写入该房屋的变更
+    db_user = db.query(models.User).filter(models.User.user_id == relation.user_id).first()
+    if db_user:
+        _record_change(db, db_user, "insert", [relation.home_id], flush=False)
     db.commit()
     db.refresh(db_relation)
     return db_relation
@@ -86,6 +245,7 @@ def update_user_home_relation(db: Session, user_id: str, home_id: str, relation:
         update_data = relation.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_relation, field, value)
+        _record_change(db, db_relation, "update", [home_id])
         db.commit()
         db.refresh(db_relation)
     return db_relation
@@ -93,6 +253,7 @@ def update_user_home_relation(db: Session, user_id: str, home_id: str, relation:
 def delete_user_home_relation(db: Session, user_id: str, home_id: str):
     db_relation = get_user_home_relation(db, user_id, home_id)
     if db_relation:
+        _record_change(db, db_relation, "delete", [home_id])
         db.delete(db_relation)
         db.commit()
     return db_relation
@@ -101,7 +262,10 @@ def delete_user_home_relation(db: Session, user_id: str, home_id: str):
 def create_device(db: Session, device: schemas.DeviceCreate):
     db_device = models.Device(**device.dict())
     db.add(db_device)
+    _record_change(db, db_device, "insert", [device.home_id])
+    delete_precomputed_analytics(db, device.home_id)
     db.commit()
+    analytics_cache.invalidate_home(device.home_id)
     db.refresh(db_device)
     return db_device
 
@@ -114,9 +278,26 @@ def get_home_devices(db: Session, home_id: str):
         print(f"数据库查询设备时发生错误: {e}")
         raise
 
+def _device_home_id(db: Session, device_id: str):
+    """设备所属房屋ID"""
+    return db.query(models.Device.home_id).filter(models.Device.device_id == device_id).scalar()
+
 def get_device(db: Session, device_id: str):
     return db.query(models.Device).filter(models.Device.device_id == device_id).first()
 
+def get_existing_device_ids(db: Session, device_ids) -> set:
+    """device_ids中已存在的设备ID"""
+    return {
+        device_id
+        for (device_id,) in db.query(models.Device.device_id).filter(models.Device.device_id.in_(list(device_ids))).all()
+    }
+
+def get_home_device_by_name(db: Session, home_id: str, name: str):
+    """按名称查找房屋中的设备"""
+    return db.query(models.Device).filter(
+        and_(models.Device.home_id == home_id, models.Device.name == name)
+    ).first()
+
 def get_devices(db: Session, home_id: str = None, skip: int = 0, limit: int = 100):
     query = db.query(models.Device)
     if home_id:
@@ -126,59 +307,804 @@ def get_devices(db: Session, home_id: str = None, skip: int = 0, limit: int = 10
 def update_device(db: Session, device_id: str, device: schemas.DeviceUpdate):
     db_device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
     if db_device:
+        old_home_id = db_device.home_id
         update_data = device.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_device, field, value)
+        # 设备移到其他房屋时，两个房屋的客户端和分析结果都受影响
+        affected_homes = list(dict.fromkeys([old_home_id, db_device.home_id]))
+        _record_change(db, db_device, "update", affected_homes)
+        for home_id in sorted(filter(None, affected_homes)):
+            delete_precomputed_analytics(db, home_id)
         db.commit()
+        for home_id in affected_homes:
+            analytics_cache.invalidate_home(home_id)
         db.refresh(db_device)
     return db_device
 
 def delete_device(db: Session, device_id: str):
     db_device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
     if db_device:
+        home_id = db_device.home_id
+        _record_change(db, db_device, "delete", [home_id])
         db.delete(db_device)
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
     return db_device
 
+# Device Usage Hourly rollup
+def _dialect_insert(db: Session):
+    """支持 ON CONFLICT 的INSERT构造函数"""
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+def _upsert_increment(db: Session, model, rows: List[Dict[str, Any]], increment_columns: tuple):
+    """
+    INSERT ... ON CONFLICT DO UPDATE 把rows中的计数累加到汇总表，不提交事务
+    
+    并发写入同一行时由数据库串行累加，不会丢失增量，也不会因同时新建同一行而主键冲突；
+    按主键排序后写入，避免多行更新的事务互相死锁
+    """
+    if not rows:
+        return
+    table = model.__table__
+    key_columns = [column.name for column in table.primary_key.columns]
+    rows = sorted(rows, key=lambda row: tuple(row[column] for column in key_columns))
+    statement = _dialect_insert(db)(table).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={column: table.c[column] + statement.excluded[column] for column in increment_columns}
+    )
+    db.execute(statement)
+
+def _locked_summary_row(db: Session, model, defaults: Dict[str, Any], **key):
+    """
+    确保汇总行存在（INSERT ... ON CONFLICT DO NOTHING）后以 SELECT ... FOR UPDATE 加锁读取，不提交事务
+    
+    用于无法在SQL中累加、需要读出再合并的汇总（草图、统计量）：并发写入同一行时依次进行，
+    不会丢失更新，也不会因同时新建同一行而主键冲突
+    """
+    table = model.__table__
+    # 重新读取会覆盖会话中未flush的修改，先写入
+    db.flush()
+    db.execute(
+        _dialect_insert(db)(table).values(**key, **defaults).on_conflict_do_nothing(
+            index_elements=[column.name for column in table.primary_key.columns]
+        )
+    )
+    return db.query(model).filter_by(**key).with_for_update().populate_existing().one()
+
+ROLLUP_EPSILON_SECONDS = 1e-6  # 浮点累加误差
+
+def apply_usage_rollup(db: Session, device_id: str, starts: np.ndarray, durations: np.ndarray, sign: int = 1):
+    """
+    将一个设备的若干条使用记录按实际时长分摊到小时汇总表（sign=-1时扣减），不提交事务
+    
+    starts为开始时间戳（秒），durations为时长（秒）；扣减后时长和次数都不大于0的小时行直接删除
+    """
+    if len(starts) == 0:
+        return
+    
+    edges = hour_edges(starts.min(), (starts + durations).max())
+    seconds = split_intervals(starts, durations, edges)
+    counts = np.bincount(np.searchsorted(edges, starts, side="right") - 1, minlength=len(edges) - 1)
+    
+    touched = np.flatnonzero((seconds != 0) | (counts != 0))
+    hours = [datetime.fromtimestamp(edges[i]) for i in touched]
+    _upsert_increment(db, models.DeviceUsageHourly, [
+        {
+            "device_id": device_id,
+            "hour_start": hour,
+            "usage_seconds": sign * float(seconds[i]),
+            "session_count": sign * int(counts[i])
+        }
+        for i, hour in zip(touched, hours)
+    ], ("usage_seconds", "session_count"))
+    
+    if sign < 0 and hours:
+        db.query(models.DeviceUsageHourly).filter(
+            and_(
+                models.DeviceUsageHourly.device_id == device_id,
+                models.DeviceUsageHourly.hour_start.in_(hours),
+                models.DeviceUsageHourly.session_count <= 0,
+                models.DeviceUsageHourly.usage_seconds <= ROLLUP_EPSILON_SECONDS
+            )
+        ).delete(synchronize_session=False)
+
+def _apply_usage_log_rollup(db: Session, usage_log: models.DeviceUsageLog, sign: int = 1):
+    """单条使用记录的小时汇总增量"""
+    apply_usage_rollup(
+        db, usage_log.device_id,
+        np.array([usage_log.start_time.timestamp()]),
+        np.array([float(usage_log.duration_seconds or 0)]),
+        sign
+    )
+
+def rebuild_usage_rollup(db: Session, device_id: str = None):
+    """根据原始使用记录重建小时汇总表（可只重建单个设备）"""
+    query = db.query(models.DeviceUsageHourly)
+    if device_id:
+        query = query.filter(models.DeviceUsageHourly.device_id == device_id)
+    query.delete(synchronize_session=False)
+    
+    device_query = db.query(models.DeviceUsageLog.device_id).distinct()
+    if device_id:
+        device_query = device_query.filter(models.DeviceUsageLog.device_id == device_id)
+    
+    for (log_device_id,) in device_query.all():
+        starts, durations = get_device_usage_arrays(db, device_id=log_device_id, start_time=datetime.min)
+        apply_usage_rollup(db, log_device_id, starts, durations)
+        db.flush()
+    db.commit()
+
+# Device co-occurrence (30-minute windows)
+CORRELATION_WINDOW_MINUTES = 30
+CORRELATION_DAYS = 30
+
+def _correlation_window(start_time: datetime) -> datetime:
+    """使用记录所在的30分钟窗口起点"""
+    return start_time.replace(minute=start_time.minute // CORRELATION_WINDOW_MINUTES * CORRELATION_WINDOW_MINUTES,
+                              second=0, microsecond=0)
+
+def _add_cooccurrence_counts(db: Session, home_id: str, day, pairs: Dict[tuple, int]):
+    """
+    把 {(device1, device2): 增量} 累加到某房屋某天的共现计数，不提交事务
+    
+    扣减后不大于0的计数行（如删除回填之前写入、从未计数的记录）直接删除
+    """
+    _upsert_increment(db, models.DeviceCooccurrenceDaily, [
+        {"home_id": home_id, "day": day, "device1": device1, "device2": device2, "window_count": delta}
+        for (device1, device2), delta in pairs.items()
+    ], ("window_count",))
+    if any(delta < 0 for delta in pairs.values()):
+        db.query(models.DeviceCooccurrenceDaily).filter(
+            and_(
+                models.DeviceCooccurrenceDaily.home_id == home_id,
+                models.DeviceCooccurrenceDaily.day == day,
+                models.DeviceCooccurrenceDaily.window_count <= 0
+            )
+        ).delete(synchronize_session=False)
+
+def _apply_usage_log_cooccurrence(db: Session, usage_log: models.DeviceUsageLog, sign: int = 1):
+    """
+    增量维护共现计数：一条记录加入（sign=1）或移出（sign=-1）其30分钟窗口
+    
+    只有当设备在该窗口中首次出现/最后一条记录移出时，才会改变该设备及其与窗口内其他设备的计数
+    """
+    home_id = _device_home_id(db, usage_log.device_id)
+    if home_id is None or usage_log.start_time is None:
+        return
+    
+    window = _correlation_window(usage_log.start_time)
+    window_device_ids = {
+        device_id
+        for (device_id,) in db.query(models.DeviceUsageLog.device_id).join(
+            models.Device, models.Device.device_id == models.DeviceUsageLog.device_id
+        ).filter(
+            and_(
+                models.Device.home_id == home_id,
+                models.DeviceUsageLog.start_time >= window,
+                models.DeviceUsageLog.start_time < window + timedelta(minutes=CORRELATION_WINDOW_MINUTES),
+                models.DeviceUsageLog.usage_id != usage_log.usage_id
+            )
+        ).distinct().all()
+    }
+    if usage_log.device_id in window_device_ids:
+        return
+    
+    pairs = {(usage_log.device_id, usage_log.device_id): sign}
+    for other in window_device_ids:
+        pairs[tuple(sorted((usage_log.device_id, other)))] = sign
+    _add_cooccurrence_counts(db, home_id, window.date(), pairs)
+
+def _cooccurrence_counts_from_logs(db: Session, home_id: str = None):
+    """扫描最近30天的原始使用记录，返回 {(房屋, 天): {(device1, device2): 窗口数}}"""
+    log_query = db.query(
+        models.Device.home_id, models.DeviceUsageLog.device_id, models.DeviceUsageLog.start_time
+    ).join(
+        models.DeviceUsageLog, models.Device.device_id == models.DeviceUsageLog.device_id
+    ).filter(models.DeviceUsageLog.start_time >= datetime.now() - timedelta(days=CORRELATION_DAYS + 1))
+    if home_id:
+        log_query = log_query.filter(models.Device.home_id == home_id)
+    
+    windows = defaultdict(set)
+    for row in log_query.all():
+        windows[(row.home_id, _correlation_window(row.start_time))].add(row.device_id)
+    
+    counts = defaultdict(lambda: defaultdict(int))
+    for (window_home_id, window), device_ids in windows.items():
+        day_counts = counts[(window_home_id, window.date())]
+        ordered = sorted(device_ids)
+        for i, device1 in enumerate(ordered):
+            for device2 in ordered[i:]:
+                day_counts[(device1, device2)] += 1
+    return counts
+
+def rebuild_device_cooccurrence(db: Session, home_id: str = None):
+    """根据最近30天的原始使用记录重建共现计数（可只重建单个房屋）"""
+    query = db.query(models.DeviceCooccurrenceDaily)
+    if home_id:
+        query = query.filter(models.DeviceCooccurrenceDaily.home_id == home_id)
+    query.delete(synchronize_session=False)
+    
+    for (window_home_id, day), pairs in _cooccurrence_counts_from_logs(db, home_id).items():
+        for (device1, device2), count in pairs.items():
+            db.add(models.DeviceCooccurrenceDaily(
+                home_id=window_home_id, day=day, device1=device1, device2=device2, window_count=count
+            ))
+    db.commit()
+
+def prune_device_cooccurrence(db: Session, days: int = CORRELATION_DAYS):
+    """删除滑动窗口之外的共现计数"""
+    cutoff = (datetime.now() - timedelta(days=days)).date()
+    deleted = db.query(models.DeviceCooccurrenceDaily).filter(
+        models.DeviceCooccurrenceDaily.day < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+# Session duration digests (t-digest per device per day)
+def _add_to_duration_digest(db: Session, device_id: str, day, durations):
+    """把若干使用时长加入设备当天的草图（锁定该行后合并），不提交事务"""
+    row = _locked_summary_row(
+        db, models.DeviceDurationDigest, {"session_count": 0, "digest": TDigest().to_dict()},
+        device_id=device_id, day=day
+    )
+    row.digest = TDigest.from_dict(row.digest).add(durations).to_dict()
+    row.session_count = (row.session_count or 0) + len(durations)
+
+def rebuild_duration_digest_day(db: Session, device_id: str, day):
+    """
+    根据原始记录重建设备单日的草图，不提交事务
+    
+    草图不支持删除值，修改或删除使用记录时只重新计算受影响的一天；先锁定草图行再读取原始记录，
+    使等待锁期间提交的写入也被计入
+    """
+    row = _locked_summary_row(
+        db, models.DeviceDurationDigest, {"session_count": 0, "digest": TDigest().to_dict()},
+        device_id=device_id, day=day
+    )
+    day_start = datetime(day.year, day.month, day.day)
+    durations = [
+        float(duration or 0)
+        for (duration,) in db.query(models.DeviceUsageLog.duration_seconds).filter(
+            and_(
+                models.DeviceUsageLog.device_id == device_id,
+                models.DeviceUsageLog.start_time >= day_start,
+                models.DeviceUsageLog.start_time < day_start + timedelta(days=1)
+            )
+        ).all()
+    ]
+    if not durations:
+        db.delete(row)
+        return
+    row.digest = TDigest().add(durations).to_dict()
+    row.session_count = len(durations)
+
+def rebuild_duration_digests(db: Session, device_id: str = None):
+    """根据原始使用记录重建全部草图（可只重建单个设备）"""
+    query = db.query(models.DeviceDurationDigest)
+    if device_id:
+        query = query.filter(models.DeviceDurationDigest.device_id == device_id)
+    query.delete(synchronize_session=False)
+    
+    device_query = db.query(models.DeviceUsageLog.device_id).distinct()
+    if device_id:
+        device_query = device_query.filter(models.DeviceUsageLog.device_id == device_id)
+    
+    for (log_device_id,) in device_query.all():
+        rows = db.query(models.DeviceUsageLog.start_time, models.DeviceUsageLog.duration_seconds).filter(
+            models.DeviceUsageLog.device_id == log_device_id
+        ).all()
+        by_day = defaultdict(list)
+        for start_time, duration in rows:
+            by_day[start_time.date()].append(float(duration or 0))
+        for day, durations in by_day.items():
+            db.add(models.DeviceDurationDigest(
+                device_id=log_device_id, day=day, session_count=len(durations),
+                digest=TDigest().add(durations).to_dict()
+            ))
+        db.flush()
+    db.commit()
+
+# Daily activity sketches (HyperLogLog per day per device type)
+def _locked_activity_sketch_row(db: Session, day, device_type: str):
+    empty = HyperLogLog().to_bytes()
+    return _locked_summary_row(
+        db, models.DailyActivitySketch, {"device_registers": empty, "home_registers": empty},
+        day=day, device_type=device_type
+    )
+
+def _stage_activity_members(db: Session, device_days):
+    """
+    把 (设备ID, 日期) 记入活跃成员表（INSERT ... ON CONFLICT DO NOTHING），不提交事务
+    
+    不读取、不锁定草图行：同一设备同一天重复写入只保留一行，不同设备的写入互不等待；
+    成员由 fold_activity_members 并入草图，查询时与草图一起合并
+    """
+    device_days = set(device_days)
+    if not device_days:
+        return
+    devices = {
+        row.device_id: row
+        for row in db.query(models.Device.device_id, models.Device.device_type, models.Device.home_id).filter(
+            models.Device.device_id.in_({device_id for device_id, _ in device_days})
+        ).all()
+    }
+    rows = sorted(
+        (
+            {"day": day, "device_type": devices[device_id].device_type or "",
+             "device_id": device_id, "home_id": devices[device_id].home_id}
+            for device_id, day in device_days if device_id in devices
+        ),
+        key=lambda row: (row["day"], row["device_type"], row["device_id"])
+    )
+    if rows:
+        table = models.DailyActivityMember.__table__
+        db.execute(_dialect_insert(db)(table).values(rows).on_conflict_do_nothing(
+            index_elements=[column.name for column in table.primary_key.columns]
+        ))
+
+def fold_activity_members(db: Session, before_day: date = None) -> int:
+    """
+    把before_day（默认今天）之前的活跃成员并入每日草图并删除，返回并入的成员数
+    
+    每个 (日期, 设备类型) 锁定草图行后合并、单独提交；只删除已读出的成员，合并期间新插入的成员留待下次
+    """
+    member = models.DailyActivityMember
+    keys = db.query(member.day, member.device_type).filter(
+        member.day < (before_day or date.today())
+    ).distinct().order_by(member.day, member.device_type).all()
+    folded = 0
+    for day, device_type in keys:
+        row = _locked_activity_sketch_row(db, day, device_type)
+        members = db.query(member.device_id, member.home_id).filter(
+            and_(member.day == day, member.device_type == device_type)
+        ).all()
+        row.device_registers = HyperLogLog.from_bytes(row.device_registers).add(m.device_id for m in members).to_bytes()
+        row.home_registers = HyperLogLog.from_bytes(row.home_registers).add(m.home_id for m in members).to_bytes()
+        db.query(member).filter(
+            and_(member.day == day, member.device_type == device_type,
+                 member.device_id.in_([m.device_id for m in members]))
+        ).delete(synchronize_session=False)
+        db.commit()
+        folded += len(members)
+    return folded
+
+def _activity_day_members(db: Session, day_start: datetime, day_end: datetime, device_type: str = None):
+    """[day_start, day_end) 内有使用记录的 (设备类型, 设备ID, 房屋ID)，去重"""
+    query = db.query(models.Device.device_type, models.Device.device_id, models.Device.home_id).join(
+        models.DeviceUsageLog, models.DeviceUsageLog.device_id == models.Device.device_id
+    ).filter(
+        and_(models.DeviceUsageLog.start_time >= day_start, models.DeviceUsageLog.start_time < day_end)
+    )
+    if device_type is not None:
+        query = query.filter(func.coalesce(models.Device.device_type, "") == device_type)
+    return query.distinct().all()
+
+def rebuild_activity_sketch_day(db: Session, device_id: str, day):
+    """
+    根据原始记录重建单日、该设备类型的活跃草图，不提交事务
+    
+    HyperLogLog不支持删除，修改或删除使用记录时使用；先锁定草图行、删除当天该类型待并入的成员，
+    再读取原始记录，在此之前提交的写入都会被计入
+    """
+    device = db.query(models.Device.device_type).filter(models.Device.device_id == device_id).first()
+    if device is None:
+        return
+    device_type = device.device_type or ""
+    row = _locked_activity_sketch_row(db, day, device_type)
+    db.query(models.DailyActivityMember).filter(
+        and_(models.DailyActivityMember.day == day, models.DailyActivityMember.device_type == device_type)
+    ).delete(synchronize_session=False)
+    day_start = datetime(day.year, day.month, day.day)
+    members = _activity_day_members(db, day_start, day_start + timedelta(days=1), device_type)
+    if not members:
+        db.delete(row)
+        return
+    row.device_registers = HyperLogLog().add(member.device_id for member in members).to_bytes()
+    row.home_registers = HyperLogLog().add(member.home_id for member in members).to_bytes()
+
+def rebuild_activity_sketches(db: Session):
+    """根据原始使用记录重建全部活跃草图，逐天读取"""
+    db.query(models.DailyActivitySketch).delete(synchronize_session=False)
+    db.query(models.DailyActivityMember).delete(synchronize_session=False)
+    first, last = db.query(
+        func.min(models.DeviceUsageLog.start_time), func.max(models.DeviceUsageLog.start_time)
+    ).one()
+    if first is not None:
+        day = datetime(first.year, first.month, first.day)
+        while day <= last:
+            by_type = defaultdict(list)
+            for member in _activity_day_members(db, day, day + timedelta(days=1)):
+                by_type[member.device_type or ""].append(member)
+            for device_type, members in by_type.items():
+                db.add(models.DailyActivitySketch(
+                    day=day.date(), device_type=device_type,
+                    device_registers=HyperLogLog().add(member.device_id for member in members).to_bytes(),
+                    home_registers=HyperLogLog().add(member.home_id for member in members).to_bytes()
+                ))
+            db.flush()
+            day += timedelta(days=1)
+    db.commit()
+
+# Device duration running statistics (Welford)
+# 写入时z分数绝对值超过阈值的记录标记为异常；已有记录不足时不判断
+ANOMALY_Z_THRESHOLD = 3.0
+ANOMALY_MIN_SESSIONS = 30
+
+# 使用时长列为 NUMERIC(6,2)
+DURATION_QUANTUM = Decimal("0.01")
+
+def _quantize_duration(value):
+    """
+    按时长列的精度取整（与PostgreSQL相同的四舍五入）
+    
+    写入前对记录取整，使合并进统计量的值与表中保存、之后移除时减去的值一致，均值和M2不会漂移
+    """
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(DURATION_QUANTUM, rounding=ROUND_HALF_UP)
+
+def _duration_stats_row(db: Session, device_id: str, lock: bool = False):
+    query = db.query(models.DeviceDurationStats).filter(models.DeviceDurationStats.device_id == device_id)
+    if lock:
+        db.flush()
+        query = query.with_for_update().populate_existing()
+    return query.first()
+
+def _locked_duration_stats_row(db: Session, device_id: str):
+    """写入时使用：确保统计行存在并加锁，并发写入同一设备时依次合并，不会丢失更新"""
+    return _locked_summary_row(
+        db, models.DeviceDurationStats, {"session_count": 0, "mean_seconds": 0, "m2": 0}, device_id=device_id
+    )
+
+def _row_moments(row) -> running_stats.Moments:
+    if row is None:
+        return running_stats.EMPTY
+    return row.session_count, row.mean_seconds, row.m2
+
+def _score_usage_log(usage_log: models.DeviceUsageLog, moments: running_stats.Moments):
+    """按设备已有的统计量给记录打z分数和异常标记"""
+    z = running_stats.z_score(moments, float(usage_log.duration_seconds or 0), ANOMALY_MIN_SESSIONS)
+    usage_log.duration_zscore = z
+    usage_log.is_anomaly = z is not None and abs(z) > ANOMALY_Z_THRESHOLD
+
+def _add_to_duration_stats(db: Session, device_id: str, durations: np.ndarray, row=None):
+    """把一批时长合并进设备的统计量，不提交事务；row为已加锁的统计行"""
+    if len(durations) == 0:
+        return
+    if row is None:
+        row = _locked_duration_stats_row(db, device_id)
+    count, mean, m2 = running_stats.merge(_row_moments(row) if row.session_count else running_stats.EMPTY,
+                                          running_stats.batch(durations))
+    row.session_count, row.mean_seconds, row.m2 = count, mean, m2
+    low, high = float(np.min(durations)), float(np.max(durations))
+    row.min_seconds = low if row.min_seconds is None else min(row.min_seconds, low)
+    row.max_seconds = high if row.max_seconds is None else max(row.max_seconds, high)
+
+def _remove_from_duration_stats(db: Session, device_id: str, duration: float):
+    """
+    从设备统计量中移除一个时长，不提交事务；调用前须已flush，使原始记录反映移除后的状态
+    
+    均值和M2可直接逆运算，最小/最大值只有被移除的值恰为极值时才重新查询
+    """
+    row = _duration_stats_row(db, device_id, lock=True)
+    if row is None:
+        return
+    count, mean, m2 = running_stats.remove_value(_row_moments(row), duration)
+    if count == 0:
+        db.delete(row)
+        return
+    row.session_count, row.mean_seconds, row.m2 = count, mean, m2
+    if duration <= row.min_seconds or duration >= row.max_seconds:
+        low, high = db.query(
+            func.min(models.DeviceUsageLog.duration_seconds), func.max(models.DeviceUsageLog.duration_seconds)
+        ).filter(models.DeviceUsageLog.device_id == device_id).one()
+        row.min_seconds = float(low) if low is not None else None
+        row.max_seconds = float(high) if high is not None else None
+
+def rebuild_duration_stats(db: Session, device_id: str = None):
+    """根据原始使用记录重建统计量（可只重建单个设备）"""
+    query = db.query(models.DeviceDurationStats)
+    if device_id:
+        query = query.filter(models.DeviceDurationStats.device_id == device_id)
+    query.delete(synchronize_session=False)
+    
+    log_query = db.query(models.DeviceUsageLog.device_id, models.DeviceUsageLog.duration_seconds)
+    if device_id:
+        log_query = log_query.filter(models.DeviceUsageLog.device_id == device_id)
+    durations = defaultdict(list)
+    for log_device_id, duration in log_query.all():
+        durations[log_device_id].append(float(duration or 0))
+    for log_device_id, values in durations.items():
+        row = models.DeviceDurationStats(device_id=log_device_id, session_count=0, mean_seconds=0, m2=0)
+        db.add(row)
+        _add_to_duration_stats(db, log_device_id, np.array(values), row=row)
+    db.commit()
+
+def _duration_stats_dict(moments: running_stats.Moments, low, high) -> Dict[str, Any]:
+    return {
+        "session_count": moments[0],
+        "mean_seconds": moments[1] if moments[0] else None,
+        "std_seconds": running_stats.std(moments),
+        "min_seconds": low,
+        "max_seconds": high
+    }
+
+def get_device_duration_stats(db: Session, home_id: str, device_id: str):
+    """设备全部使用记录的时长统计（读取汇总行）；设备不存在或不在该房屋时返回None"""
+    device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
+    if not device or device.home_id != home_id:
+        return None
+    row = _duration_stats_row(db, device_id)
+    return {
+        "device_id": device_id,
+        "device_name": device.name,
+        **_duration_stats_dict(
+            _row_moments(row), row.min_seconds if row else None, row.max_seconds if row else None
+        )
+    }
+
+def get_home_duration_stats(db: Session, home_id: str):
+    """房屋内各设备及整个房屋的时长统计，房屋统计由各设备的矩合并得到"""
+    rows = db.query(
+        models.Device.device_id, models.Device.name, models.DeviceDurationStats
+    ).outerjoin(
+        models.DeviceDurationStats, models.DeviceDurationStats.device_id == models.Device.device_id
+    ).filter(models.Device.home_id == home_id).order_by(models.Device.device_id).all()
+    
+    devices = []
+    home_moments = running_stats.EMPTY
+    lows, highs = [], []
+    for device_id, name, row in rows:
+        moments = _row_moments(row)
+        home_moments = running_stats.merge(home_moments, moments)
+        if row is not None and row.min_seconds is not None:
+            lows.append(row.min_seconds)
+            highs.append(row.max_seconds)
+        devices.append({
+            "device_id": device_id,
+            "device_name": name,
+            **_duration_stats_dict(moments, row.min_seconds if row else None, row.max_seconds if row else None)
+        })
+    return {
+        "home_id": home_id,
+        **_duration_stats_dict(home_moments, min(lows) if lows else None, max(highs) if highs else None),
+        "devices": devices
+    }
+
 # Device Usage Log CRUD operations
 def create_device_usage_log(db: Session, usage_log: schemas.DeviceUsageLogCreate):
     db_usage_log = models.DeviceUsageLog(**usage_log.dict())
+    db_usage_log.duration_seconds = _quantize_duration(db_usage_log.duration_seconds)
+    stats_row = _locked_duration_stats_row(db, db_usage_log.device_id)
+    _score_usage_log(db_usage_log, _row_moments(stats_row))
+    _add_to_duration_stats(db, db_usage_log.device_id, np.array([float(db_usage_log.duration_seconds or 0)]), stats_row)
     db.add(db_usage_log)
+    _apply_usage_log_rollup(db, db_usage_log)
+    _apply_usage_log_cooccurrence(db, db_usage_log)
+    _add_to_duration_digest(
+        db, db_usage_log.device_id, db_usage_log.start_time.date(), [float(db_usage_log.duration_seconds or 0)]
+    )
+    _stage_activity_members(db, [(db_usage_log.device_id, db_usage_log.start_time.date())])
+    home_id = _device_home_id(db, usage_log.device_id)
+    _record_change(db, db_usage_log, "insert", [home_id])
+    delete_precomputed_analytics(db, home_id)
     db.commit()
+    analytics_cache.invalidate_home(home_id)
     db.refresh(db_usage_log)
     return db_usage_log
 
+def _apply_bulk_cooccurrence(db: Session, usage_logs: List[models.DeviceUsageLog], home_ids: Dict[str, str]):
+    """
+    批量写入的共现计数增量，须在新记录flush之前调用
+    
+    每个 (房屋, 窗口) 只查询一次窗口内已有的设备，只有本批新出现的设备才产生计数
+    """
+    batch_windows = defaultdict(set)
+    day_counts = defaultdict(lambda: defaultdict(int))
+    for usage_log in usage_logs:
+        home_id = home_ids.get(usage_log.device_id)
+        if home_id is not None and usage_log.start_time is not None:
+            batch_windows[(home_id, _correlation_window(usage_log.start_time))].add(usage_log.device_id)
+    
+    for (home_id, window), batch_device_ids in batch_windows.items():
+        existing = {
+            device_id
+            for (device_id,) in db.query(models.DeviceUsageLog.device_id).join(
+                models.Device, models.Device.device_id == models.DeviceUsageLog.device_id
+            ).filter(
+                and_(
+                    models.Device.home_id == home_id,
+                    models.DeviceUsageLog.start_time >= window,
+                    models.DeviceUsageLog.start_time < window + timedelta(minutes=CORRELATION_WINDOW_MINUTES)
+                )
+            ).distinct().all()
+        }
+        added = batch_device_ids - existing
+        ordered = sorted(existing | added)
+        day_pairs = day_counts[(home_id, window.date())]
+        for i, device1 in enumerate(ordered):
+            for device2 in ordered[i:]:
+                if device1 in added or device2 in added:
+                    day_pairs[(device1, device2)] += 1
+    
+    # 同一天的多个窗口合并为一次更新，避免重复新建同一计数行
+    for (home_id, day), pairs in day_counts.items():
+        if pairs:
+            _add_cooccurrence_counts(db, home_id, day, dict(pairs))
+
+def create_device_usage_logs_bulk(db: Session, usage_logs: List[schemas.DeviceUsageLogCreate]):
+    """
+    批量写入使用记录，一次提交
+    
+    各项汇总按设备（或按天）分组后批量更新；z分数相对于本批写入之前的统计量
+    """
+    db_usage_logs = [models.DeviceUsageLog(**usage_log.dict()) for usage_log in usage_logs]
+    by_device = defaultdict(list)
+    for db_usage_log in db_usage_logs:
+        db_usage_log.duration_seconds = _quantize_duration(db_usage_log.duration_seconds)
+        by_device[db_usage_log.device_id].append(db_usage_log)
+    home_ids = dict(
+        db.query(models.Device.device_id, models.Device.home_id).filter(
+            models.Device.device_id.in_(list(by_device))
+        ).all()
+    )
+    
+    _apply_bulk_cooccurrence(db, db_usage_logs, home_ids)
+    # 按设备ID顺序锁定统计行，避免并发的批量写入互相死锁
+    for device_id, device_logs in sorted(by_device.items()):
+        durations = np.array([float(usage_log.duration_seconds or 0) for usage_log in device_logs])
+        stats_row = _locked_duration_stats_row(db, device_id)
+        moments = _row_moments(stats_row)
+        for usage_log in device_logs:
+            _score_usage_log(usage_log, moments)
+        _add_to_duration_stats(db, device_id, durations, stats_row)
+        apply_usage_rollup(
+            db, device_id, to_epoch_seconds([usage_log.start_time for usage_log in device_logs]), durations
+        )
+        by_day = defaultdict(list)
+        for usage_log, duration in zip(device_logs, durations.tolist()):
+            by_day[usage_log.start_time.date()].append(duration)
+        for day, day_durations in sorted(by_day.items()):
+            _add_to_duration_digest(db, device_id, day, day_durations)
+        db.flush()
+    _stage_activity_members(db, [(usage_log.device_id, usage_log.start_time.date()) for usage_log in db_usage_logs])
+    db.add_all(db_usage_logs)
+    for db_usage_log in db_usage_logs:
+        _record_change(db, db_usage_log, "insert", [home_ids.get(db_usage_log.device_id)], flush=False)
+    
+    affected_homes = set(home_ids.values())
+    # 按固定顺序锁定各房屋的版本行，避免并发的批量写入互相死锁
+    for home_id in sorted(filter(None, affected_homes)):
+        delete_precomputed_analytics(db, home_id)
+    db.commit()
+    for home_id in affected_homes:
+        analytics_cache.invalidate_home(home_id)
+    return db_usage_logs
+
 def get_device_usage_log(db: Session, usage_id: str):
     return db.query(models.DeviceUsageLog).filter(models.DeviceUsageLog.usage_id == usage_id).first()
 
+def get_existing_usage_ids(db: Session, usage_ids) -> set:
+    """usage_ids中已存在的使用记录ID"""
+    return {
+        usage_id
+        for (usage_id,) in db.query(models.DeviceUsageLog.usage_id).filter(
+            models.DeviceUsageLog.usage_id.in_(list(usage_ids))
+        ).all()
+    }
+
 def get_device_usage_logs(db: Session, device_id: str = None, skip: int = 0, limit: int = 100):
     query = db.query(models.DeviceUsageLog)
     if device_id:
         query = query.filter(models.DeviceUsageLog.device_id == device_id)
     return query.offset(skip).limit(limit).all()
 
+def get_device_usage_arrays(db: Session, device_id: str, start_time: datetime):
+    """只读取开始时间和时长两列，返回 (开始时间戳, 时长秒) 两个NumPy数组"""
+    rows = db.query(
+        models.DeviceUsageLog.start_time,
+        models.DeviceUsageLog.duration_seconds
+    ).filter(
+        and_(
+            models.DeviceUsageLog.device_id == device_id,
+            models.DeviceUsageLog.start_time >= start_time
+        )
+    ).all()
+    
+    starts = to_epoch_seconds([row.start_time for row in rows])
+    durations = np.fromiter((float(row.duration_seconds or 0) for row in rows), dtype=np.float64, count=len(rows))
+    return starts, durations
+
+def get_home_usage_intervals(db: Session, home_id: str, start_time: datetime, end_time: datetime):
+    """
+    读取房屋内所有设备与 [start_time, end_time) 重叠的使用区间
+    
+    返回 (设备列表, 设备下标数组, 开始时间戳数组, 结束时间戳数组)，区间已截断到窗口内
+    """
+    devices = db.query(models.Device).filter(models.Device.home_id == home_id).order_by(models.Device.device_id).all()
+    device_index = {device.device_id: i for i, device in enumerate(devices)}
+    
+    rows = db.query(
+        models.DeviceUsageLog.device_id,
+        models.DeviceUsageLog.start_time,
+        models.DeviceUsageLog.duration_seconds
+    ).filter(
+        and_(
+            models.DeviceUsageLog.device_id.in_(list(device_index)),
+            models.DeviceUsageLog.start_time >= start_time - timedelta(seconds=MAX_SESSION_SECONDS),
+            models.DeviceUsageLog.start_time < end_time
+        )
+    ).all()
+    
+    groups = np.fromiter((device_index[row.device_id] for row in rows), dtype=np.int64, count=len(rows))
+    starts = to_epoch_seconds([row.start_time for row in rows])
+    durations = np.fromiter((float(row.duration_seconds or 0) for row in rows), dtype=np.float64, count=len(rows))
+    
+    window_start, window_end = start_time.timestamp(), end_time.timestamp()
+    ends = np.minimum(starts + durations, window_end)
+    starts = np.maximum(starts, window_start)
+    keep = ends > starts
+    return devices, groups[keep], starts[keep], ends[keep]
+
 def update_device_usage_log(db: Session, usage_id: str, usage_log: schemas.DeviceUsageLogUpdate):
     db_usage_log = db.query(models.DeviceUsageLog).filter(models.DeviceUsageLog.usage_id == usage_id).first()
     if db_usage_log:
+        _apply_usage_log_rollup(db, db_usage_log, sign=-1)
+        _apply_usage_log_cooccurrence(db, db_usage_log, sign=-1)
+        old_digest_key = (db_usage_log.device_id, db_usage_log.start_time.date())
+        old_duration = float(db_usage_log.duration_seconds or 0)
         update_data = usage_log.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_usage_log, field, value)
+        db_usage_log.duration_seconds = _quantize_duration(db_usage_log.duration_seconds)
+        db.flush()
+        _remove_from_duration_stats(db, old_digest_key[0], old_duration)
+        stats_row = _locked_duration_stats_row(db, db_usage_log.device_id)
+        _score_usage_log(db_usage_log, _row_moments(stats_row))
+        _add_to_duration_stats(db, db_usage_log.device_id, np.array([float(db_usage_log.duration_seconds or 0)]), stats_row)
+        _apply_usage_log_rollup(db, db_usage_log)
+        _apply_usage_log_cooccurrence(db, db_usage_log)
+        # 按固定顺序锁定草图行，避免并发的修改互相死锁
+        for device_id, day in sorted({old_digest_key, (db_usage_log.device_id, db_usage_log.start_time.date())}):
+            rebuild_duration_digest_day(db, device_id, day)
+            rebuild_activity_sketch_day(db, device_id, day)
+        home_id = _device_home_id(db, db_usage_log.device_id)
+        _record_change(db, db_usage_log, "update", [home_id])
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
         db.refresh(db_usage_log)
     return db_usage_log
 
 def delete_device_usage_log(db: Session, usage_id: str):
     db_usage_log = db.query(models.DeviceUsageLog).filter(models.DeviceUsageLog.usage_id == usage_id).first()
     if db_usage_log:
+        _apply_usage_log_rollup(db, db_usage_log, sign=-1)
+        _apply_usage_log_cooccurrence(db, db_usage_log, sign=-1)
+        home_id = _device_home_id(db, db_usage_log.device_id)
+        _record_change(db, db_usage_log, "delete", [home_id])
         db.delete(db_usage_log)
+        db.flush()
+        _remove_from_duration_stats(db, db_usage_log.device_id, float(db_usage_log.duration_seconds or 0))
+        rebuild_duration_digest_day(db, db_usage_log.device_id, db_usage_log.start_time.date())
+        rebuild_activity_sketch_day(db, db_usage_log.device_id, db_usage_log.start_time.date())
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
     return db_usage_log
 
 # Device Feedback CRUD operations
 def create_device_feedback(db: Session, feedback: schemas.DeviceFeedbackCreate):
     db_feedback = models.DeviceFeedback(**feedback.dict())
     db.add(db_feedback)
+    home_id = _device_home_id(db, feedback.device_id)
+    _record_change(db, db_feedback, "insert", [home_id])
+    delete_precomputed_analytics(db, home_id)
     db.commit()
+    analytics_cache.invalidate_home(home_id)
     db.refresh(db_feedback)
     return db_feedback
 
@@ -199,25 +1125,83 @@ def update_device_feedback(db: Session, feedback_id: str, feedback: schemas.Devi
         update_data = feedback.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_feedback, field, value)
+        home_id = _device_home_id(db, db_feedback.device_id)
+        _record_change(db, db_feedback, "update", [home_id])
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
         db.refresh(db_feedback)
     return db_feedback
 
 def delete_device_feedback(db: Session, feedback_id: str):
     db_feedback = db.query(models.DeviceFeedback).filter(models.DeviceFeedback.feedback_id == feedback_id).first()
     if db_feedback:
+        home_id = _device_home_id(db, db_feedback.device_id)
+        _record_change(db, db_feedback, "delete", [home_id])
         db.delete(db_feedback)
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
     return db_feedback
 
 # Security Event CRUD operations
+SECURITY_BURST_ALERT_TYPE = "安全事件突发"
+
+def _emit_security_burst_alerts(db: Session, event: models.SecurityEvent):
+    """更新房屋、设备的滑动窗口计数，超过阈值时在同一事务中写入高优先级警报，返回新警报"""
+    event_time = event.event_time or datetime.now()
+    bursts = security_burst_detector.observe(
+        event_time.timestamp(), home=event.home_id, device=event.device_id
+    )
+    alerts = []
+    for scope, object_id, count in bursts:
+        target = f"房屋 {object_id}" if scope == "home" else f"设备 {object_id}"
+        alerts.append(models.Alert(
+            alert_id=str(uuid.uuid4()),
+            home_id=event.home_id,
+            device_id=event.device_id if scope == "device" else None,
+            alert_type=SECURITY_BURST_ALERT_TYPE,
+            message=f"{target} 在 {int(security_burst_detector.window)} 秒内产生 {count} 条安全事件",
+            severity="high",
+            resolved=False,
+            created_at=datetime.now()
+        ))
+    db.add_all(alerts)
+    return alerts
+
+def _publish_security_messages(home_id: str, event: models.SecurityEvent, alerts: List[models.Alert]):
+    """提交后把新事件和突发警报推送给该房屋的实时订阅者"""
+    messages = [{"type": "security_event", "data": schemas.SecurityEvent.from_orm(event).dict()}]
+    messages.extend({"type": "alert", "data": schemas.Alert.from_orm(alert).dict()} for alert in alerts)
+    for message in messages:
+        hub.publish(home_topic(home_id), message)
+
 def create_security_event(db: Session, event: schemas.SecurityEventCreate):
     db_event = models.SecurityEvent(**event.dict())
     db.add(db_event)
+    # 先flush使主键重复、外键错误在更新突发检测的内存计数之前抛出，失败的写入不计入窗口
+    db.flush()
+    alerts = _emit_security_burst_alerts(db, db_event)
+    _record_change(db, db_event, "insert", [event.home_id])
+    for alert in alerts:
+        _record_change(db, alert, "insert", [event.home_id], flush=False)
+    delete_precomputed_analytics(db, event.home_id)
     db.commit()
+    analytics_cache.invalidate_home(event.home_id)
     db.refresh(db_event)
+    _publish_security_messages(event.home_id, db_event, alerts)
     return db_event
 
+def get_home_system_alerts(db: Session, home_id: str, alert_type: str = None, resolved: bool = None,
+                           skip: int = 0, limit: int = 100):
+    """房屋的系统警报（alerts表），按时间倒序"""
+    query = db.query(models.Alert).filter(models.Alert.home_id == home_id)
+    if alert_type:
+        query = query.filter(models.Alert.alert_type == alert_type)
+    if resolved is not None:
+        query = query.filter(models.Alert.resolved == resolved)
+    return query.order_by(models.Alert.created_at.desc()).offset(skip).limit(limit).all()
+
 def get_security_event(db: Session, event_id: str):
     return db.query(models.SecurityEvent).filter(models.SecurityEvent.event_id == event_id).first()
 
@@ -235,17 +1219,185 @@ def update_security_event(db: Session, event_id: str, event: schemas.SecurityEve
         update_data = event.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_event, field, value)
+        _record_change(db, db_event, "update", [db_event.home_id])
+        delete_precomputed_analytics(db, db_event.home_id)
         db.commit()
+        analytics_cache.invalidate_home(db_event.home_id)
         db.refresh(db_event)
     return db_event
 
 def delete_security_event(db: Session, event_id: str):
     db_event = db.query(models.SecurityEvent).filter(models.SecurityEvent.event_id == event_id).first()
     if db_event:
+        home_id = db_event.home_id
+        _record_change(db, db_event, "delete", [home_id])
         db.delete(db_event)
+        delete_precomputed_analytics(db, home_id)
         db.commit()
+        analytics_cache.invalidate_home(home_id)
     return db_event
 
+# Home activity timeline
+TIMELINE_TYPES = ("usage", "feedback", "security_event")
+
+def _keyset_before(time_column, id_column, before_time, before_id):
+    """(时间, ID) 倒序键集分页条件，before_id为None时包含before_time本身"""
+    if before_time is None:
+        return true()
+    if before_id is None:
+        return time_column <= before_time
+    return or_(time_column < before_time, and_(time_column == before_time, id_column < before_id))
+
+def _timeline_fetcher(db: Session, entity, time_column, id_column, home_filter, join=None):
+    def fetch(before_time, before_id, n):
+        query = db.query(entity)
+        if join is not None:
+            query = query.join(*join)
+        rows = query.filter(
+            home_filter,
+            time_column.isnot(None),
+            _keyset_before(time_column, id_column, before_time, before_id)
+        ).order_by(time_column.desc(), id_column.desc()).limit(n).all()
+        return [(getattr(row, time_column.key), getattr(row, id_column.key), row) for row in rows]
+    return fetch
+
+def _timeline_item(key, obj) -> Dict[str, Any]:
+    time, kind, item_id = key
+    item = {"type": kind, "time": time.isoformat(), "id": item_id, "device_id": obj.device_id}
+    if kind == "usage":
+        item.update(
+            duration_seconds=float(obj.duration_seconds) if obj.duration_seconds is not None else None,
+            is_anomaly=obj.is_anomaly
+        )
+    elif kind == "feedback":
+        item.update(user_id=obj.user_id, problem_description=obj.problem_description, resolved=obj.resolved)
+    return item
+
+def get_home_timeline(db: Session, home_id: str, limit: int = 50, cursor: str = None, types: List[str] = None):
+    """
+    房屋活动时间线：使用记录、反馈、安全事件按时间倒序归并
+
+    cursor为上一页返回的next_cursor；游标无效时抛出 ValueError
+    """
+    types = types or TIMELINE_TYPES
+    device_join = (models.Device, models.Device.device_id == models.DeviceUsageLog.device_id)
+    fetchers = {}
+    if "usage" in types:
+        fetchers["usage"] = _timeline_fetcher(
+            db, models.DeviceUsageLog, models.DeviceUsageLog.start_time, models.DeviceUsageLog.usage_id,
+            models.Device.home_id == home_id, join=device_join
+        )
+    if "feedback" in types:
+        fetchers["feedback"] = _timeline_fetcher(
+            db, models.DeviceFeedback, models.DeviceFeedback.submit_time, models.DeviceFeedback.feedback_id,
+            models.Device.home_id == home_id,
+            join=(models.Device, models.Device.device_id == models.DeviceFeedback.device_id)
+        )
+    if "security_event" in types:
+        fetchers["security_event"] = _timeline_fetcher(
+            db, models.SecurityEvent, models.SecurityEvent.event_time, models.SecurityEvent.event_id,
+            models.SecurityEvent.home_id == home_id
+        )
+
+    page = merge_timeline(fetchers, limit, cursor)
+    page["items"] = [_timeline_item(key, obj) for key, obj in page["items"]]
+    return page
+
+# Precomputed analytics (persistent cache)
+# 预计算结果的最长有效期（小时），夜间任务未按时运行时回退到实时计算
+PRECOMPUTED_MAX_AGE_HOURS = 36
+# 不依赖当前时间的分析（全量统计）；其余分析的窗口随当前日期移动，结果只在计算当天有效
+PRECOMPUTED_WINDOW_INDEPENDENT = {"get_alert_distribution", "get_feedback_distribution"}
+# 不属于任何房屋的写入（如未加入房屋的设备的反馈）计入该版本行，只影响全局结果
+NO_HOME_VERSION_KEY = ""
+
+def get_precomputed_analytics(db: Session, cache_key: str):
+    """
+    读取预计算结果，返回 (是否命中, 结果)
+    
+    超过PRECOMPUTED_MAX_AGE_HOURS的结果视为未命中；按当前时间取窗口的结果过了计算当天的零点即失效；
+    全局结果计算后任一房屋的数据发生变化（全局数据版本不同）即失效
+    """
+    row = db.query(models.PrecomputedAnalytics).filter(
+        models.PrecomputedAnalytics.cache_key == cache_key
+    ).first()
+    if row is None:
+        return False, None
+    now = datetime.now()
+    expires_at = row.computed_at + timedelta(hours=PRECOMPUTED_MAX_AGE_HOURS)
+    if row.function_name not in PRECOMPUTED_WINDOW_INDEPENDENT:
+        expires_at = min(expires_at, datetime.combine(row.computed_at.date() + timedelta(days=1), datetime.min.time()))
+    if now >= expires_at:
+        return False, None
+    if row.home_id is None and row.data_version != get_global_analytics_version(db):
+        return False, None
+    return True, row.result
+
+def get_analytics_version(db: Session, home_id: str) -> int:
+    """房屋数据的版本号，每次写入该房屋的数据时加一"""
+    version = db.query(models.AnalyticsVersion.version).filter(
+        models.AnalyticsVersion.home_id == home_id
+    ).scalar()
+    return version or 0
+
+def get_global_analytics_version(db: Session) -> int:
+    """
+    全局数据版本：各房屋数据版本之和
+    
+    版本号只增不减、版本行不删除，任一房屋的写入提交后总和即变化；写入方只更新自己房屋的版本行，
+    不需要争用同一行
+    """
+    return int(db.query(func.coalesce(func.sum(models.AnalyticsVersion.version), 0)).scalar())
+
+def save_precomputed_analytics(db: Session, cache_key: str, function_name: str, home_id: Optional[str], result,
+                               version: Optional[int] = None) -> bool:
+    """
+    写入或覆盖一条预计算结果
+    
+    version为计算开始前读取的房屋数据版本：保存时锁定该房屋的版本行，版本已变化（计算期间有其他进程写入）
+    则放弃保存并返回False。写入方在同一行上加一并删除旧结果，因此保存与写入不会交错。
+    全局结果的version为全局数据版本，随结果保存，读取时与当前全局数据版本比较
+    """
+    if home_id and version is not None:
+        _upsert_increment(db, models.AnalyticsVersion, [{"home_id": home_id, "version": 0}], ("version",))
+        if get_analytics_version(db, home_id) != version:
+            db.rollback()
+            return False
+    if not home_id and version is not None and get_global_analytics_version(db) != version:
+        return False
+    db.merge(models.PrecomputedAnalytics(
+        cache_key=cache_key,
+        function_name=function_name,
+        home_id=home_id,
+        result=result,
+        computed_at=datetime.now(),
+        data_version=None if home_id else version
+    ))
+    db.commit()
+    return True
+
+def delete_precomputed_analytics(db: Session, home_id: Optional[str]):
+    """
+    房屋数据发生变化：提升该房屋的数据版本并删除其预计算结果，与数据写入在同一事务中执行，不提交事务
+    
+    全局数据版本随之变化，计算早于本次写入的全局结果在读取时视为未命中
+    """
+    _upsert_increment(db, models.AnalyticsVersion, [{"home_id": home_id or NO_HOME_VERSION_KEY, "version": 1}], ("version",))
+    if not home_id:
+        return
+    db.query(models.PrecomputedAnalytics).filter(
+        models.PrecomputedAnalytics.home_id == home_id
+    ).delete(synchronize_session=False)
+
+def get_active_home_ids(db: Session, days: int = 30) -> List[str]:
+    """最近days天内有设备使用记录或安全事件的房屋"""
+    since = datetime.now() - timedelta(days=days)
+    usage_homes = db.query(models.Device.home_id).join(
+        models.DeviceUsageLog, models.Device.device_id == models.DeviceUsageLog.device_id
+    ).filter(models.DeviceUsageLog.start_time >= since)
+    event_homes = db.query(models.SecurityEvent.home_id).filter(models.SecurityEvent.event_time >= since)
+    return sorted({row[0] for row in usage_homes.union(event_homes).all() if row[0]})
+
 # Analytics functions
 # def get_user_homes(db: Session, user_id: str):
 #    """获取用户关联的所有房屋"""
@@ -259,14 +1411,206 @@ def delete_security_event(db: Session, event_id: str):
 
 def get_home_users(db: Session, home_id: str):
     """获取房屋关联的所有用户"""
-    relations = db.query(models.UserHomeRelation).filter(models.UserHomeRelation.home_id == home_id).all()
-    users = []
-    for relation in relations:
-        user = db.query(models.User).filter(models.User.user_id == relation.user_id).first()
-        if user:
-            users.append(user)
+    # 关系与用户一次连接查询取回，不再逐个关系查询用户
+    rows = db.query(models.UserHomeRelation, models.User).outerjoin(
+        models.User, models.User.user_id == models.UserHomeRelation.user_id
+    ).filter(models.UserHomeRelation.home_id == home_id).all()
+    relations = [relation for relation, _ in rows]
+    users = [user for _, user in rows if user is not None]
     return users, relations
 
+# Home dashboard
+# 每个部分一条带CTE的语句，语句数固定，不随设备数增长
+DASHBOARD_USAGE_PERIODS = ["day", "week", "month", "year"]
+
+def _usage_period_starts(now: datetime) -> Dict[str, datetime]:
+    """与get_device_usage_stats一致的各统计周期起点"""
+    return {
+        "day": now.replace(hour=0, minute=0, second=0, microsecond=0),
+        "week": now - timedelta(days=7),
+        "month": now - timedelta(days=30),
+        "year": now - timedelta(days=365),
+    }
+
+def get_dashboard_home(db: Session, home_id: str):
+    """房屋信息及设备数、用户数、警报数，一条语句"""
+    device_count = select(func.count()).select_from(models.Device).where(
+        models.Device.home_id == home_id
+    ).cte("device_count")
+    user_count = select(func.count()).select_from(models.UserHomeRelation).where(
+        models.UserHomeRelation.home_id == home_id
+    ).cte("user_count")
+    alert_count = select(func.count()).select_from(models.SecurityEvent).where(
+        models.SecurityEvent.home_id == home_id
+    ).cte("alert_count")
+    
+    row = db.execute(
+        select(
+            models.Home.home_id,
+            models.Home.area_sqm,
+            models.Home.address,
+            device_count.c[0].label("device_count"),
+            user_count.c[0].label("user_count"),
+            alert_count.c[0].label("alert_count")
+        ).select_from(models.Home).join(device_count, true()).join(user_count, true()).join(alert_count, true())
+        .where(models.Home.home_id == home_id)
+    ).first()
+    return dict(row._mapping) if row else None
+
+def _usage_totals_cte(home_id: str, periods: List[str], now: datetime):
+    """
+    房屋各设备在各统计周期内的使用总时长（{period}_seconds）和次数（{period}_count）
+    
+    使用记录只扫描一次，按最长周期过滤后做条件聚合
+    """
+    period_starts = _usage_period_starts(now)
+    earliest = min(period_starts[period] for period in periods)
+    home_devices = select(models.Device.device_id).where(models.Device.home_id == home_id).cte("home_devices")
+    aggregates = []
+    for period in periods:
+        in_period = models.DeviceUsageLog.start_time >= period_starts[period]
+        aggregates.append(func.sum(case((in_period, models.DeviceUsageLog.duration_seconds), else_=0)).label(f"{period}_seconds"))
+        aggregates.append(func.sum(case((in_period, 1), else_=0)).label(f"{period}_count"))
+    return select(models.DeviceUsageLog.device_id, *aggregates).where(
+        and_(
+            models.DeviceUsageLog.device_id.in_(select(home_devices.c.device_id)),
+            models.DeviceUsageLog.start_time >= earliest
+        )
+    ).group_by(models.DeviceUsageLog.device_id).cte("usage")
+
+def get_dashboard_devices(db: Session, home_id: str, with_usage: bool = True):
+    """
+    房屋设备列表，with_usage时同一条语句中附带各设备日/周/月/年使用总时长（秒）
+    
+    使用记录先在CTE中按设备做条件聚合，一次扫描得到四个周期，再与设备左连接
+    """
+    columns = [
+        models.Device.device_id,
+        models.Device.name,
+        models.Device.device_type,
+        models.Device.room_name,
+        models.Device.install_time
+    ]
+    query = select(*columns).where(models.Device.home_id == home_id)
+    
+    if with_usage:
+        usage = _usage_totals_cte(home_id, DASHBOARD_USAGE_PERIODS, datetime.now())
+        query = select(
+            *columns, *[usage.c[f"{period}_seconds"] for period in DASHBOARD_USAGE_PERIODS]
+        ).outerjoin(usage, usage.c.device_id == models.Device.device_id).where(models.Device.home_id == home_id)
+    
+    rows = db.execute(query.order_by(models.Device.device_id)).all()
+    devices = []
+    for row in rows:
+        device = {
+            "device_id": row.device_id,
+            "name": row.name,
+            "device_type": row.device_type,
+            "room_name": row.room_name,
+            "install_time": row.install_time
+        }
+        if with_usage:
+            device["usage_stats"] = {
+                period: float(row._mapping[f"{period}_seconds"] or 0) for period in DASHBOARD_USAGE_PERIODS
+            }
+        devices.append(device)
+    return devices
+
+@cached_analytics()
+def get_home_usage_stats(db: Session, home_id: str, periods: tuple = tuple(DASHBOARD_USAGE_PERIODS),
+                         sort_by: str = None, top: int = None):
+    """
+    房屋所有设备及各房间在多个统计周期内的使用总时长和次数，一条分组查询
+    
+    设备按sort_by周期（默认第一个周期）的使用时长降序排列，top限制返回的设备数和房间数；
+    房间汇总基于全部设备计算
+    """
+    sort_by = sort_by or periods[0]
+    usage = _usage_totals_cte(home_id, list(periods), datetime.now())
+    sort_column = func.coalesce(usage.c[f"{sort_by}_seconds"], 0)
+    rows = db.execute(
+        select(
+            models.Device.device_id,
+            models.Device.name,
+            models.Device.device_type,
+            models.Device.room_name,
+            *[usage.c[f"{period}_seconds"] for period in periods],
+            *[usage.c[f"{period}_count"] for period in periods]
+        ).outerjoin(usage, usage.c.device_id == models.Device.device_id)
+        .where(models.Device.home_id == home_id)
+        .order_by(sort_column.desc(), models.Device.device_id)
+    ).all()
+    
+    devices = []
+    rooms = {}
+    for row in rows:
+        usage_by_period = {
+            period: {
+                "total_duration": float(row._mapping[f"{period}_seconds"] or 0),
+                "usage_count": int(row._mapping[f"{period}_count"] or 0)
+            }
+            for period in periods
+        }
+        devices.append({
+            "device_id": row.device_id,
+            "device_name": row.name,
+            "device_type": row.device_type,
+            "room_name": row.room_name,
+            "usage": usage_by_period
+        })
+        room = rooms.setdefault(row.room_name, {
+            "room_name": row.room_name,
+            "device_count": 0,
+            "usage": {period: {"total_duration": 0.0, "usage_count": 0} for period in periods}
+        })
+        room["device_count"] += 1
+        for period, totals in usage_by_period.items():
+            room["usage"][period]["total_duration"] += totals["total_duration"]
+            room["usage"][period]["usage_count"] += totals["usage_count"]
+    
+    room_list = sorted(rooms.values(), key=lambda room: room["usage"][sort_by]["total_duration"], reverse=True)
+    return {
+        "home_id": home_id,
+        "periods": list(periods),
+        "sort_by": sort_by,
+        "total_devices": len(devices),
+        "devices": devices[:top] if top else devices,
+        "rooms": room_list[:top] if top else room_list
+    }
+
+def get_dashboard_users(db: Session, home_id: str):
+    """房屋关联用户及其关系，一条连接查询"""
+    rows = db.execute(
+        select(
+            models.User.user_id,
+            models.User.name,
+            models.User.number,
+            models.User.register_time,
+            models.UserHomeRelation.relation
+        ).join(models.UserHomeRelation, models.UserHomeRelation.user_id == models.User.user_id)
+        .where(models.UserHomeRelation.home_id == home_id)
+        .order_by(models.User.user_id)
+    ).all()
+    return [dict(row._mapping) for row in rows]
+
+def get_dashboard_alerts(db: Session, home_id: str, limit: int = 20):
+    """房屋最近的警报事件，附带触发设备的名称和类型"""
+    recent = select(models.SecurityEvent).where(
+        models.SecurityEvent.home_id == home_id
+    ).order_by(models.SecurityEvent.event_time.desc()).limit(limit).cte("recent_events")
+    rows = db.execute(
+        select(
+            recent.c.event_id,
+            recent.c.event_time,
+            recent.c.device_id,
+            models.Device.name.label("device_name"),
+            models.Device.device_type
+        ).outerjoin(models.Device, models.Device.device_id == recent.c.device_id)
+        .order_by(recent.c.event_time.desc())
+    ).all()
+    return [dict(row._mapping) for row in rows]
+
+@cached_analytics(loader=get_precomputed_analytics)
 def get_device_usage_stats(db: Session, home_id: str, device_id: str, period: str):
     """获取设备使用统计（日、周、月、年）"""
     device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
@@ -299,83 +1643,387 @@ def get_device_usage_stats(db: Session, home_id: str, device_id: str, period: st
         "period": period
     }
 
+@cached_analytics(loader=get_precomputed_analytics)
 def get_device_time_slot_usage(db: Session, home_id: str, device_id: str):
     """获取设备使用时间段分布（每2小时一个时间段）"""
     device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
     if not device or device.home_id != home_id:
         return []
     
-    # 获取最近30天的数据
-    start_time = datetime.now() - timedelta(days=30)
-    
-    usage_logs = db.query(models.DeviceUsageLog).filter(
-        and_(
-            models.DeviceUsageLog.device_id == device_id,
-            models.DeviceUsageLog.start_time >= start_time
-        )
-    ).all()
-    
-    time_slots = defaultdict(lambda: {"count": 0, "total_duration": 0})
+    # 获取最近30天的数据，向前多取一个最长会话时长以包含跨入窗口的会话
+    now = datetime.now()
+    start_time = now - timedelta(days=30)
+    starts, durations = get_device_usage_arrays(
+        db, device_id=device_id, start_time=start_time - timedelta(seconds=MAX_SESSION_SECONDS)
+    )
     
-    for log in usage_logs:
-        hour = log.start_time.hour
-        slot = f"{hour//2*2:02d}:00-{(hour//2*2+2)%24:02d}:00"
-        time_slots[slot]["count"] += 1
-        time_slots[slot]["total_duration"] += float(log.duration_seconds)
+    # 截掉窗口起点之前的部分，剩余时长按实际重叠分摊到各时间段
+    clipped_starts = np.maximum(starts, start_time.timestamp())
+    clipped_durations = np.maximum(starts + durations - clipped_starts, 0)
+    edges = day_edges(start_time, (now.date() - start_time.date()).days + 1)
+    slot_seconds = split_by_day_and_slot(clipped_starts, clipped_durations, edges).sum(axis=0)
+    slot_counts = count_by_slot(starts[starts >= start_time.timestamp()], edges)
     
     return [
         {
-            "time_slot": slot,
-            "usage_count": data["count"],
-            "total_duration": data["total_duration"]
+            "time_slot": f"{slot*2:02d}:00-{(slot*2+2)%24:02d}:00",
+            "usage_count": int(slot_counts[slot]),
+            "total_duration": float(slot_seconds[slot])
         }
-        for slot, data in sorted(time_slots.items())
+        for slot in range(len(slot_counts))
+        if slot_counts[slot] > 0 or slot_seconds[slot] > 0
     ]
 
+def get_usage_series(db: Session, home_id: str, start_time: datetime, end_time: datetime,
+                     device_id: str = None, series: str = "sessions"):
+    """
+    使用时间序列，返回 (时间戳数组, 值数组)，值的单位为秒
+    
+    sessions：每次使用一个点（开始时间, 使用时长）；
+    hourly：小时汇总表中每小时的使用时长，没有记录的小时补0
+    """
+    if series == "hourly":
+        query = db.query(
+            models.DeviceUsageHourly.hour_start,
+            func.sum(models.DeviceUsageHourly.usage_seconds)
+        ).filter(
+            and_(
+                models.DeviceUsageHourly.hour_start >= start_time,
+                models.DeviceUsageHourly.hour_start < end_time
+            )
+        )
+        if device_id:
+            query = query.filter(models.DeviceUsageHourly.device_id == device_id)
+        else:
+            query = query.join(
+                models.Device, models.Device.device_id == models.DeviceUsageHourly.device_id
+            ).filter(models.Device.home_id == home_id)
+        rows = query.group_by(models.DeviceUsageHourly.hour_start).all()
+        
+        edges = hour_edges(start_time.timestamp(), end_time.timestamp())[:-1]
+        values = np.zeros(len(edges))
+        if rows:
+            hours = to_epoch_seconds([row[0] for row in rows])
+            index = np.searchsorted(edges, hours)
+            inside = (index < len(edges)) & (edges[np.minimum(index, len(edges) - 1)] == hours)
+            values[index[inside]] = np.array([float(row[1] or 0) for row in rows])[inside]
+        return edges, values
+    
+    query = db.query(models.DeviceUsageLog.start_time, models.DeviceUsageLog.duration_seconds).filter(
+        and_(
+            models.DeviceUsageLog.start_time >= start_time,
+            models.DeviceUsageLog.start_time < end_time
+        )
+    )
+    if device_id:
+        query = query.filter(models.DeviceUsageLog.device_id == device_id)
+    else:
+        query = query.join(
+            models.Device, models.Device.device_id == models.DeviceUsageLog.device_id
+        ).filter(models.Device.home_id == home_id)
+    rows = query.order_by(models.DeviceUsageLog.start_time).all()
+    return (
+        to_epoch_seconds([row[0] for row in rows]),
+        np.fromiter((float(row[1] or 0) for row in rows), dtype=np.float64, count=len(rows))
+    )
+
+@cached_analytics()
+def get_usage_heatmap(db: Session, home_id: str, device_id: str = None, days: int = 365):
+    """
+    使用日历热力图：最近days天（含今天）× 24小时的使用时长矩阵（小时，float32）
+    
+    从小时汇总表一次分组查询读取，device_id为空时为整个房屋所有设备之和
+    """
+    first_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    query = db.query(
+        models.DeviceUsageHourly.hour_start,
+        func.sum(models.DeviceUsageHourly.usage_seconds)
+    ).filter(models.DeviceUsageHourly.hour_start >= first_day)
+    if device_id:
+        query = query.filter(models.DeviceUsageHourly.device_id == device_id)
+    else:
+        query = query.join(
+            models.Device, models.Device.device_id == models.DeviceUsageHourly.device_id
+        ).filter(models.Device.home_id == home_id)
+    rows = query.group_by(models.DeviceUsageHourly.hour_start).all()
+    
+    matrix = day_hour_matrix(
+        [row[0] for row in rows], [(row[1] or 0) / 3600 for row in rows], first_day, days
+    )
+    return {"first_day": first_day.date(), "days": days, "matrix": matrix}
+
+ACTIVITY_PERIODS = ("day", "week", "month")
+
+def _period_start(day, period: str):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+@cached_analytics()
+def get_active_counts(db: Session, start_day, end_day, period: str = "day",
+                      device_type: str = None, by_device_type: bool = False):
+    """
+    活跃设备数、活跃房屋数（近似），按日/周（周一开始）/月分桶，日期范围含两端
+    
+    只读取每日草图和尚未并入草图的活跃成员，按桶求并集；total为整个日期范围的去重数（不是各桶之和）
+    """
+    if period not in ACTIVITY_PERIODS:
+        raise ValueError(f"不支持的周期: {period}，可选: {', '.join(ACTIVITY_PERIODS)}")
+    
+    query = db.query(models.DailyActivitySketch).filter(
+        and_(models.DailyActivitySketch.day >= start_day, models.DailyActivitySketch.day <= end_day)
+    )
+    if device_type is not None:
+        query = query.filter(models.DailyActivitySketch.device_type == device_type)
+    
+    buckets = defaultdict(lambda: (HyperLogLog(), HyperLogLog()))
+    total_devices, total_homes = HyperLogLog(), HyperLogLog()
+    for row in query.all():
+        devices = HyperLogLog.from_bytes(row.device_registers)
+        homes = HyperLogLog.from_bytes(row.home_registers)
+        key = (_period_start(row.day, period), row.device_type if by_device_type else None)
+        buckets[key][0].update(devices)
+        buckets[key][1].update(homes)
+        total_devices.update(devices)
+        total_homes.update(homes)
+    
+    member = models.DailyActivityMember
+    member_query = db.query(member.day, member.device_type, member.device_id, member.home_id).filter(
+        and_(member.day >= start_day, member.day <= end_day)
+    )
+    if device_type is not None:
+        member_query = member_query.filter(member.device_type == device_type)
+    for row in member_query.all():
+        key = (_period_start(row.day, period), row.device_type if by_device_type else None)
+        for sketch in (buckets[key][0], total_devices):
+            sketch.add([row.device_id])
+        for sketch in (buckets[key][1], total_homes):
+            sketch.add([row.home_id])
+    
+    result = []
+    for (bucket_start, bucket_type), (devices, homes) in sorted(buckets.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+        item = {"period_start": bucket_start, "active_devices": devices.count(), "active_homes": homes.count()}
+        if by_device_type:
+            item["device_type"] = bucket_type
+        result.append(item)
+    return {
+        "period": period,
+        "start_day": start_day,
+        "end_day": end_day,
+        "relative_error": total_devices.relative_error,
+        "buckets": result,
+        "total": {"active_devices": total_devices.count(), "active_homes": total_homes.count()}
+    }
+
+DURATION_PERCENTILE_GROUPS = ("device", "device_type", "home", "all")
+
+@cached_analytics()
+def get_duration_percentiles(db: Session, quantiles: tuple = (0.5, 0.9, 0.99), group_by: str = "device",
+                             start_day=None, end_day=None, home_id: str = None,
+                             device_type: str = None, device_id: str = None):
+    """
+    使用时长分位数（秒），按设备/设备类型/房屋/全部分组
+    
+    只读取每设备每日的t-digest草图并合并，不扫描原始使用记录；日期范围按开始时间的日期，含两端
+    """
+    if group_by not in DURATION_PERCENTILE_GROUPS:
+        raise ValueError(f"不支持的分组: {group_by}，可选: {', '.join(DURATION_PERCENTILE_GROUPS)}")
+    
+    digest_table = models.DeviceDurationDigest
+    query = db.query(
+        digest_table.digest, digest_table.session_count,
+        models.Device.device_id, models.Device.device_type, models.Device.home_id
+    ).join(models.Device, models.Device.device_id == digest_table.device_id)
+    if start_day is not None:
+        query = query.filter(digest_table.day >= start_day)
+    if end_day is not None:
+        query = query.filter(digest_table.day <= end_day)
+    if home_id:
+        query = query.filter(models.Device.home_id == home_id)
+    if device_type:
+        query = query.filter(models.Device.device_type == device_type)
+    if device_id:
+        query = query.filter(models.Device.device_id == device_id)
+    
+    groups = defaultdict(list)
+    session_counts = defaultdict(int)
+    for digest, session_count, row_device_id, row_device_type, row_home_id in query.all():
+        key = {"device": row_device_id, "device_type": row_device_type, "home": row_home_id, "all": "all"}[group_by]
+        groups[key].append(TDigest.from_dict(digest))
+        session_counts[key] += session_count or 0
+    
+    result = []
+    for key in sorted(groups, key=str):
+        merged = TDigest.merge_all(groups[key])
+        result.append({
+            "group": key,
+            "session_count": session_counts[key],
+            "min_seconds": merged.min,
+            "max_seconds": merged.max,
+            "percentiles": {
+                f"p{q * 100:g}": value for q, value in zip(quantiles, merged.quantiles(quantiles))
+            }
+        })
+    return result
+
+@cached_analytics(loader=get_precomputed_analytics)
 def get_device_correlation(db: Session, home_id: str):
-    """获取设备使用关联性"""
+    """获取设备使用关联性（基于增量维护的30分钟窗口共现计数）"""
     # 获取房屋中的所有设备
     devices = db.query(models.Device).filter(models.Device.home_id == home_id).all()
     device_ids = [d.device_id for d in devices]
     
-    # 获取最近30天的使用记录
-    start_time = datetime.now() - timedelta(days=30)
-    usage_logs = db.query(models.DeviceUsageLog).filter(
+    # 读取增量维护的最近30天共现计数，组装成 D×D 矩阵（对角线为各设备出现的窗口数）
+    cutoff = (datetime.now() - timedelta(days=CORRELATION_DAYS)).date()
+    rows = db.query(
+        models.DeviceCooccurrenceDaily.device1,
+        models.DeviceCooccurrenceDaily.device2,
+        func.sum(models.DeviceCooccurrenceDaily.window_count).label('window_count')
+    ).filter(
         and_(
-            models.DeviceUsageLog.device_id.in_(device_ids),
-            models.DeviceUsageLog.start_time >= start_time
+            models.DeviceCooccurrenceDaily.home_id == home_id,
+            models.DeviceCooccurrenceDaily.day >= cutoff
         )
-    ).all()
+    ).group_by(models.DeviceCooccurrenceDaily.device1, models.DeviceCooccurrenceDaily.device2).all()
+    if not rows:
+        # 尚未回填共现计数时（如上线前写入或直接导入的记录）回退到扫描原始记录
+        totals = defaultdict(int)
+        for (_, day), pairs in _cooccurrence_counts_from_logs(db, home_id).items():
+            if day >= cutoff:
+                for pair, count in pairs.items():
+                    totals[pair] += count
+        rows = [(device1, device2, count) for (device1, device2), count in totals.items()]
     
-    # 按时间窗口分组（30分钟窗口）
-    time_windows = defaultdict(set)
-    for log in usage_logs:
-        window = log.start_time.replace(minute=log.start_time.minute//30*30, second=0, microsecond=0)
-        time_windows[window].add(log.device_id)
+    index = {device_id: i for i, device_id in enumerate(device_ids)}
+    counts = np.zeros((len(devices), len(devices)))
+    for device1, device2, window_count in rows:
+        if device1 in index and device2 in index:
+            i, j = index[device1], index[device2]
+            counts[i, j] = counts[j, i] = window_count
     
     # 计算设备共现概率
     correlations = []
     for i, device1 in enumerate(devices):
-        for device2 in devices[i+1:]:
-            together_count = 0
-            device1_count = 0
-            
-            for window_devices in time_windows.values():
-                if device1.device_id in window_devices:
-                    device1_count += 1
-                    if device2.device_id in window_devices:
-                        together_count += 1
-            
-            if device1_count > 0:
-                probability = together_count / device1_count
-                correlations.append({
-                    "device1": device1.name,
-                    "device2": device2.name,
-                    "correlation_probability": probability
-                })
+        device1_count = counts[i, i]
+        if device1_count <= 0:
+            continue
+        for j in range(i + 1, len(devices)):
+            correlations.append({
+                "device1": device1.name,
+                "device2": devices[j].name,
+                "correlation_probability": float(counts[i, j] / device1_count)
+            })
+    
+    return correlations
+
+@cached_analytics(loader=get_precomputed_analytics)
+def get_home_concurrency(db: Session, home_id: str, days: int = 30, resolution_minutes: int = 60, peak_limit: int = 20):
+    """房屋设备同时运行数量分析（扫描线），返回并发时间序列、峰值时刻和各设备贡献"""
+    end_time = datetime.now()
+    start_time = (end_time - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    devices, groups, starts, ends = get_home_usage_intervals(db, home_id, start_time, end_time)
+    
+    # 同一设备的重叠会话先合并，保证统计的是同时运行的设备数而不是会话数
+    groups, starts, ends = merge_intervals(groups, starts, ends)
+    times, levels = sweep_concurrency(starts, ends)
+    peak = int(levels.max()) if len(levels) else 0
+    
+    # 按分辨率聚合：每个时间桶的最大并发数与平均并发数
+    bucket_seconds = resolution_minutes * 60
+    edges = np.arange(start_time.timestamp(), end_time.timestamp() + bucket_seconds, bucket_seconds)
+    bucket_count = len(edges) - 1
+    bucket_max = np.zeros(bucket_count, dtype=np.int64)
+    if len(times):
+        # 桶起点时刻的并发数 + 桶内各事件之后的并发数取最大
+        at_edge = np.searchsorted(times, edges[:-1], side="right") - 1
+        bucket_max = np.where(at_edge >= 0, levels[np.maximum(at_edge, 0)], 0)
+        event_bucket = np.searchsorted(edges, times, side="right") - 1
+        inside = (event_bucket >= 0) & (event_bucket < bucket_count)
+        np.maximum.at(bucket_max, event_bucket[inside], levels[inside])
+    bucket_avg = split_intervals(starts, ends - starts, edges) / np.diff(edges)
+    
+    # 峰值片段，以及各设备在峰值/多设备同时运行期间的时长
+    peak_starts, peak_ends = level_runs(times, levels == peak) if peak > 0 else (np.empty(0), np.empty(0))
+    active = np.bincount(groups, weights=ends - starts, minlength=len(devices))
+    overlapped = np.bincount(groups, weights=measure_where(times, levels >= 2, starts, ends), minlength=len(devices))
+    at_peak = np.bincount(groups, weights=measure_where(times, levels == peak, starts, ends), minlength=len(devices))
+    total_peak_seconds = float((peak_ends - peak_starts).sum())
+    
+    return {
+        "home_id": home_id,
+        "days": days,
+        "resolution_minutes": resolution_minutes,
+        "peak_concurrency": peak,
+        "peak_total_seconds": total_peak_seconds,
+        "peak_periods": [
+            {
+                "start": datetime.fromtimestamp(start).isoformat(),
+                "end": datetime.fromtimestamp(end).isoformat(),
+                "duration_seconds": float(end - start)
+            }
+            for start, end in zip(peak_starts[:peak_limit].tolist(), peak_ends[:peak_limit].tolist())
+        ],
+        "series": {
+            "timestamps": [datetime.fromtimestamp(edge).isoformat() for edge in edges[:-1].tolist()],
+            "max_concurrent": bucket_max.tolist(),
+            "avg_concurrent": np.round(bucket_avg, 4).tolist()
+        },
+        "device_contributions": sorted(
+            [
+                {
+                    "device_id": device.device_id,
+                    "device_name": device.name,
+                    "device_type": device.device_type,
+                    "active_seconds": float(active[i]),
+                    "overlap_seconds": float(overlapped[i]),
+                    "peak_seconds": float(at_peak[i]),
+                    "peak_share": float(at_peak[i] / total_peak_seconds) if total_peak_seconds > 0 else 0
+                }
+                for i, device in enumerate(devices)
+            ],
+            key=lambda item: item["peak_seconds"],
+            reverse=True
+        )
+    }
+
+@cached_analytics(loader=get_precomputed_analytics)
+def get_device_overlap_correlation(db: Session, home_id: str, days: int = 30):
+    """
+    基于实际使用区间重叠的设备关联性
+    
+    对每对设备返回重叠时长、Jaccard系数（重叠 / 并集）和提升度
+    （重叠占比 / 两设备各自运行占比之积，>1 表示比独立使用更常同时运行）
+    """
+    end_time = datetime.now()
+    start_time = end_time - timedelta(days=days)
+    devices, groups, starts, ends = get_home_usage_intervals(db, home_id, start_time, end_time)
+    groups, starts, ends = merge_intervals(groups, starts, ends)
+    overlap = pairwise_overlap(groups, starts, ends, len(devices))
+    active = np.diag(overlap)
+    window_seconds = (end_time - start_time).total_seconds()
+    
+    correlations = []
+    for i, device1 in enumerate(devices):
+        for j in range(i + 1, len(devices)):
+            if active[i] <= 0:
+                continue
+            device2 = devices[j]
+            overlap_seconds = float(overlap[i, j])
+            union_seconds = active[i] + active[j] - overlap_seconds
+            correlations.append({
+                "device1": device1.name,
+                "device2": device2.name,
+                "correlation_probability": overlap_seconds / active[i],
+                "overlap_seconds": overlap_seconds,
+                "jaccard": overlap_seconds / union_seconds if union_seconds > 0 else 0,
+                "lift": overlap_seconds * window_seconds / (active[i] * active[j]) if active[j] > 0 else 0
+            })
     
     return correlations
 
+@cached_analytics(loader=get_precomputed_analytics)
 def get_area_usage_correlation(db: Session, device_type: str):
     """分析房屋面积对设备使用行为的影响"""
     # 获取最近30天的数据
@@ -404,6 +2052,128 @@ def get_area_usage_correlation(db: Session, device_type: str):
         for result in results
     ]
 
+def _scale_interval(interval: Dict[str, float], factor: float) -> Dict[str, float]:
+    return {key: value * factor if value is not None else None for key, value in interval.items()}
+
+def get_area_usage_correlation_sampled(db: Session, device_type: str, sample_rate: float,
+                                       confidence: float = 0.95, days: int = 30):
+    """
+    get_area_usage_correlation 的抽样近似版本：只读取最近days天中约sample_rate比例的使用记录
+    
+    每个房屋返回平均使用时长的估计及置信区间，样本中没有记录的房屋不出现在结果中
+    """
+    start_time = datetime.now() - timedelta(days=days)
+    log, sampled = sample_source(db, models.DeviceUsageLog, sample_rate)
+    
+    results = db.query(
+        models.Home.area_sqm,
+        func.count(log.usage_id).label('session_count'),
+        func.sum(log.duration_seconds).label('total_duration'),
+        func.sum(log.duration_seconds * log.duration_seconds).label('total_squares')
+    ).join(
+        models.Device, models.Home.home_id == models.Device.home_id
+    ).join(
+        log, models.Device.device_id == log.device_id
+    ).filter(
+        and_(
+            models.Device.device_type == device_type,
+            log.start_time >= start_time,
+            sampled
+        )
+    ).group_by(models.Home.home_id, models.Home.area_sqm).all()
+    
+    z = z_value(confidence)
+    points = []
+    for result in results:
+        interval = _scale_interval(
+            mean_interval(
+                result.session_count, float(result.total_duration or 0),
+                float(result.total_squares or 0), sample_rate, z
+            ),
+            1 / 86400  # 转换为天
+        )
+        points.append({
+            "area_sqm": float(result.area_sqm),
+            "avg_daily_usage": interval["estimate"],
+            "avg_daily_usage_interval": [interval["lower"], interval["upper"]],
+            "sampled_sessions": result.session_count,
+            "device_type": device_type
+        })
+    return points
+
+def get_area_usage_partials(db: Session, device_type: str, start_time: datetime, home_ids: List[str]):
+    """
+    房屋面积分析的分片部分聚合：home_ids中各房屋该类设备的使用总时长和次数
+    
+    供并行执行器按房屋分片调用，合并后得到与get_area_usage_correlation相同的结果
+    """
+    results = db.query(
+        models.Home.home_id,
+        models.Home.area_sqm,
+        func.sum(models.DeviceUsageLog.duration_seconds).label('total_duration'),
+        func.count(models.DeviceUsageLog.usage_id).label('session_count')
+    ).join(
+        models.Device, models.Home.home_id == models.Device.home_id
+    ).join(
+        models.DeviceUsageLog, models.Device.device_id == models.DeviceUsageLog.device_id
+    ).filter(
+        and_(
+            models.Home.home_id.in_(home_ids),
+            models.Device.device_type == device_type,
+            models.DeviceUsageLog.start_time >= start_time
+        )
+    ).group_by(models.Home.home_id, models.Home.area_sqm).all()
+    
+    return [
+        {
+            "home_id": result.home_id,
+            "area_sqm": float(result.area_sqm),
+            "total_duration": float(result.total_duration or 0),
+            "session_count": int(result.session_count)
+        }
+        for result in results
+    ]
+
+def _correlation_window_index(dialect: str, column):
+    """时间所在30分钟窗口的序号（自1970年起），与_correlation_window的划分一致"""
+    window_seconds = CORRELATION_WINDOW_MINUTES * 60
+    if dialect == "postgresql":
+        return cast(func.floor(extract("epoch", column) / window_seconds), BigInteger)
+    return cast(func.strftime("%s", column), Integer) // window_seconds
+
+def get_device_type_cooccurrence_partials(db: Session, since: datetime, home_ids: List[str]) -> Dict[str, Dict]:
+    """
+    跨房屋设备类型关联的分片部分聚合：home_ids中各房屋自since起的 (房屋, 30分钟窗口)
+    
+    返回 {"windows": {类型: 出现该类型设备的窗口数}, "pairs": {(类型1, 类型2): 两类设备同时出现的窗口数}}，
+    同一窗口内有多个同类设备时只计一次，因此比例不超过1
+    """
+    window = _correlation_window_index(db.get_bind().dialect.name, models.DeviceUsageLog.start_time).label("window")
+    rows = db.query(models.Device.home_id, window, models.Device.device_type).join(
+        models.DeviceUsageLog, models.DeviceUsageLog.device_id == models.Device.device_id
+    ).filter(
+        and_(
+            models.Device.home_id.in_(home_ids),
+            models.DeviceUsageLog.start_time >= since,
+            models.Device.device_type.isnot(None)
+        )
+    ).distinct().all()
+    
+    window_types = defaultdict(set)
+    for home_id, window_index, device_type in rows:
+        window_types[(home_id, window_index)].add(device_type)
+    
+    windows = defaultdict(int)
+    pairs = defaultdict(int)
+    for types in window_types.values():
+        ordered = sorted(types)
+        for i, type1 in enumerate(ordered):
+            windows[type1] += 1
+            for type2 in ordered[i + 1:]:
+                pairs[(type1, type2)] += 1
+    return {"windows": dict(windows), "pairs": dict(pairs)}
+
+@cached_analytics(loader=get_precomputed_analytics)
 def get_alert_distribution(db: Session, home_id: str = None):
     """获取警报类型分布"""
     query = db.query(
@@ -429,12 +2199,13 @@ def get_alert_distribution(db: Session, home_id: str = None):
         for result in results
     ]
 
+@cached_analytics(loader=get_precomputed_analytics)
 def get_feedback_distribution(db: Session):
     """获取用户反馈的设备类型分布"""
     results = db.query(
         models.Device.device_type,
         func.count(models.DeviceFeedback.feedback_id).label('total_feedback'),
-        func.sum(case([(models.DeviceFeedback.resolved == True, 1)], else_=0)).label('resolved_count')
+        func.sum(case((models.DeviceFeedback.resolved == True, 1), else_=0)).label('resolved_count')
     ).join(
         models.DeviceFeedback, models.Device.device_id == models.DeviceFeedback.device_id
     ).group_by(models.Device.device_type).all()
@@ -450,6 +2221,170 @@ def get_feedback_distribution(db: Session):
         for result in results
     ]
 
+def get_alert_distribution_sampled(db: Session, sample_rate: float, confidence: float = 0.95):
+    """get_alert_distribution 的抽样近似版本（全系统）：数量和占比附带置信区间"""
+    event, sampled = sample_source(db, models.SecurityEvent, sample_rate)
+    results = db.query(
+        models.Device.device_type,
+        func.count(event.event_id).label('count')
+    ).join(
+        event, models.Device.device_id == event.device_id
+    ).filter(sampled).group_by(models.Device.device_type).all()
+    
+    z = z_value(confidence)
+    sample_total = sum(result.count for result in results)
+    distribution = []
+    for result in results:
+        count = count_interval(result.count, sample_rate, z)
+        percentage = _scale_interval(proportion_interval(result.count, sample_total, sample_rate, z), 100)
+        distribution.append({
+            "device_type": result.device_type,
+            "count": count["estimate"],
+            "count_interval": [count["lower"], count["upper"]],
+            "percentage": percentage["estimate"],
+            "percentage_interval": [percentage["lower"], percentage["upper"]],
+            "sampled_count": result.count
+        })
+    return distribution
+
+def get_feedback_distribution_sampled(db: Session, sample_rate: float, confidence: float = 0.95):
+    """get_feedback_distribution 的抽样近似版本：反馈数量和已解决比例附带置信区间"""
+    feedback, sampled = sample_source(db, models.DeviceFeedback, sample_rate)
+    results = db.query(
+        models.Device.device_type,
+        func.count(feedback.feedback_id).label('total_feedback'),
+        func.sum(case((feedback.resolved == True, 1), else_=0)).label('resolved_count')
+    ).join(
+        feedback, models.Device.device_id == feedback.device_id
+    ).filter(sampled).group_by(models.Device.device_type).all()
+    
+    z = z_value(confidence)
+    distribution = []
+    for result in results:
+        resolved_count = int(result.resolved_count or 0)
+        total = count_interval(result.total_feedback, sample_rate, z)
+        resolved = count_interval(resolved_count, sample_rate, z)
+        percentage = _scale_interval(
+            proportion_interval(resolved_count, result.total_feedback, sample_rate, z), 100
+        )
+        distribution.append({
+            "device_type": result.device_type,
+            "total_feedback": total["estimate"],
+            "total_feedback_interval": [total["lower"], total["upper"]],
+            "resolved_count": resolved["estimate"],
+            "unresolved_count": total["estimate"] - resolved["estimate"],
+            "resolved_percentage": percentage["estimate"],
+            "resolved_percentage_interval": [percentage["lower"], percentage["upper"]],
+            "sampled_feedback": result.total_feedback
+        })
+    return distribution
+
+@cached_analytics()
+def get_aggregate(db: Session, fact: str, dimensions: tuple, measures: tuple,
+                  start_time: datetime = None, end_time: datetime = None,
+                  home_id: str = None, device_type: str = None,
+                  use_rollup: bool = True, limit: int = 1000):
+    """通用聚合：按白名单维度分组计算度量，一条GROUP BY语句；维度或度量不合法时抛出ValueError"""
+    query, source = build_aggregate_query(
+        db.get_bind().dialect.name, fact, dimensions, measures,
+        start_time=start_time, end_time=end_time, home_id=home_id, device_type=device_type,
+        use_rollup=use_rollup, limit=limit
+    )
+    rows = db.execute(query).all()
+    return {
+        "fact": fact,
+        "dimensions": list(dimensions),
+        "measures": list(measures),
+        "source": source,
+        "rows": format_rows(rows, dimensions, measures)
+    }
+
+# Fleet usage anomalies
+def get_daily_usage_matrix(db: Session, first_day: datetime, days: int):
+    """
+    从小时汇总表读取 设备 × 天 的使用时长矩阵（小时），第j列为first_day之后第j天
+    
+    一次按 (设备, 日期) 分组查询，返回 (设备ID列表, 房屋ID列表, 矩阵)；窗口内没有使用的设备不包含在内
+    """
+    day_column = time_part(db.get_bind().dialect.name, "day", models.DeviceUsageHourly.hour_start).label("day")
+    rows = db.query(
+        models.DeviceUsageHourly.device_id,
+        models.Device.home_id,
+        day_column,
+        func.sum(models.DeviceUsageHourly.usage_seconds)
+    ).join(
+        models.Device, models.Device.device_id == models.DeviceUsageHourly.device_id
+    ).filter(
+        and_(
+            models.DeviceUsageHourly.hour_start >= first_day,
+            models.DeviceUsageHourly.hour_start < first_day + timedelta(days=days)
+        )
+    ).group_by(models.DeviceUsageHourly.device_id, models.Device.home_id, day_column).all()
+    
+    day_index = {(first_day + timedelta(days=j)).strftime("%Y-%m-%d"): j for j in range(days)}
+    device_index = {}
+    home_ids = []
+    for row in rows:
+        if row[0] not in device_index:
+            device_index[row[0]] = len(device_index)
+            home_ids.append(row[1])
+    
+    matrix = np.zeros((len(device_index), days))
+    if rows:
+        device_positions = np.fromiter((device_index[row[0]] for row in rows), dtype=np.int64, count=len(rows))
+        day_positions = np.fromiter((day_index.get(row[2], -1) for row in rows), dtype=np.int64, count=len(rows))
+        hours = np.fromiter((float(row[3] or 0) / 3600 for row in rows), dtype=np.float64, count=len(rows))
+        inside = day_positions >= 0
+        np.add.at(matrix, (device_positions[inside], day_positions[inside]), hours[inside])
+    return list(device_index), home_ids, matrix
+
+def replace_usage_anomalies(db: Session, first_day, last_day, anomalies: List[Dict[str, Any]]):
+    """用一次扫描的结果替换 [first_day, last_day] 内的异常记录"""
+    db.query(models.DeviceUsageAnomaly).filter(
+        and_(models.DeviceUsageAnomaly.day >= first_day, models.DeviceUsageAnomaly.day <= last_day)
+    ).delete(synchronize_session=False)
+    detected_at = datetime.now()
+    db.add_all([models.DeviceUsageAnomaly(detected_at=detected_at, **anomaly) for anomaly in anomalies])
+    db.commit()
+
+def get_usage_anomalies(db: Session, day=None, home_id: str = None, direction: str = None, limit: int = 100):
+    """读取异常扫描结果，day为空时取最近一次扫描到的日期，按z分数绝对值降序"""
+    if day is None:
+        query = db.query(func.max(models.DeviceUsageAnomaly.day))
+        if home_id:
+            query = query.filter(models.DeviceUsageAnomaly.home_id == home_id)
+        day = query.scalar()
+        if day is None:
+            return {"day": None, "anomalies": []}
+    
+    query = db.query(models.DeviceUsageAnomaly, models.Device.name, models.Device.device_type).join(
+        models.Device, models.Device.device_id == models.DeviceUsageAnomaly.device_id
+    ).filter(models.DeviceUsageAnomaly.day == day)
+    if home_id:
+        query = query.filter(models.DeviceUsageAnomaly.home_id == home_id)
+    if direction:
+        query = query.filter(models.DeviceUsageAnomaly.direction == direction)
+    rows = query.order_by(func.abs(models.DeviceUsageAnomaly.robust_zscore).desc()).limit(limit).all()
+    
+    return {
+        "day": day,
+        "anomalies": [
+            {
+                "device_id": anomaly.device_id,
+                "device_name": name,
+                "device_type": device_type,
+                "home_id": anomaly.home_id,
+                "usage_hours": anomaly.usage_hours,
+                "baseline_median_hours": anomaly.baseline_median_hours,
+                "baseline_mad_hours": anomaly.baseline_mad_hours,
+                "robust_zscore": anomaly.robust_zscore,
+                "direction": anomaly.direction,
+                "detected_at": anomaly.detected_at
+            }
+            for anomaly, name, device_type in rows
+        ]
+    }
+
 def get_user_homes(db: Session, user_id: str):
     """获取用户的房屋列表"""
     try:
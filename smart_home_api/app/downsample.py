@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留点的下标（递增）
+
+    首尾两点固定保留，中间的点均分为 max_points-2 个桶；每个桶保留与上一个已选点、
+    下一个桶平均点构成的三角形面积最大的点，能保留峰谷形状。
+    各桶的平均点用前缀和一次算出，桶内面积向量化计算，只有按桶的一层循环（桶之间有顺序依赖）
+    """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # 以第一个点为原点，避免时间戳相乘时损失精度
+    x = x - x[0]
+    buckets = max_points - 2
+    edges = (np.arange(buckets + 1) * ((n - 2) / buckets)).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # 每个桶的平均点；最后一个桶的"下一个桶"为最后一个点
+    x_cumsum = np.concatenate(([0.0], np.cumsum(x)))
+    y_cumsum = np.concatenate(([0.0], np.cumsum(y)))
+    next_start = np.append(edges[1:-1], n - 1)
+    next_end = np.append(edges[2:], n)
+    next_size = next_end - next_start
+    avg_x = (x_cumsum[next_end] - x_cumsum[next_start]) / next_size
+    avg_y = (y_cumsum[next_end] - y_cumsum[next_start]) / next_size
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(buckets):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - avg_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
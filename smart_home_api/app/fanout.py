@@ -0,0 +1,55 @@
+"""
+并发执行互不依赖的数据库查询
+
+组合型接口（如房屋用户、仪表盘）需要的多个查询彼此独立，依次执行时耗时为各查询之和。
+fan_out 把它们分发到有界线程池，每个查询使用连接池中的独立会话，总耗时约等于最慢的一个查询
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+
+# 线程数应不超过连接池容量（默认 pool_size=5 + max_overflow=10），否则查询会排队等待连接
+FANOUT_WORKERS = int(os.getenv("QUERY_FANOUT_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="query-fanout")
+_local = threading.local()
+
+
+def _run_query(query: Callable[[Session], Any]) -> Any:
+    outer = getattr(_local, "in_pool", False)
+    _local.in_pool = True
+    db = SessionLocal()
+    try:
+        return query(db)
+    finally:
+        db.close()
+        _local.in_pool = outer
+
+
+def fan_out(queries: Dict[str, Callable[[Session], Any]]) -> Dict[str, Any]:
+    """
+    并发执行 {名称: query(db)}，返回 {名称: 结果}
+
+    每个query在自己的会话中执行，返回的ORM对象在会话关闭后处于分离状态，只能访问已加载的属性。
+    任一查询抛出异常时，等待其余查询结束后将该异常抛出。
+    在fan_out的查询内部再次调用时顺序执行，避免占满线程池后互相等待
+    """
+    if len(queries) <= 1 or getattr(_local, "in_pool", False):
+        return {name: _run_query(query) for name, query in queries.items()}
+
+    futures = {name: _executor.submit(_run_query, query) for name, query in queries.items()}
+    results = {}
+    error = None
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,104 @@
+import numpy as np
+from typing import Tuple
+
+
+def merge_intervals(groups: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    合并同一分组（如同一设备）内相互重叠或首尾相接的区间
+
+    groups为非负整数分组编号，返回按 (分组, 开始时间) 排序的合并结果 (groups, starts, ends)
+    """
+    if len(starts) == 0:
+        return groups, starts, ends
+
+    order = np.lexsort((starts, groups))
+    groups, starts, ends = groups[order], starts[order], ends[order]
+
+    # 给每个分组加上递增的偏移量，一次maximum.accumulate即可得到组内的累计最大结束时间
+    origin = starts.min()
+    span = ends.max() - origin + 1
+    offset = groups * span
+    running_end = np.maximum.accumulate(ends - origin + offset) - offset + origin
+
+    # 分组变化或开始时间晚于之前所有区间的结束时间时，开始一个新的合并区间
+    new_run = np.ones(len(starts), dtype=bool)
+    new_run[1:] = (groups[1:] != groups[:-1]) | (starts[1:] > running_end[:-1])
+    run_start = np.flatnonzero(new_run)
+    run_end = np.append(run_start[1:], len(starts)) - 1
+
+    return groups[run_start], starts[run_start], running_end[run_end]
+
+
+def sweep_concurrency(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    扫描线计算区间并发数，O(n log n)
+
+    返回 (times, levels)：times为去重后的事件时刻，levels[k]为 [times[k], times[k+1]) 内的并发数。
+    区间为左闭右开，同一时刻先处理结束事件
+    """
+    times = np.concatenate((starts, ends))
+    deltas = np.concatenate((np.ones(len(starts), dtype=np.int64), -np.ones(len(ends), dtype=np.int64)))
+    order = np.lexsort((deltas, times))
+    times = times[order]
+    levels = np.cumsum(deltas[order])
+
+    # 同一时刻只保留处理完所有事件后的并发数
+    last_of_time = np.ones(len(times), dtype=bool)
+    last_of_time[:-1] = times[1:] != times[:-1]
+    return times[last_of_time], levels[last_of_time]
+
+
+def measure_where(times: np.ndarray, mask: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    对每个区间计算其与满足条件的扫描线片段的重叠时长
+
+    times为sweep_concurrency返回的事件时刻，mask[k]表示片段 [times[k], times[k+1]) 是否满足条件。
+    区间端点必须是times中的时刻（即参与扫描的区间本身）
+    """
+    lengths = np.diff(times) * mask[:-1]
+    cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+    return cumulative[np.searchsorted(times, ends)] - cumulative[np.searchsorted(times, starts)]
+
+
+def level_runs(times: np.ndarray, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """返回满足条件的连续片段合并后的 (开始时刻, 结束时刻)"""
+    mask = mask[:-1]
+    if not mask.any():
+        return np.empty(0), np.empty(0)
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    return times[run_starts], times[run_ends]
+
+
+def pairwise_overlap(groups: np.ndarray, starts: np.ndarray, ends: np.ndarray, group_count: int,
+                     chunk_size: int = 65536) -> np.ndarray:
+    """
+    计算各分组两两之间的区间重叠总时长，返回 group_count × group_count 矩阵（对角线为各组自身的覆盖时长）
+
+    区间需先经merge_intervals合并。对所有端点排序后扫描，每个片段内同时活跃的分组两两累加片段长度；
+    活跃状态用按分组的 ±1 累加得到，分块做矩阵乘法以控制内存
+    """
+    overlap = np.zeros((group_count, group_count))
+    if len(starts) == 0:
+        return overlap
+
+    times = np.concatenate((starts, ends))
+    event_groups = np.concatenate((groups, groups))
+    deltas = np.concatenate((np.ones(len(starts), dtype=np.int8), -np.ones(len(ends), dtype=np.int8)))
+    order = np.argsort(times, kind="stable")
+    times, event_groups, deltas = times[order], event_groups[order], deltas[order]
+    # 第k个片段为第k个事件之后到下一事件之前，最后一个事件（必为结束）之后没有片段
+    lengths = np.diff(times)
+    event_groups, deltas = event_groups[:-1], deltas[:-1]
+
+    active = np.zeros(group_count, dtype=np.int8)
+    for chunk_start in range(0, len(lengths), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        chunk_deltas = np.zeros((len(lengths[chunk]), group_count), dtype=np.int8)
+        chunk_deltas[np.arange(len(lengths[chunk])), event_groups[chunk]] = deltas[chunk]
+        states = active + np.cumsum(chunk_deltas, axis=0, dtype=np.int8)
+        active = states[-1]
+        weighted = states.T.astype(np.float64)
+        overlap += (weighted * lengths[chunk]) @ states.astype(np.float64)
+    return overlap
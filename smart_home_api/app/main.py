@@ -9,7 +9,8 @@ from .database import engine
 from . import models
 
 # 导入路由
-from .routers import user, home, device, analytics
+from .routers import user, home, device, analytics, sync
+from .scheduler import scheduler_from_env
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -67,6 +68,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 分析结果夜间预计算（ANALYTICS_PRECOMPUTE_ENABLED=1 时启用）
+precompute_scheduler = scheduler_from_env()
+
+@app.on_event("startup")
+def start_precompute_scheduler():
+    if precompute_scheduler:
+        precompute_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_precompute_scheduler():
+    if precompute_scheduler:
+        precompute_scheduler.stop()
+
 # 全局异常处理器
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -104,6 +118,11 @@ app.include_router(
     prefix="/api/v1"
 )
 
+app.include_router(
+    sync.router,
+    prefix="/api/v1"
+)
+
 # 根路径
 @app.get("/")
 async def read_root():
@@ -142,7 +161,8 @@ async def api_info():
             "users": "/api/v1/users",
             "homes": "/api/v1/homes", 
             "devices": "/api/v1/devices",
-            "analytics": "/api/v1/analytics"
+            "analytics": "/api/v1/analytics",
+            "sync": "/api/v1/sync"
         }
     }
 
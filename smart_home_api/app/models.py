@@ -1,7 +1,7 @@
-from sqlalchemy import Column, String, Integer, Float, Text, Date, DateTime, Boolean, Numeric, ForeignKey, CheckConstraint
+from sqlalchemy import Column, String, Integer, BigInteger, Float, Text, Date, DateTime, Boolean, Numeric, ForeignKey, CheckConstraint, Index, JSON, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 Base = declarative_base()
 
@@ -67,6 +67,13 @@ class DeviceUsageLog(Base):
     device_id = Column(String, ForeignKey("device.device_id"))
     start_time = Column(DateTime)
     duration_seconds = Column(Numeric(6,2))
+    # 写入时相对于该设备已有记录的时长z分数，超过阈值时标记为异常
+    duration_zscore = Column(Float)
+    is_anomaly = Column(Boolean, default=False)
+    
+    __table_args__ = (
+        Index('ix_device_usage_log_device_start', 'device_id', 'start_time'),
+    )
     
     # Relationships
     device = relationship("Device", back_populates="usage_logs")
@@ -81,6 +88,10 @@ class DeviceFeedback(Base):
     problem_description = Column(Text)
     resolved = Column(Boolean, default=False)
     
+    __table_args__ = (
+        Index('ix_device_feedback_device_submit', 'device_id', 'submit_time'),
+    )
+    
     # Relationships
     device = relationship("Device", back_populates="feedbacks")
     user = relationship("User", back_populates="feedbacks")
@@ -93,18 +104,152 @@ class SecurityEvent(Base):
     event_time = Column(DateTime, default=func.now())
     device_id = Column(String, ForeignKey("device.device_id"))
     
+    __table_args__ = (
+        Index('ix_security_event_home_time', 'home_id', 'event_time'),
+    )
+    
     # Relationships
     home = relationship("Home", back_populates="security_events")
     device = relationship("Device", back_populates="security_events")
 
+class DeviceUsageHourly(Base):
+    """设备使用小时汇总表，使用记录按实际重叠时长分摊到每个整点小时"""
+    __tablename__ = "device_usage_hourly"
+    
+    device_id = Column(String, ForeignKey("device.device_id"), primary_key=True)
+    hour_start = Column(DateTime, primary_key=True)
+    usage_seconds = Column(Float, default=0)
+    session_count = Column(Integer, default=0)  # 在该小时内开始的使用次数
+
+class DeviceCooccurrenceDaily(Base):
+    """
+    设备30分钟窗口共现计数（按房屋、按天）
+    
+    device1 < device2 时为两设备同时出现的窗口数；device1 == device2 时为该设备出现的窗口数
+    """
+    __tablename__ = "device_cooccurrence_daily"
+    
+    home_id = Column(String, ForeignKey("home.home_id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    device1 = Column(String, ForeignKey("device.device_id"), primary_key=True)
+    device2 = Column(String, ForeignKey("device.device_id"), primary_key=True)
+    window_count = Column(Integer, default=0)
+
+class DeviceDurationStats(Base):
+    """设备使用时长的在线统计量（Welford：数量、均值、离差平方和），写入使用记录时O(1)更新"""
+    __tablename__ = "device_duration_stats"
+    
+    device_id = Column(String, ForeignKey("device.device_id"), primary_key=True)
+    session_count = Column(Integer, nullable=False, default=0)
+    mean_seconds = Column(Float, nullable=False, default=0)
+    m2 = Column(Float, nullable=False, default=0)
+    min_seconds = Column(Float)
+    max_seconds = Column(Float)
+
+class DeviceDurationDigest(Base):
+    """设备每日使用时长的t-digest草图（按开始时间的本地日期），写入使用记录时增量更新"""
+    __tablename__ = "device_duration_digest"
+    
+    device_id = Column(String, ForeignKey("device.device_id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    session_count = Column(Integer, default=0)
+    digest = Column(JSON, nullable=False)  # {"means": [...], "weights": [...], "min": x, "max": y}
+
+class DailyActivitySketch(Base):
+    """
+    每天每个设备类型的活跃设备、活跃房屋HyperLogLog草图（按使用记录开始时间的本地日期）
+    
+    写入使用记录时只插入 daily_activity_member，夜间预计算时并入草图
+    """
+    __tablename__ = "daily_activity_sketch"
+    
+    day = Column(Date, primary_key=True)
+    device_type = Column(String, primary_key=True)
+    device_registers = Column(LargeBinary, nullable=False)
+    home_registers = Column(LargeBinary, nullable=False)
+
+class DailyActivityMember(Base):
+    """尚未并入 daily_activity_sketch 的当天活跃设备，同一设备同一天只有一行"""
+    __tablename__ = "daily_activity_member"
+    
+    day = Column(Date, primary_key=True)
+    device_type = Column(String, primary_key=True)
+    device_id = Column(String, primary_key=True)
+    home_id = Column(String)
+
+class DeviceUsageAnomaly(Base):
+    """全设备异常扫描结果：设备某天的使用时长相对其前几周基线的稳健z分数超过阈值"""
+    __tablename__ = "device_usage_anomaly"
+    
+    device_id = Column(String, ForeignKey("device.device_id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    home_id = Column(String, index=True)
+    usage_hours = Column(Float, nullable=False)
+    baseline_median_hours = Column(Float, nullable=False)
+    baseline_mad_hours = Column(Float, nullable=False)
+    robust_zscore = Column(Float, nullable=False)
+    direction = Column(String(10), nullable=False)  # spike: 使用显著增加, drop: 显著减少
+    detected_at = Column(DateTime, nullable=False)
+
+class DerivedBackfill(Base):
+    """派生表回填记录：某个回填步骤完成后写入一行，调度器不再重复执行（见 backfill.py）"""
+    __tablename__ = "derived_backfill"
+    
+    step = Column(String(50), primary_key=True)
+    completed_at = Column(DateTime, nullable=False)
+
+class ChangeLog(Base):
+    """
+    变更记录（增量同步的outbox）
+    
+    crud中的每次增删改在同一事务中写入；提交后由排序步骤按可见顺序分配sync_seq，作为客户端增量同步的游标
+    """
+    __tablename__ = "change_log"
+    
+    change_id = Column(Integer, primary_key=True, autoincrement=True)
+    sync_seq = Column(BigInteger, unique=True)  # 尚未排序时为空，对客户端不可见
+    entity = Column(String(50), nullable=False)  # 表名
+    entity_id = Column(String, nullable=False)  # 主键，复合主键用"/"连接
+    home_id = Column(String)  # 为空表示不属于任何房屋（如尚未加入房屋的用户）
+    operation = Column(String(10), nullable=False)  # insert, update, delete
+    payload = Column(JSON)  # 修改后的整行，delete时为空
+    changed_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index('ix_change_log_home_id', 'home_id', 'sync_seq'),
+        Index('ix_change_log_unsequenced', 'change_id', postgresql_where=text('sync_seq IS NULL')),
+    )
+
+class PrecomputedAnalytics(Base):
+    """
+    预计算分析结果（持久化缓存）
+    
+    由夜间预计算任务写入，键为分析函数及其参数的摘要；房屋数据发生变化时删除该房屋的结果
+    """
+    __tablename__ = "analytics_cache"
+    
+    cache_key = Column(String(40), primary_key=True)
+    function_name = Column(String(100), nullable=False)
+    home_id = Column(String, index=True)  # 为空表示全局结果
+    result = Column(JSON, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+    data_version = Column(BigInteger)  # 全局结果计算前的全局数据版本
+
+class AnalyticsVersion(Base):
+    """房屋数据版本号，写入时加一；预计算任务据此判断计算期间数据是否变化（跨进程）"""
+    __tablename__ = "analytics_version"
+    
+    home_id = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
 class Alert(Base):
     """警报表"""
     __tablename__ = "alerts"
     
     alert_id = Column(String, primary_key=True, index=True)
-    home_id = Column(String, ForeignKey("homes.home_id"))
-    device_id = Column(String, ForeignKey("devices.device_id"))
-    alert_type = Column(String)  # 设备故障, 网络异常, 温度异常等
+    home_id = Column(String, ForeignKey("home.home_id"), index=True)
+    device_id = Column(String, ForeignKey("device.device_id"))
+    alert_type = Column(String)  # 设备故障, 网络异常, 温度异常, 安全事件突发等
     message = Column(String)
     severity = Column(String, default="medium")  # low, medium, high
     resolved = Column(Boolean, default=False)
@@ -0,0 +1,185 @@
+"""
+通用聚合查询编译
+
+把 (事实表, 维度, 度量, 过滤条件) 编译为一条 GROUP BY 语句。维度和度量均为白名单，
+不会拼接任何用户输入的SQL。使用记录的聚合在可能时改从小时汇总表 device_usage_hourly 读取
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Integer, and_, case, cast, extract, func, select
+
+from . import models
+
+DIMENSIONS = ["device_type", "room_name", "home_id", "hour", "weekday", "day", "month"]
+TIME_DIMENSIONS = {"hour", "weekday", "day", "month"}
+
+FACT_MEASURES = {
+    "usage": ["count", "sum_duration", "avg_duration"],
+    "feedback": ["count", "resolved_count", "resolved_ratio"],
+    "security": ["count"],
+}
+
+COUNT_MEASURES = {"count", "resolved_count"}
+
+# 小时汇总表能提供的度量；平均时长须按会话计算，汇总表只有分摊到各小时的时长，只能查明细
+ROLLUP_MEASURES = {"count", "sum_duration"}
+
+SUPPORTED_DIALECTS = ("postgresql", "sqlite")
+
+
+def time_part(dialect: str, part: str, column):
+    """
+    按数据库方言取时间维度：hour 0-23，weekday 0-6（周一为0），day 'YYYY-MM-DD'，month 'YYYY-MM'
+    """
+    if dialect == "postgresql":
+        if part == "hour":
+            return cast(extract("hour", column), Integer)
+        if part == "weekday":
+            return cast(extract("isodow", column), Integer) - 1
+        if part == "day":
+            return func.to_char(column, "YYYY-MM-DD")
+        if part == "month":
+            return func.to_char(column, "YYYY-MM")
+    elif dialect == "sqlite":
+        if part == "hour":
+            return cast(func.strftime("%H", column), Integer)
+        if part == "weekday":
+            return (cast(func.strftime("%w", column), Integer) + 6) % 7
+        if part == "day":
+            return func.strftime("%Y-%m-%d", column)
+        if part == "month":
+            return func.strftime("%Y-%m", column)
+    raise ValueError(f"不支持的时间维度或数据库: {part} / {dialect}")
+
+
+def _fact_source(fact: str, use_rollup: bool):
+    """
+    返回 (from子句, 时间列, home_id列, {度量名: 表达式}, 数据来源)
+
+    使用记录在use_rollup时读取小时汇总表：次数为该小时内开始的会话数，
+    时长为落在该小时内的实际使用时长（跨小时的会话按重叠分摊），粒度为小时；不提供平均时长
+    """
+    device = models.Device
+    if fact == "usage" and use_rollup:
+        hourly = models.DeviceUsageHourly
+        return (
+            hourly.__table__.join(device.__table__, device.device_id == hourly.device_id),
+            hourly.hour_start,
+            device.home_id,
+            {
+                "count": func.sum(hourly.session_count),
+                "sum_duration": func.sum(hourly.usage_seconds),
+            },
+            "device_usage_hourly",
+        )
+    if fact == "usage":
+        log = models.DeviceUsageLog
+        return (
+            log.__table__.join(device.__table__, device.device_id == log.device_id),
+            log.start_time,
+            device.home_id,
+            {
+                "count": func.count(log.usage_id),
+                "sum_duration": func.sum(log.duration_seconds),
+                "avg_duration": func.avg(log.duration_seconds),
+            },
+            "device_usage_log",
+        )
+    if fact == "feedback":
+        feedback = models.DeviceFeedback
+        resolved = case((feedback.resolved == True, 1), else_=0)
+        return (
+            feedback.__table__.join(device.__table__, device.device_id == feedback.device_id),
+            feedback.submit_time,
+            device.home_id,
+            {
+                "count": func.count(feedback.feedback_id),
+                "resolved_count": func.sum(resolved),
+                "resolved_ratio": func.avg(resolved),
+            },
+            "device_feedback",
+        )
+    if fact == "security":
+        event = models.SecurityEvent
+        return (
+            event.__table__.outerjoin(device.__table__, device.device_id == event.device_id),
+            event.event_time,
+            event.home_id,
+            {"count": func.count(event.event_id)},
+            "security_event",
+        )
+    raise ValueError(f"不支持的事实表: {fact}，可选: {', '.join(FACT_MEASURES)}")
+
+
+def build_aggregate_query(dialect: str, fact: str, dimensions: Sequence[str], measures: Sequence[str],
+                          start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                          home_id: Optional[str] = None, device_type: Optional[str] = None,
+                          use_rollup: bool = True, limit: int = 1000) -> Tuple[object, str]:
+    """
+    编译聚合请求，返回 (select语句, 数据来源表名)
+
+    维度、度量不在白名单内时抛出ValueError
+    """
+    if fact not in FACT_MEASURES:
+        raise ValueError(f"不支持的事实表: {fact}，可选: {', '.join(FACT_MEASURES)}")
+    unknown = [dimension for dimension in dimensions if dimension not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"不支持的维度: {', '.join(unknown)}，可选: {', '.join(DIMENSIONS)}")
+    unknown = [measure for measure in measures if measure not in FACT_MEASURES[fact]]
+    if unknown or not measures:
+        raise ValueError(f"{fact} 支持的度量: {', '.join(FACT_MEASURES[fact])}")
+    if len(set(dimensions)) != len(dimensions):
+        raise ValueError("维度不能重复")
+    if dialect not in SUPPORTED_DIALECTS and TIME_DIMENSIONS & set(dimensions):
+        raise ValueError(f"数据库 {dialect} 不支持时间维度")
+
+    # 汇总表按整点小时存储，时间过滤条件不在整点或请求了汇总表没有的度量时改查明细
+    hour_aligned = all(
+        t is None or (t.minute == 0 and t.second == 0 and t.microsecond == 0) for t in (start_time, end_time)
+    )
+    use_rollup = use_rollup and hour_aligned and set(measures) <= ROLLUP_MEASURES
+    source, time_column, home_column, measure_columns, source_name = _fact_source(fact, use_rollup)
+
+    dimension_columns = []
+    for dimension in dimensions:
+        if dimension in TIME_DIMENSIONS:
+            column = time_part(dialect, dimension, time_column)
+        elif dimension == "home_id":
+            column = home_column
+        else:
+            column = getattr(models.Device, dimension)
+        dimension_columns.append(column.label(dimension))
+
+    filters = []
+    if start_time is not None:
+        filters.append(time_column >= start_time)
+    if end_time is not None:
+        filters.append(time_column < end_time)
+    if home_id is not None:
+        filters.append(home_column == home_id)
+    if device_type is not None:
+        filters.append(models.Device.device_type == device_type)
+
+    query = select(
+        *dimension_columns, *[measure_columns[measure].label(measure) for measure in measures]
+    ).select_from(source)
+    if filters:
+        query = query.where(and_(*filters))
+    if dimension_columns:
+        query = query.group_by(*dimension_columns).order_by(*dimension_columns)
+    return query.limit(limit), source_name
+
+
+def format_rows(rows, dimensions: Sequence[str], measures: Sequence[str]) -> List[Dict]:
+    """查询结果转换为字典列表，计数为int、其余度量为float，空值为0"""
+    return [
+        {
+            **{dimension: row._mapping[dimension] for dimension in dimensions},
+            **{
+                measure: (int if measure in COUNT_MEASURES else float)(row._mapping[measure] or 0)
+                for measure in measures
+            },
+        }
+        for row in rows
+    ]
@@ -0,0 +1,135 @@
+"""
+系统级分析的多进程并行执行
+
+把房屋划分为若干分片（每片为明确的home_id列表，不依赖数据库排序规则），分发到ProcessPoolExecutor；
+每个工作进程用自己的数据库连接读取分片数据并返回部分聚合，由主进程合并。分片数多于进程数，以平衡各房屋数据量不均的情况
+
+工作进程以spawn方式启动：进程池可能在请求线程中创建，fork会复制父进程的连接池和其他线程持有的锁
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from . import crud, models
+from .database import SessionLocal
+
+# 每个进程分到的分片数
+SHARDS_PER_WORKER = 4
+
+_shared_executor: Optional[ProcessPoolExecutor] = None
+_shared_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    return int(os.getenv("ANALYTICS_PROCESSES", str(os.cpu_count() or 1)))
+
+
+def partition_home_ids(home_ids: Sequence[str], shards: int) -> List[List[str]]:
+    """把房屋ID切成至多shards个分片，各分片房屋数相差不超过1"""
+    home_ids = sorted(home_ids)
+    shards = max(1, min(shards, len(home_ids)))
+    return [
+        chunk
+        for k in range(shards)
+        for chunk in [home_ids[k * len(home_ids) // shards:(k + 1) * len(home_ids) // shards]]
+        if chunk
+    ]
+
+
+def _run_shard(task: Callable, home_ids: List[str], args: tuple):
+    db = SessionLocal()
+    try:
+        return task(db, *args, home_ids=home_ids)
+    finally:
+        db.close()
+
+
+def _new_executor(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _get_shared_executor() -> ProcessPoolExecutor:
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = _new_executor(default_workers())
+            atexit.register(_shared_executor.shutdown)
+        return _shared_executor
+
+
+def run_partitioned(task: Callable, args: tuple = (), workers: Optional[int] = None) -> List[Any]:
+    """
+    对所有房屋按分片并行执行 task(db, *args, home_ids=...)，返回各分片的部分结果
+
+    task须为模块级函数（可被pickle）。workers为空时使用常驻的共享进程池；
+    workers为1时在当前进程内顺序执行
+    """
+    db = SessionLocal()
+    try:
+        home_ids = [row[0] for row in db.query(models.Home.home_id).all()]
+    finally:
+        db.close()
+
+    pool_size = workers or default_workers()
+    shards = partition_home_ids(home_ids, pool_size * SHARDS_PER_WORKER)
+    if not shards:
+        return []
+    if pool_size == 1:
+        return [_run_shard(task, shard, args) for shard in shards]
+
+    count = len(shards)
+    if workers is None:
+        return list(_get_shared_executor().map(_run_shard, [task] * count, shards, [args] * count))
+    with _new_executor(workers) as executor:
+        return list(executor.map(_run_shard, [task] * count, shards, [args] * count))
+
+
+def parallel_area_usage_correlation(device_type: str, days: int = 30,
+                                    workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """并行版的房屋面积对设备使用行为影响分析，结果与crud.get_area_usage_correlation一致"""
+    start_time = datetime.now() - timedelta(days=days)
+    partials = run_partitioned(crud.get_area_usage_partials, (device_type, start_time), workers)
+    return [
+        {
+            "area_sqm": row["area_sqm"],
+            "avg_daily_usage": row["total_duration"] / row["session_count"] / 86400,  # 转换为天
+            "device_type": device_type
+        }
+        for partial in partials
+        for row in partial
+        if row["session_count"] > 0
+    ]
+
+
+def parallel_device_type_correlation(days: int = 30, workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    跨所有房屋的设备类型关联性：出现类型1设备的 (房屋, 30分钟窗口) 中，同时出现类型2设备的比例
+
+    各分片返回各类型出现的窗口数和各类型对同时出现的窗口数，合并时直接相加
+    """
+    since = datetime.now() - timedelta(days=days)
+    partials = run_partitioned(crud.get_device_type_cooccurrence_partials, (since,), workers)
+
+    windows: Dict[str, int] = defaultdict(int)
+    pairs: Dict[tuple, int] = defaultdict(int)
+    for partial in partials:
+        for device_type, count in partial["windows"].items():
+            windows[device_type] += count
+        for key, count in partial["pairs"].items():
+            pairs[key] += count
+
+    correlations = []
+    for (type1, type2), count in pairs.items():
+        for source, target in ((type1, type2), (type2, type1)):
+            correlations.append({
+                "device_type1": source,
+                "device_type2": target,
+                "cooccurrence_windows": count,
+                "correlation_probability": count / windows[source]
+            })
+    return sorted(correlations, key=lambda item: item["correlation_probability"], reverse=True)
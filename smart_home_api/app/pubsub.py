@@ -0,0 +1,109 @@
+"""
+进程内发布/订阅
+
+WebSocket、SSE 连接按房屋订阅，写入安全事件后发布到该房屋的主题。每个订阅者有一个有界队列，
+发布方（同步的crud代码，运行在线程池中）通过 call_soon_threadsafe 投递到订阅者所在的事件循环，不会阻塞；
+队列已满说明客户端消费过慢，直接断开该订阅者，不影响其他订阅者
+
+只在当前进程内分发；多进程部署时客户端只能收到连接所在进程写入的事件
+"""
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Optional, Set
+
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "100"))
+
+
+class Subscription:
+    """一个订阅者；get() 在订阅被关闭（包括因消费过慢被断开）后返回None"""
+
+    _CLOSED = object()
+
+    def __init__(self, hub: "PubSubHub", topic: str, maxsize: int):
+        self.hub = hub
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+        self.dropped = False
+
+    def _deliver(self, message: Any):
+        # 在订阅者的事件循环中执行
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped = True
+            self._close()
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.hub.unsubscribe(self)
+        # 清空积压的消息，保证关闭标记能放入队列
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(self._CLOSED)
+
+    def offer(self, message: Any):
+        """线程安全地投递一条消息"""
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, message)
+        except RuntimeError:
+            # 事件循环已关闭
+            self.hub.unsubscribe(self)
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        """等待下一条消息；超时抛出 asyncio.TimeoutError"""
+        message = await asyncio.wait_for(self.queue.get(), timeout)
+        return None if message is self._CLOSED else message
+
+    def close(self):
+        """消费方退出时调用"""
+        self.closed = True
+        self.hub.unsubscribe(self)
+
+
+class PubSubHub:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic: str) -> Subscription:
+        """在事件循环中调用"""
+        subscription = Subscription(self, topic, self.queue_size)
+        with self._lock:
+            self._subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def publish(self, topic: str, message: Any) -> int:
+        """发布消息，返回投递的订阅者数；可在任意线程中调用"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.offer(message)
+        return len(subscribers)
+
+    def subscriber_count(self, topic: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+
+def home_topic(home_id: str) -> str:
+    return f"home:{home_id}"
+
+
+hub = PubSubHub()
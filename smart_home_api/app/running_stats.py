@@ -0,0 +1,71 @@
+"""
+在线统计量（Welford）
+
+以 (数量, 均值, 离差平方和M2) 表示一组数的矩，单条加入、移除为O(1)，两组的矩可以直接合并（Chan等人的并行公式），
+因此单条写入和批量写入都只需更新汇总行，不需要重新扫描原始记录
+"""
+import math
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+# (count, mean, m2)
+Moments = Tuple[int, float, float]
+
+EMPTY: Moments = (0, 0.0, 0.0)
+
+
+def add_value(moments: Moments, value: float) -> Moments:
+    count, mean, m2 = moments
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    return count, mean, m2 + delta * (value - mean)
+
+
+def remove_value(moments: Moments, value: float) -> Moments:
+    """add_value的逆运算"""
+    count, mean, m2 = moments
+    if count <= 1:
+        return EMPTY
+    new_mean = (count * mean - value) / (count - 1)
+    return count - 1, new_mean, max(m2 - (value - mean) * (value - new_mean), 0.0)
+
+
+def merge(a: Moments, b: Moments) -> Moments:
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    if count == 0:
+        return EMPTY
+    delta = mean_b - mean_a
+    return (
+        count,
+        mean_a + delta * count_b / count,
+        m2_a + m2_b + delta * delta * count_a * count_b / count,
+    )
+
+
+def batch(values: Iterable[float]) -> Moments:
+    """一批数值的矩（向量化计算），可再与已有的矩合并"""
+    values = np.asarray(list(values) if not isinstance(values, np.ndarray) else values, dtype=np.float64)
+    if len(values) == 0:
+        return EMPTY
+    mean = float(values.mean())
+    return len(values), mean, float(np.sum((values - mean) ** 2))
+
+
+def std(moments: Moments) -> Optional[float]:
+    """样本标准差，少于2个值时为None"""
+    count, _, m2 = moments
+    if count < 2:
+        return None
+    return math.sqrt(m2 / (count - 1))
+
+
+def z_score(moments: Moments, value: float, min_count: int = 2) -> Optional[float]:
+    """value相对于这组数的z分数；样本数不足min_count或标准差为0时为None"""
+    deviation = std(moments)
+    if moments[0] < min_count or not deviation:
+        return None
+    return (value - moments[1]) / deviation
@@ -0,0 +1,73 @@
+"""
+抽样近似查询
+
+系统级统计只需要趋势时，按伯努利抽样读取明细表的一部分行，再把样本统计量换算为总体估计和置信区间。
+PostgreSQL 使用 TABLESAMPLE BERNOULLI；SQLite 退化为按 rowid 的乘法哈希过滤（结果可重复，但仍需扫描全表）
+"""
+import math
+from statistics import NormalDist
+from typing import Dict, Optional
+
+from sqlalchemy import func, literal_column, tablesample, true
+from sqlalchemy.orm import Session, aliased
+
+# rowid 哈希：乘以 2^32/黄金分割比 后取低32位，连续的rowid被均匀打散到 [0, 2^32)
+_HASH_MULTIPLIER = 2654435761
+_HASH_SCALE = 1 << 32
+
+
+def sample_source(db: Session, model, rate: float):
+    """
+    返回 (实体, 过滤条件)：查询中用该实体代替model并加上过滤条件，即只读取约rate比例的行
+
+    rate >= 1 时不抽样
+    """
+    if rate >= 1:
+        return model, true()
+    if db.get_bind().dialect.name == "postgresql":
+        sample = tablesample(model.__table__, func.bernoulli(rate * 100))
+        return aliased(model, sample), true()
+    # 不引用列的 random() 条件会被SQLite当作常量提前计算，因此按行的rowid哈希抽样
+    rowid = literal_column(f"{model.__tablename__}.rowid")
+    return model, (rowid * _HASH_MULTIPLIER) % _HASH_SCALE < int(rate * _HASH_SCALE)
+
+
+def z_value(confidence: float) -> float:
+    """双侧置信水平对应的正态分位数，如0.95对应1.96"""
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def _interval(estimate: float, half_width: float, lower_bound: Optional[float] = 0.0,
+              upper_bound: Optional[float] = None) -> Dict[str, float]:
+    lower = estimate - half_width
+    upper = estimate + half_width
+    if lower_bound is not None:
+        lower = max(lower, lower_bound)
+    if upper_bound is not None:
+        upper = min(upper, upper_bound)
+    return {"estimate": estimate, "lower": lower, "upper": upper}
+
+
+def count_interval(sample_count: int, rate: float, z: float) -> Dict[str, float]:
+    """总体行数估计 n/p，伯努利抽样下方差为 n(1-p)/p²"""
+    return _interval(sample_count / rate, z * math.sqrt(sample_count * (1 - rate)) / rate)
+
+
+def mean_interval(sample_count: int, total: float, total_squares: float, rate: float, z: float) -> Dict[str, float]:
+    """总体均值估计，取样本均值，标准误为 s/√n 乘以有限总体修正 √(1-p)"""
+    if sample_count == 0:
+        return {"estimate": None, "lower": None, "upper": None}
+    mean = total / sample_count
+    if sample_count == 1:
+        return {"estimate": mean, "lower": None, "upper": None}
+    variance = max(total_squares - sample_count * mean * mean, 0.0) / (sample_count - 1)
+    return _interval(mean, z * math.sqrt(variance / sample_count * (1 - rate)), lower_bound=None)
+
+
+def proportion_interval(hits: int, sample_count: int, rate: float, z: float) -> Dict[str, float]:
+    """总体比例估计 k/n（正态近似），结果截断到 [0, 1]"""
+    if sample_count == 0:
+        return {"estimate": None, "lower": None, "upper": None}
+    share = hits / sample_count
+    half_width = z * math.sqrt(share * (1 - share) / sample_count * (1 - rate))
+    return _interval(share, half_width, upper_bound=1.0)
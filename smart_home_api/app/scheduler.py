@@ -0,0 +1,279 @@
+"""
+分析结果夜间预计算
+
+在低峰时段为所有活跃房屋计算耗时的分析（使用统计、时间段分布、设备关联性、并发、警报/反馈分布），
+写入持久化缓存表 analytics_cache 并预热进程内缓存，白天的请求只需查表；随后运行全设备使用异常扫描（见 anomaly.py）。
+全量运行开始时先执行尚未完成的派生表回填（见 backfill.py）。
+
+进程内运行：设置环境变量 ANALYTICS_PRECOMPUTE_ENABLED=1，应用启动时开启定时线程；
+多个worker进程都开启时由数据库advisory锁保证只有一个进程执行全量运行
+命令行运行: python -m app.scheduler [--home HOME_ID ...] [--workers N] [--rate R]
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from . import crud, models
+from .anomaly import scan_usage_anomalies
+from .backfill import run_backfills
+from .cache import analytics_cache, cache_key_digest, GLOBAL_SCOPE
+from .database import engine, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+USAGE_PERIODS = ["day", "week", "month", "year"]
+
+# 全量预计算的advisory锁键（任意固定值，与其他使用advisory锁的程序区分即可）
+PRECOMPUTE_LOCK_KEY = 7_305_001
+
+# 变更记录保留天数，超过后客户端需要全量同步
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+
+
+class RateLimiter:
+    """令牌桶限速，rate为每秒允许的任务数，burst为允许的突发数"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+Job = Tuple[Callable, Dict]
+
+
+def _home_jobs(db, home_id: str) -> List[Job]:
+    """单个房屋需要预计算的分析"""
+    jobs: List[Job] = [
+        (crud.get_alert_distribution, {"home_id": home_id}),
+        (crud.get_device_correlation, {"home_id": home_id}),
+        (crud.get_device_overlap_correlation, {"home_id": home_id}),
+        (crud.get_home_concurrency, {"home_id": home_id}),
+    ]
+    for device in crud.get_home_devices(db, home_id=home_id):
+        jobs.append((crud.get_device_time_slot_usage, {"home_id": home_id, "device_id": device.device_id}))
+        for period in USAGE_PERIODS:
+            jobs.append((crud.get_device_usage_stats,
+                         {"home_id": home_id, "device_id": device.device_id, "period": period}))
+    return jobs
+
+
+def _global_jobs(db) -> List[Job]:
+    """系统级分析"""
+    jobs: List[Job] = [
+        (crud.get_alert_distribution, {"home_id": None}),
+        (crud.get_feedback_distribution, {}),
+    ]
+    device_types = db.query(models.Device.device_type).distinct().all()
+    for (device_type,) in device_types:
+        if device_type:
+            jobs.append((crud.get_area_usage_correlation, {"device_type": device_type}))
+    return jobs
+
+
+def _run_job(fn: Callable, kwargs: Dict, limiter: RateLimiter) -> bool:
+    """计算一个分析结果并写入持久化缓存和进程内缓存，每个任务使用独立会话"""
+    limiter.acquire()
+    key, scope = fn.cache_key(**kwargs)
+    db = SessionLocal()
+    try:
+        home_id = None if scope == GLOBAL_SCOPE else scope
+        generation = analytics_cache.generation(scope)
+        version = crud.get_analytics_version(db, home_id) if home_id else crud.get_global_analytics_version(db)
+        result = fn.uncached(db, **kwargs)
+        # 计算期间该房屋数据发生变化（本进程的代数或数据库中的版本号）则丢弃结果，等待下次计算
+        if analytics_cache.generation(scope) != generation:
+            return False
+        if not crud.save_precomputed_analytics(db, cache_key_digest(key), fn.__name__, home_id, result, version):
+            return False
+        analytics_cache.set(key, result, scope, generation)
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.error(f"预计算失败 {fn.__name__}({kwargs}): {e}")
+        return False
+    finally:
+        db.close()
+
+
+@contextmanager
+def _single_runner_lock():
+    """
+    PostgreSQL会话级advisory锁，多个进程（各uvicorn worker、命令行）中同时只有一个能进行全量运行；
+    返回是否获得锁。其他数据库不加锁
+    """
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+    with engine.connect() as connection:
+        acquired = connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": PRECOMPUTE_LOCK_KEY}
+        ).scalar()
+        # 会话级锁在事务提交后仍保持，提交以免连接在整个运行期间处于 idle in transaction
+        connection.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PRECOMPUTE_LOCK_KEY})
+                connection.commit()
+
+
+def precompute_analytics(home_ids: Optional[List[str]] = None, workers: int = 4, rate: float = 20.0,
+                         active_days: int = 30) -> Dict:
+    """
+    预计算分析结果
+
+    home_ids为空时处理最近active_days天的所有活跃房屋，计算系统级分析并运行全设备使用异常扫描；
+    任务分发到workers个线程，总速率不超过每秒rate个任务，避免压垮数据库。
+    全量运行同时只能有一个，其他进程已在运行时直接返回 {"skipped": True}
+    """
+    if home_ids is None:
+        with _single_runner_lock() as acquired:
+            if not acquired:
+                logger.info("其他进程正在运行全量预计算，本次跳过")
+                return {"skipped": True}
+            return _precompute(None, workers, rate, active_days)
+    return _precompute(home_ids, workers, rate, active_days)
+
+
+def _precompute(home_ids: Optional[List[str]], workers: int, rate: float, active_days: int) -> Dict:
+    started = time.perf_counter()
+    full_run = home_ids is None
+    # 预计算和异常扫描读取派生表，须先回填
+    backfilled = run_backfills() if full_run else []
+    db = SessionLocal()
+    try:
+        pruned = pruned_changes = folded = 0
+        if full_run:
+            folded = crud.fold_activity_members(db)
+            home_ids = crud.get_active_home_ids(db, days=active_days)
+            pruned = crud.prune_device_cooccurrence(db)
+            pruned_changes = crud.prune_change_log(db, days=CHANGE_LOG_RETENTION_DAYS)
+            jobs = _global_jobs(db)
+        else:
+            jobs = []
+        for home_id in home_ids:
+            jobs.extend(_home_jobs(db, home_id))
+    finally:
+        db.close()
+
+    limiter = RateLimiter(rate, burst=workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda job: _run_job(job[0], job[1], limiter), jobs))
+
+    anomalies = None
+    if full_run:
+        try:
+            anomalies = scan_usage_anomalies()["anomalies"]
+        except Exception as e:
+            logger.error(f"使用异常扫描失败: {e}")
+
+    summary = {
+        "homes": len(home_ids),
+        "jobs": len(jobs),
+        "succeeded": sum(results),
+        "failed": len(results) - sum(results),
+        "backfilled": backfilled,
+        "pruned_cooccurrence_rows": pruned,
+        "pruned_change_log_rows": pruned_changes,
+        "folded_activity_members": folded,
+        "usage_anomalies": anomalies,
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"分析预计算完成: {summary}")
+    return summary
+
+
+class NightlyScheduler:
+    """每天在固定时刻（本地时间 HH:MM）运行一次预计算的后台线程"""
+
+    def __init__(self, run_at: str = "03:00", workers: int = 4, rate: float = 20.0):
+        hour, minute = (int(part) for part in run_at.split(":"))
+        self.run_at = (hour, minute)
+        self.workers = workers
+        self.rate = rate
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def next_run(self, now: datetime = None) -> datetime:
+        now = now or datetime.now()
+        run = now.replace(hour=self.run_at[0], minute=self.run_at[1], second=0, microsecond=0)
+        return run if run > now else run + timedelta(days=1)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            wait = (self.next_run() - datetime.now()).total_seconds()
+            if self._stop.wait(wait):
+                break
+            try:
+                precompute_analytics(workers=self.workers, rate=self.rate)
+            except Exception as e:
+                logger.error(f"夜间预计算失败: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="analytics-precompute", daemon=True)
+            self._thread.start()
+            logger.info(f"分析预计算定时任务已启动，下次运行: {self.next_run()}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def scheduler_from_env() -> Optional[NightlyScheduler]:
+    """ANALYTICS_PRECOMPUTE_ENABLED 为真时按环境变量创建定时任务"""
+    if os.getenv("ANALYTICS_PRECOMPUTE_ENABLED", "").lower() not in ("1", "true", "yes"):
+        return None
+    return NightlyScheduler(
+        run_at=os.getenv("ANALYTICS_PRECOMPUTE_AT", "03:00"),
+        workers=int(os.getenv("ANALYTICS_PRECOMPUTE_WORKERS", "4")),
+        rate=float(os.getenv("ANALYTICS_PRECOMPUTE_RATE", "20")),
+    )
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="预计算分析结果并写入持久化缓存")
+    parser.add_argument("--home", dest="homes", action="append", help="只处理指定房屋，可重复")
+    parser.add_argument("--workers", type=int, default=4, help="并发线程数")
+    parser.add_argument("--rate", type=float, default=20.0, help="每秒最多执行的任务数，0表示不限速")
+    parser.add_argument("--active-days", type=int, default=30, help="活跃房屋的判定天数")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=engine, tables=[
+        models.PrecomputedAnalytics.__table__, models.AnalyticsVersion.__table__, models.DerivedBackfill.__table__
+    ])
+    summary = precompute_analytics(args.homes, workers=args.workers, rate=args.rate, active_days=args.active_days)
+    print(f"✅ 预计算完成: {summary}")
+
+
+if __name__ == "__main__":
+    main()
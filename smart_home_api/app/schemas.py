@@ -101,6 +101,8 @@ class DeviceUsageLogUpdate(BaseModel):
 class DeviceUsageLog(DeviceUsageLogBase):
     usage_id: str
     device_id: str
+    duration_zscore: Optional[float] = None
+    is_anomaly: Optional[bool] = None
     
     class Config:
         from_attributes = True
@@ -148,6 +150,21 @@ class SecurityEvent(SecurityEventBase):
     class Config:
         from_attributes = True
 
+# Alert schemas（由系统生成的警报，如安全事件突发）
+class Alert(BaseModel):
+    alert_id: str
+    home_id: Optional[str] = None
+    device_id: Optional[str] = None
+    alert_type: Optional[str] = None
+    message: Optional[str] = None
+    severity: Optional[str] = None
+    resolved: Optional[bool] = None
+    created_at: Optional[datetime] = None
+    resolved_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
 # Analytics schemas
 class UsageStats(BaseModel):
     total_duration: float
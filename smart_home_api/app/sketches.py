@@ -0,0 +1,208 @@
+"""
+可合并的概率草图
+
+- t-digest：分位数。每个设备每天一个草图，任意时间范围、任意分组的分位数由相应草图合并得到
+- HyperLogLog：去重计数。每天每个设备类型一个草图，任意时间范围的活跃设备数、活跃房屋数由寄存器取最大值合并
+
+t-digest在写入使用记录时增量更新；HyperLogLog写入时只记录当天活跃成员，夜间并入草图。查询时不需要扫描原始记录
+"""
+import hashlib
+import math
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+# 压缩参数：质心数约为 compression/2，越大越精确
+DEFAULT_COMPRESSION = 200
+
+
+def _k_scale(q: np.ndarray, compression: float) -> np.ndarray:
+    """k1 尺度函数，两端（q接近0或1）的质心更小，尾部分位数更精确"""
+    return compression / (2 * math.pi) * np.arcsin(2 * np.clip(q, 0, 1) - 1)
+
+
+def _k_inverse(k: float, compression: float) -> float:
+    """k尺度函数的反函数，超出范围时截断到 [0, 1]"""
+    return (math.sin(min(k * 2 * math.pi / compression, math.pi / 2)) + 1) / 2
+
+
+class TDigest:
+    """
+    t-digest：用 (均值, 权重) 质心近似数据分布
+
+    压缩时相邻质心按k尺度合并，每个质心覆盖的k跨度不超过1；两个草图合并只需拼接质心后重新压缩，
+    因此可以按天、按设备、按房屋逐层合并
+    """
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION, means: Sequence[float] = (),
+                 weights: Sequence[float] = (), minimum: float = math.inf, maximum: float = -math.inf):
+        self.compression = compression
+        self.means = np.asarray(means, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.min = minimum
+        self.max = maximum
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        if len(means) <= 1 or total <= 0:
+            self.means, self.weights = means, weights
+            return
+
+        # 第一步（向量化）：按更细的k尺度（4倍压缩参数）把相邻质心分组合并，大批量合并时先把数量降下来
+        fine = 4 * self.compression
+        q_left = (np.cumsum(weights) - weights) / total
+        group = np.floor(_k_scale(q_left, fine) - _k_scale(np.zeros(1), fine)[0])
+        group = np.concatenate(([0], np.cumsum(group[1:] != group[:-1])))
+        weights_sum = np.bincount(group, weights=weights)
+        means = np.bincount(group, weights=means * weights) / weights_sum
+        weights = weights_sum
+
+        # 第二步：标准的顺序合并，保证每个质心的k跨度不超过1
+        merged_means, merged_weights = [], []
+        current_mean, current_weight = float(means[0]), float(weights[0])
+        weight_so_far = 0.0
+        limit = total * _k_inverse(_k_scale(np.zeros(1), self.compression)[0] + 1, self.compression)
+        for mean, weight in zip(means[1:].tolist(), weights[1:].tolist()):
+            if weight_so_far + current_weight + weight <= limit:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                merged_means.append(current_mean)
+                merged_weights.append(current_weight)
+                weight_so_far += current_weight
+                limit = total * _k_inverse(
+                    _k_scale(np.array([weight_so_far / total]), self.compression)[0] + 1, self.compression
+                )
+                current_mean, current_weight = mean, weight
+        merged_means.append(current_mean)
+        merged_weights.append(current_weight)
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights)
+
+    def add(self, values: Iterable[float]) -> "TDigest":
+        """加入一批数值"""
+        values = np.asarray(list(values) if not isinstance(values, np.ndarray) else values, dtype=np.float64)
+        if len(values) == 0:
+            return self
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        means = np.concatenate((self.means, values))
+        weights = np.concatenate((self.weights, np.ones(len(values))))
+        # 质心数不多时保留原值（精确），超过上限才压缩，逐条加入时压缩次数也被摊薄
+        if len(means) > 2 * self.compression:
+            self._compress(means, weights)
+        else:
+            order = np.argsort(means, kind="stable")
+            self.means, self.weights = means[order], weights[order]
+        return self
+
+    @classmethod
+    def merge_all(cls, digests: Iterable["TDigest"], compression: float = DEFAULT_COMPRESSION) -> "TDigest":
+        """合并多个草图，一次拼接全部质心后压缩"""
+        digests = [digest for digest in digests if len(digest.means)]
+        merged = cls(compression)
+        if not digests:
+            return merged
+        merged.min = min(digest.min for digest in digests)
+        merged.max = max(digest.max for digest in digests)
+        merged._compress(
+            np.concatenate([digest.means for digest in digests]),
+            np.concatenate([digest.weights for digest in digests])
+        )
+        return merged
+
+    def quantiles(self, qs: Sequence[float]) -> List[float]:
+        """估计多个分位数；在相邻质心中心之间线性插值，两端以最小、最大值为界"""
+        if len(self.means) == 0:
+            return [None for _ in qs]
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        xp = np.concatenate(([0.0], centers, [total]))
+        fp = np.concatenate(([self.min], self.means, [self.max]))
+        return np.interp(np.asarray(qs, dtype=np.float64) * total, xp, fp).tolist()
+
+    def to_dict(self) -> Dict:
+        return {
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist(),
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, compression: float = DEFAULT_COMPRESSION) -> "TDigest":
+        return cls(compression, data["means"], data["weights"], data["min"], data["max"])
+
+
+# HyperLogLog精度：寄存器数 2^precision，相对标准误差约 1.04/sqrt(2^precision)
+DEFAULT_HLL_PRECISION = 12
+
+
+class HyperLogLog:
+    """
+    HyperLogLog 去重计数，寄存器为uint8数组，可序列化为 2^precision 字节
+
+    两个草图的并集为寄存器逐位取最大值，与加入顺序、重复加入无关
+    """
+
+    def __init__(self, precision: int = DEFAULT_HLL_PRECISION, registers: bytes = None):
+        self.precision = precision
+        size = 1 << precision
+        if registers is None:
+            self.registers = np.zeros(size, dtype=np.uint8)
+        else:
+            self.registers = np.frombuffer(registers, dtype=np.uint8).copy()
+            if len(self.registers) != size:
+                raise ValueError(f"寄存器长度 {len(self.registers)} 与精度 {precision} 不符")
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(1 << self.precision)
+
+    def add(self, values: Iterable[str]) -> "HyperLogLog":
+        """加入一批值（按字符串哈希）"""
+        width = 64 - self.precision
+        for value in values:
+            hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+            index = hashed >> width
+            rank = width - (hashed & ((1 << width) - 1)).bit_length() + 1
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+        return self
+
+    def update(self, other: "HyperLogLog") -> "HyperLogLog":
+        """并入另一个草图"""
+        if other.precision != self.precision:
+            raise ValueError("精度不同的草图不能合并")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @classmethod
+    def union(cls, sketches: Iterable["HyperLogLog"], precision: int = DEFAULT_HLL_PRECISION) -> "HyperLogLog":
+        merged = cls(precision)
+        for sketch in sketches:
+            merged.update(sketch)
+        return merged
+
+    def count(self) -> int:
+        """估计去重数；基数较小（有空寄存器且估计值不超过2.5m）时改用线性计数"""
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, precision: int = DEFAULT_HLL_PRECISION) -> "HyperLogLog":
+        return cls(precision, data)
@@ -0,0 +1,150 @@
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence
+
+# 每2小时一个时间段的标签
+TIME_SLOTS = [f"{h:02d}:00-{h + 2:02d}:00" for h in range(0, 24, 2)]
+
+SECONDS_PER_SLOT = 2 * 3600
+
+# duration_seconds 为 NUMERIC(6,2)，单次使用不会超过该时长；
+# 按开始时间取窗口时需要向前多取这么久，才能拿到跨入窗口的会话
+MAX_SESSION_SECONDS = 10000
+
+
+def to_epoch_seconds(times: Sequence[datetime]) -> np.ndarray:
+    """将datetime序列转换为秒级时间戳数组（无时区的时间按本地时间处理）"""
+    return np.fromiter((t.timestamp() for t in times), dtype=np.float64, count=len(times))
+
+
+def day_edges(first_day: datetime, days: int) -> np.ndarray:
+    """返回从first_day零点开始连续days天的本地零点时间戳（共days+1个边界）"""
+    first_day = first_day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return np.array(
+        [(first_day + timedelta(days=i)).timestamp() for i in range(days + 1)],
+        dtype=np.float64
+    )
+
+
+def hour_edges(start: float, end: float) -> np.ndarray:
+    """返回覆盖 [start, end) 的整点时间戳边界（按本地时间取整点）"""
+    first = datetime.fromtimestamp(start).replace(minute=0, second=0, microsecond=0).timestamp()
+    count = int(np.ceil((end - first) / 3600)) or 1
+    return first + 3600.0 * np.arange(count + 1)
+
+
+def split_intervals(starts: np.ndarray, durations: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    将每个区间 [start, start + duration) 按实际重叠时长分摊到edges划分的各个桶中
+
+    返回长度为len(edges)-1的数组，第k个值为所有区间落在 [edges[k], edges[k+1]) 内的总秒数。
+    做法是计算累计覆盖函数 F(x) = sum(clip(x - start, 0, duration)) 在各边界上的值再差分：
+    对排序后的开始/结束时间做前缀和，每个边界只需一次searchsorted，整体 O((n + m) log n)，
+    不需要逐条展开区间
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    if len(starts) == 0:
+        return np.zeros(len(edges) - 1)
+
+    # 以第一个边界为原点，避免大时间戳做前缀和时损失精度
+    origin = edges[0]
+    x = edges - origin
+    begin = np.sort(starts - origin)
+    end = np.sort(starts + durations - origin)
+
+    begin_cumsum = np.concatenate(([0.0], np.cumsum(begin)))
+    end_cumsum = np.concatenate(([0.0], np.cumsum(end)))
+
+    begun = np.searchsorted(begin, x, side="left")
+    ended = np.searchsorted(end, x, side="left")
+    covered = (begun * x - begin_cumsum[begun]) - (ended * x - end_cumsum[ended])
+    return np.diff(covered)
+
+
+def split_by_day_and_slot(starts: np.ndarray, durations: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    将区间分摊到 天 × 2小时时间段 的矩阵中，edges为day_edges返回的每日零点边界
+
+    返回形状为 (天数, 12) 的秒数矩阵，按行求和即每日时长，按列求和即各时间段时长
+    """
+    days = len(edges) - 1
+    slot_edges = (edges[:-1, None] + SECONDS_PER_SLOT * np.arange(len(TIME_SLOTS))).ravel()
+    # 夏令时切换日的时间段边界可能越过次日零点，截断以保证边界单调
+    slot_edges = np.minimum(slot_edges, np.repeat(edges[1:], len(TIME_SLOTS)))
+    slot_edges = np.append(slot_edges, edges[-1])
+    return split_intervals(starts, durations, slot_edges).reshape(days, len(TIME_SLOTS))
+
+
+def count_by_slot(starts: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """按开始时间所在的2小时时间段统计使用次数，edges为day_edges返回的每日零点边界"""
+    days = len(edges) - 1
+    day_index = np.searchsorted(edges, starts, side="right") - 1
+    in_window = (day_index >= 0) & (day_index < days)
+    day_index = day_index[in_window]
+    # 夏令时切换日可能超过24小时，截断到最后一个时间段
+    slot_index = np.minimum((starts[in_window] - edges[day_index]) // SECONDS_PER_SLOT,
+                            len(TIME_SLOTS) - 1).astype(np.intp)
+    return np.bincount(slot_index, minlength=len(TIME_SLOTS))
+
+
+def day_hour_matrix(hour_starts: Sequence[datetime], values: Sequence[float], first_day: datetime,
+                    days: int) -> np.ndarray:
+    """
+    将整点小时的值填入 days × 24 的float32矩阵（第i行为first_day之后第i天，列为本地小时）
+
+    同一格出现多次时累加，窗口之外的值忽略
+    """
+    matrix = np.zeros((days, 24), dtype=np.float32)
+    if len(hour_starts) == 0:
+        return matrix
+    first_ordinal = first_day.toordinal()
+    day_index = np.fromiter((t.toordinal() - first_ordinal for t in hour_starts), dtype=np.int64, count=len(hour_starts))
+    hour_index = np.fromiter((t.hour for t in hour_starts), dtype=np.int64, count=len(hour_starts))
+    inside = (day_index >= 0) & (day_index < days)
+    np.add.at(matrix, (day_index[inside], hour_index[inside]), np.asarray(values, dtype=np.float32)[inside])
+    return matrix
+
+
+def bucket_weekly_usage(starts: np.ndarray, durations: np.ndarray, now: datetime = None,
+                        days: int = 49) -> Dict[str, List]:
+    """
+    一次向量化计算设备在过去days天内的按天、按自然周（周一开始）和每2小时时间段的使用时长
+
+    starts为开始时间戳（秒），durations为使用时长（秒），返回值中的时长单位为小时。
+    调用方应从窗口起点前MAX_SESSION_SECONDS开始取数据，以包含跨入窗口的会话
+    """
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = today - timedelta(days=days - 1)
+    edges = day_edges(first_day, days)
+
+    # 使用时长按实际重叠部分分摊到 天 × 时间段，跨零点、跨时间段的会话不再全部计入开始时刻
+    day_slot_seconds = split_by_day_and_slot(starts, durations, edges)
+    daily_seconds = day_slot_seconds.sum(axis=1)
+    slot_seconds = day_slot_seconds.sum(axis=0)
+
+    # 天 -> 自然周：按第一天的星期几对齐后整除7
+    week_of_day = (np.arange(days) + first_day.weekday()) // 7
+    weekly_seconds = np.bincount(week_of_day, weights=daily_seconds)
+
+    # 使用次数仍按开始时间所在的时间段计数
+    slot_counts = count_by_slot(starts, edges)
+
+    daily_labels = [(today - timedelta(days=i)).strftime('%m-%d') for i in range(6, -1, -1)]
+
+    this_week_start = today - timedelta(days=today.weekday())
+    weekly_labels = []
+    for i in range(6, -1, -1):
+        week_start = this_week_start - timedelta(weeks=i)
+        week_end = week_start + timedelta(days=6)
+        weekly_labels.append(f"{week_start.strftime('%m-%d')}~{week_end.strftime('%m-%d')}")
+
+    return {
+        "daily_data": (daily_seconds[-7:] / 3600).tolist(),
+        "daily_labels": daily_labels,
+        "weekly_data": (weekly_seconds[-7:] / 3600).tolist(),
+        "weekly_labels": weekly_labels,
+        "time_slots": list(TIME_SLOTS),
+        "slot_hours": (slot_seconds / 3600).tolist(),
+        "slot_counts": slot_counts.tolist(),
+    }
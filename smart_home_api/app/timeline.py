@@ -0,0 +1,99 @@
+"""
+房屋活动时间线
+
+使用记录、反馈、安全事件各自按 (时间, ID) 倒序、通过索引分块读取，merge_timeline 用堆（heapq.merge）
+做k路归并，排序键为 (时间, 类型, ID)。分页用键集游标（上一页最后一条的排序键），不使用OFFSET；
+每个来源按需读取：首块约为页大小平均分给各来源，之后每块翻倍，且不超过本页还需要的条数，
+因此一页最多从每个来源多读一条
+"""
+import base64
+import heapq
+import json
+import math
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# fetch(before_time, before_id, n) 返回排序键小于边界的最多n行 [(时间, ID, 对象)]，按 (时间, ID) 倒序；
+# before_id为None时边界包含before_time本身，before_time为None时不设边界
+Fetch = Callable[[Optional[datetime], Optional[str], int], List[Tuple[datetime, str, Any]]]
+SortKey = Tuple[datetime, str, str]
+
+
+def encode_cursor(key: SortKey) -> str:
+    time, kind, item_id = key
+    raw = json.dumps([time.isoformat(), kind, item_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> SortKey:
+    """无效游标抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        time, kind, item_id = json.loads(raw)
+        return datetime.fromisoformat(time), str(kind), str(item_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _start_bound(kind: str, cursor: Optional[SortKey]) -> Tuple[Optional[datetime], Optional[str]]:
+    """把全局游标换算成该来源内部的 (时间, ID) 边界"""
+    if cursor is None:
+        return None, None
+    time, cursor_kind, item_id = cursor
+    if kind < cursor_kind:
+        return time, None  # 同一时间的该类记录排在游标之后
+    if kind == cursor_kind:
+        return time, item_id
+    return time, ""  # 同一时间的该类记录已在之前的页中
+
+
+class _Source:
+    def __init__(self, kind: str, fetch: Fetch, cursor: Optional[SortKey], first_chunk: int):
+        self.kind = kind
+        self.fetch = fetch
+        self.bound = _start_bound(kind, cursor)
+        self.chunk = first_chunk
+        self.rows_read = 0
+
+    def rows(self, remaining: Callable[[], int]) -> Iterator[Tuple[SortKey, Any]]:
+        while True:
+            size = min(self.chunk, remaining())
+            if size <= 0:
+                return
+            rows = self.fetch(self.bound[0], self.bound[1], size)
+            self.rows_read += len(rows)
+            for time, item_id, obj in rows:
+                yield (time, self.kind, item_id), obj
+            if len(rows) < size:
+                return
+            self.bound = (rows[-1][0], rows[-1][1])
+            self.chunk *= 2
+
+
+def merge_timeline(fetchers: Dict[str, Fetch], limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    归并各来源，返回一页 {"items": [(排序键, 对象)], "next_cursor", "has_more", "rows_read"}
+
+    rows_read 为各来源本次读取的行数
+    """
+    start = decode_cursor(cursor) if cursor else None
+    need = limit + 1  # 多取一条判断是否还有下一页
+    first_chunk = math.ceil(need / max(len(fetchers), 1)) + 1
+    sources = [_Source(kind, fetch, start, first_chunk) for kind, fetch in fetchers.items()]
+
+    items: List[Tuple[SortKey, Any]] = []
+    remaining = lambda: need - len(items)
+    merged = heapq.merge(*(source.rows(remaining) for source in sources), key=lambda row: row[0], reverse=True)
+    for row in merged:
+        items.append(row)
+        if len(items) >= need:
+            break
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    return {
+        "items": items,
+        "next_cursor": encode_cursor(items[-1][0]) if has_more else None,
+        "has_more": has_more,
+        "rows_read": {source.kind: source.rows_read for source in sources},
+    }
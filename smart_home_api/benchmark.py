@@ -0,0 +1,258 @@
+# benchmark.py - 分析接口性能基准测试
+#
+# 使用独立的临时SQLite数据库，不会连接或写入.env中配置的数据库
+# 运行: python benchmark.py
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# 只在主进程中创建临时库：spawn启动的工作进程会以__mp_main__重新导入本文件，
+# 并从环境变量继承主进程设置的DATABASE_URL
+if __name__ == "__main__":
+    os.environ["DATABASE_URL"] = os.getenv("BENCHMARK_DATABASE_URL") or "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="smart_home_bench_"), "benchmark.db"
+    )
+
+from app import crud, models
+from app.database import engine, SessionLocal
+from app.parallel import parallel_area_usage_correlation, parallel_device_type_correlation
+from app.time_buckets import bucket_weekly_usage, split_intervals
+
+BENCH_TABLES = [
+    models.User.__table__,
+    models.Home.__table__,
+    models.UserHomeRelation.__table__,
+    models.Device.__table__,
+    models.DeviceUsageLog.__table__,
+    models.DeviceFeedback.__table__,
+    models.SecurityEvent.__table__,
+    models.DeviceCooccurrenceDaily.__table__,
+    models.DeviceUsageHourly.__table__,
+]
+
+
+def _timeit(fn, repeat: int = 5):
+    """返回多次运行中的最短耗时（毫秒）和最后一次的结果"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def _random_sessions(rng, n: int, days: int = 49):
+    """生成n条落在最近days天窗口内的随机使用记录（开始时间戳和时长，单位秒）"""
+    now = datetime.now()
+    window_start = (now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)).timestamp()
+    starts = np.sort(rng.uniform(window_start, now.timestamp(), n))
+    durations = rng.uniform(60, 3 * 3600, n).round(2)
+    return starts, durations
+
+
+def _legacy_weekly_usage(records, now: datetime):
+    """旧实现：按天、按周各扫描7次全部记录，整段时长计入开始时刻所在的桶，用作对照"""
+    daily = []
+    for i in range(6, -1, -1):
+        target_date = (now - timedelta(days=i)).date()
+        daily.append(sum(r["duration"] for r in records if r["start_time"].date() == target_date) / 3600)
+
+    weekly = []
+    for i in range(6, -1, -1):
+        week_start = (now - timedelta(weeks=i)).replace(hour=0, minute=0, second=0, microsecond=0)
+        week_start = week_start - timedelta(days=week_start.weekday())
+        week_end = week_start + timedelta(days=7)
+        weekly.append(sum(r["duration"] for r in records if week_start <= r["start_time"] < week_end) / 3600)
+
+    slots = [0.0] * 12
+    for r in records:
+        slots[r["start_time"].hour // 2] += r["duration"] / 3600
+    return daily, weekly, slots
+
+
+def bench_weekly_bucketing(rows: int = 100_000):
+    """设备7天/7周/时间段分桶：旧的逐条循环 vs 单次向量化分桶"""
+    print(f"\n📊 周/时间段分桶 ({rows:,} 条记录)")
+    print("-" * 50)
+
+    rng = np.random.default_rng(42)
+    starts, durations = _random_sessions(rng, rows)
+    now = datetime.now()
+    records = [
+        {"start_time": datetime.fromtimestamp(s), "duration": d}
+        for s, d in zip(starts.tolist(), durations.tolist())
+    ]
+
+    legacy_ms, _ = _timeit(lambda: _legacy_weekly_usage(records, now), repeat=1)
+    vector_ms, buckets = _timeit(lambda: bucket_weekly_usage(starts, durations, now=now))
+
+    # 按重叠分摊后总时长守恒（超出明天零点的部分不计入）
+    window_end = (now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+    assert np.isclose(sum(buckets["slot_hours"]) * 3600, (np.minimum(starts + durations, window_end) - starts).sum())
+
+    print(f"   旧实现 (Python循环):  {legacy_ms:10.1f} ms")
+    print(f"   向量化分桶:           {vector_ms:10.1f} ms  ({legacy_ms / vector_ms:.0f}x)")
+
+
+def bench_interval_split(intervals: int = 2_000_000):
+    """区间按小时分摊的吞吐量（一年的小时桶）"""
+    print(f"\n📊 区间分摊到小时桶 ({intervals:,} 个区间)")
+    print("-" * 50)
+
+    rng = np.random.default_rng(3)
+    now = datetime.now().timestamp()
+    starts = rng.uniform(now - 365 * 86400, now, intervals)
+    durations = rng.uniform(0, 10000, intervals)
+    edges = np.arange(now - 366 * 86400, now + 86400, 3600.0)
+
+    split_ms, _ = _timeit(lambda: split_intervals(starts, durations, edges), repeat=3)
+    print(f"   分摊耗时:             {split_ms:10.1f} ms  ({intervals / split_ms / 1000:.1f} M区间/秒)")
+
+
+def _seed_device(db, home_id: str, device_id: str, rows: int, rng):
+    """写入一个房屋、一个设备及其rows条使用记录"""
+    db.add(models.Home(home_id=home_id, area_sqm=100.0, address=f"{home_id} 测试地址"))
+    db.add(models.Device(device_id=device_id, device_type="空调", name=f"空调{device_id}",
+                         home_id=home_id, room_name="客厅"))
+    starts, durations = _random_sessions(rng, rows)
+    db.bulk_insert_mappings(models.DeviceUsageLog, [
+        {
+            "usage_id": f"{device_id}-r{i:07d}",
+            "device_id": device_id,
+            "start_time": datetime.fromtimestamp(s),
+            "duration_seconds": d,
+        }
+        for i, (s, d) in enumerate(zip(starts.tolist(), durations.tolist()))
+    ])
+    db.commit()
+
+
+def bench_weekly_usage_query(rows: int = 100_000):
+    """从数据库读取49天窗口的两列数据并分桶的端到端耗时"""
+    print(f"\n📊 周使用分析端到端 (单设备 {rows:,} 条记录)")
+    print("-" * 50)
+
+    rng = np.random.default_rng(7)
+    db = SessionLocal()
+    try:
+        _seed_device(db, "home900001", "d900001", rows, rng)
+
+        now = datetime.now()
+        window_start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=48)
+
+        load_ms, (starts, durations) = _timeit(
+            lambda: crud.get_device_usage_arrays(db, device_id="d900001", start_time=window_start)
+        )
+        bucket_ms, _ = _timeit(lambda: bucket_weekly_usage(starts, durations, now=now))
+
+        print(f"   读取列数组:           {load_ms:10.1f} ms  ({len(starts):,} 行)")
+        print(f"   分桶:                 {bucket_ms:10.1f} ms")
+    finally:
+        db.close()
+
+
+def bench_usage_heatmap(rows: int = 50_000):
+    """一年的 天 × 小时 热力图：从小时汇总表读取并填充矩阵"""
+    print(f"\n📊 年度使用热力图 (单设备 {rows:,} 条记录)")
+    print("-" * 50)
+
+    rng = np.random.default_rng(5)
+    db = SessionLocal()
+    try:
+        db.add(models.Home(home_id="home900002", area_sqm=100.0, address="home900002 测试地址"))
+        db.add(models.Device(device_id="d900002", device_type="空调", name="空调d900002",
+                             home_id="home900002", room_name="客厅"))
+        starts, durations = _random_sessions(rng, rows, days=365)
+        db.bulk_insert_mappings(models.DeviceUsageLog, [
+            {"usage_id": f"d900002-r{i:07d}", "device_id": "d900002",
+             "start_time": datetime.fromtimestamp(s), "duration_seconds": d}
+            for i, (s, d) in enumerate(zip(starts.tolist(), durations.tolist()))
+        ])
+        db.commit()
+        crud.rebuild_usage_rollup(db, device_id="d900002")
+
+        device_ms, heatmap = _timeit(lambda: crud.get_usage_heatmap.uncached(db, "home900002", device_id="d900002"))
+        home_ms, _ = _timeit(lambda: crud.get_usage_heatmap.uncached(db, "home900002"))
+        pack_ms, packed = _timeit(lambda: heatmap["matrix"].astype("<f4").tobytes())
+
+        print(f"   设备热力图 (365×24):  {device_ms:10.1f} ms")
+        print(f"   房屋热力图 (365×24):  {home_ms:10.1f} ms")
+        print(f"   打包float32:          {pack_ms:10.3f} ms  ({len(packed):,} 字节)")
+    finally:
+        db.close()
+
+
+def _seed_homes(db, homes: int, devices_per_home: int, rows_per_device: int, rng):
+    """写入homes个房屋，每个房屋若干不同类型的设备和使用记录"""
+    device_types = ["空调", "灯", "电视", "洗衣机", "冰箱"]
+    db.bulk_insert_mappings(models.Home, [
+        {"home_id": f"home{h:06d}", "area_sqm": float(rng.uniform(40, 300)), "address": f"测试地址{h}"}
+        for h in range(homes)
+    ])
+    db.bulk_insert_mappings(models.Device, [
+        {"device_id": f"d{h:05d}{d:02d}", "device_type": device_types[d % len(device_types)],
+         "name": f"设备{d}", "home_id": f"home{h:06d}", "room_name": "客厅"}
+        for h in range(homes) for d in range(devices_per_home)
+    ])
+    logs = []
+    for h in range(homes):
+        for d in range(devices_per_home):
+            device_id = f"d{h:05d}{d:02d}"
+            starts, durations = _random_sessions(rng, rows_per_device, days=30)
+            logs.extend(
+                {"usage_id": f"{device_id}-{i:05d}", "device_id": device_id,
+                 "start_time": datetime.fromtimestamp(start), "duration_seconds": duration}
+                for i, (start, duration) in enumerate(zip(starts.tolist(), durations.tolist()))
+            )
+    db.bulk_insert_mappings(models.DeviceUsageLog, logs)
+    db.commit()
+    crud.rebuild_device_cooccurrence(db)
+
+
+def bench_parallel_system_analytics(homes: int = 2000):
+    """系统级分析按房屋分片多进程并行：不同进程数下的耗时与加速比"""
+    print(f"\n📊 系统级分析多进程并行 ({homes:,} 个房屋，CPU核数 {os.cpu_count()})")
+    print("-" * 50)
+
+    rng = np.random.default_rng(11)
+    db = SessionLocal()
+    try:
+        _seed_homes(db, homes, devices_per_home=5, rows_per_device=40, rng=rng)
+        serial_ms, expected = _timeit(lambda: crud.get_area_usage_correlation.uncached(db, "空调"), repeat=3)
+    finally:
+        db.close()
+    print(f"   单线程查询 (面积关联):   {serial_ms:10.1f} ms")
+
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    baseline = None
+    for workers in worker_counts:
+        area_ms, points = _timeit(lambda: parallel_area_usage_correlation("空调", workers=workers), repeat=3)
+        type_ms, _ = _timeit(lambda: parallel_device_type_correlation(workers=workers), repeat=3)
+        assert len(points) == len(expected)
+        baseline = baseline or area_ms + type_ms
+        print(f"   {workers:2d} 进程: 面积关联 {area_ms:8.1f} ms, 类型关联 {type_ms:8.1f} ms"
+              f"  (加速 {baseline / (area_ms + type_ms):.2f}x)")
+
+
+BENCHMARKS = {
+    "weekly-bucketing": bench_weekly_bucketing,
+    "weekly-usage-query": bench_weekly_usage_query,
+    "interval-split": bench_interval_split,
+    "parallel-system-analytics": bench_parallel_system_analytics,
+    "usage-heatmap": bench_usage_heatmap,
+}
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=engine, tables=BENCH_TABLES)
+
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    print("🚀 Smart Home API 性能基准")
+    print("=" * 50)
+    for name in selected:
+        BENCHMARKS[name]()
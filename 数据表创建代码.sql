@@ -36,6 +36,8 @@ CREATE TABLE device_usage_log (
     device_id VARCHAR,
     start_time TIMESTAMPTZ,
     duration_seconds NUMERIC(6,2),
+    duration_zscore DOUBLE PRECISION,
+    is_anomaly BOOLEAN DEFAULT FALSE,
     FOREIGN KEY (device_id) REFERENCES device(device_id)
 );
 
@@ -57,4 +59,131 @@ CREATE TABLE security_event (
     device_id VARCHAR,
     FOREIGN KEY (home_id) REFERENCES home(home_id),
     FOREIGN KEY (device_id) REFERENCES device(device_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE alerts (
+    alert_id VARCHAR PRIMARY KEY,
+    home_id VARCHAR,
+    device_id VARCHAR,
+    alert_type VARCHAR,
+    message VARCHAR,
+    severity VARCHAR DEFAULT 'medium' CHECK (severity IN ('low', 'medium', 'high')),
+    resolved BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP,
+    resolved_at TIMESTAMP,
+    FOREIGN KEY (home_id) REFERENCES home(home_id),
+    FOREIGN KEY (device_id) REFERENCES device(device_id)
+);
+
+-- Rollup tables
+CREATE TABLE device_usage_hourly (
+    device_id VARCHAR,
+    hour_start TIMESTAMP,
+    usage_seconds FLOAT,
+    session_count INTEGER,
+    PRIMARY KEY (device_id, hour_start),
+    FOREIGN KEY (device_id) REFERENCES device(device_id)
+);
+
+CREATE TABLE device_cooccurrence_daily (
+    home_id VARCHAR,
+    day DATE,
+    device1 VARCHAR,
+    device2 VARCHAR,
+    window_count INTEGER,
+    PRIMARY KEY (home_id, day, device1, device2),
+    FOREIGN KEY (home_id) REFERENCES home(home_id),
+    FOREIGN KEY (device1) REFERENCES device(device_id),
+    FOREIGN KEY (device2) REFERENCES device(device_id)
+);
+
+CREATE TABLE device_duration_stats (
+    device_id VARCHAR PRIMARY KEY,
+    session_count INTEGER NOT NULL DEFAULT 0,
+    mean_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+    min_seconds DOUBLE PRECISION,
+    max_seconds DOUBLE PRECISION,
+    FOREIGN KEY (device_id) REFERENCES device(device_id)
+);
+
+CREATE TABLE device_duration_digest (
+    device_id VARCHAR,
+    day DATE,
+    session_count INTEGER,
+    digest JSON NOT NULL,
+    PRIMARY KEY (device_id, day),
+    FOREIGN KEY (device_id) REFERENCES device(device_id)
+);
+
+CREATE TABLE daily_activity_sketch (
+    day DATE,
+    device_type VARCHAR,
+    device_registers BYTEA NOT NULL,
+    home_registers BYTEA NOT NULL,
+    PRIMARY KEY (day, device_type)
+);
+
+CREATE TABLE daily_activity_member (
+    day DATE,
+    device_type VARCHAR,
+    device_id VARCHAR,
+    home_id VARCHAR,
+    PRIMARY KEY (day, device_type, device_id)
+);
+
+CREATE TABLE device_usage_anomaly (
+    device_id VARCHAR,
+    day DATE,
+    home_id VARCHAR,
+    usage_hours DOUBLE PRECISION NOT NULL,
+    baseline_median_hours DOUBLE PRECISION NOT NULL,
+    baseline_mad_hours DOUBLE PRECISION NOT NULL,
+    robust_zscore DOUBLE PRECISION NOT NULL,
+    direction VARCHAR(10) NOT NULL CHECK (direction IN ('spike', 'drop')),
+    detected_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (device_id, day),
+    FOREIGN KEY (device_id) REFERENCES device(device_id)
+);
+
+CREATE TABLE derived_backfill (
+    step VARCHAR(50) PRIMARY KEY,
+    completed_at TIMESTAMP NOT NULL
+);
+
+-- Change log (outbox for delta sync)
+CREATE TABLE change_log (
+    change_id BIGSERIAL PRIMARY KEY,
+    sync_seq BIGINT UNIQUE,
+    entity VARCHAR(50) NOT NULL,
+    entity_id VARCHAR NOT NULL,
+    home_id VARCHAR,
+    operation VARCHAR(10) NOT NULL CHECK (operation IN ('insert', 'update', 'delete')),
+    payload JSON,
+    changed_at TIMESTAMP NOT NULL
+);
+
+-- Precomputed analytics (persistent cache)
+CREATE TABLE analytics_cache (
+    cache_key VARCHAR(40) PRIMARY KEY,
+    function_name VARCHAR(100) NOT NULL,
+    home_id VARCHAR,
+    result JSON NOT NULL,
+    computed_at TIMESTAMP NOT NULL,
+    data_version BIGINT
+);
+
+CREATE TABLE analytics_version (
+    home_id VARCHAR PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Indexes
+CREATE INDEX ix_device_usage_log_device_start ON device_usage_log (device_id, start_time);
+CREATE INDEX ix_analytics_cache_home_id ON analytics_cache (home_id);
+CREATE INDEX ix_device_usage_anomaly_home_id ON device_usage_anomaly (home_id);
+CREATE INDEX ix_alerts_home_id ON alerts (home_id);
+CREATE INDEX ix_change_log_home_id ON change_log (home_id, sync_seq);
+CREATE INDEX ix_change_log_unsequenced ON change_log (change_id) WHERE sync_seq IS NULL;
+CREATE INDEX ix_device_feedback_device_submit ON device_feedback (device_id, submit_time);
+CREATE INDEX ix_security_event_home_time ON security_event (home_id, event_time);